@@ -0,0 +1 @@
+""" Offline benchmarks for the map service clients: run each suite with python -m benchmarks.<suite> --help """
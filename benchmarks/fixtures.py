@@ -0,0 +1,185 @@
+""" Routes serving the test fixtures for each kind of service, and synthetic services scaled up from them """
+import copy
+import json
+import pathlib
+import re
+
+from .transport import route
+
+
+FIXTURES_DIRECTORY = pathlib.Path(__file__).parent.parent / "clients" / "tests" / "data"
+
+XML_CONTENT_TYPE = "text/xml"
+SCIENCEBASE_URL = "https://www.sciencebase.gov"
+
+_WMS_LEAF_LAYER = re.compile(
+    r"(?P<open><Layer\b[^>]*>\s*<Name>)(?P<name>[^<]+)(?P<rest></Name>(?:(?!<Layer\b).)*?</Layer>)",
+    re.S,
+)
+
+
+def read_fixture(path):
+    return (FIXTURES_DIRECTORY / path).read_text()
+
+
+def read_json_fixture(path):
+    return json.loads(read_fixture(path))
+
+
+def get_arcgis_routes(service_url, num_layers=None, tiled=True):
+    """
+    :param service_url: the MapServer URL, without query parameters
+    :param num_layers: if provided, the layers of the service fixtures are repeated to this number
+    :param tiled: if False, the service has no tile info, so images are exported rather than tiled
+    """
+
+    service = read_json_fixture("arcgis/map.json")
+    layers = read_json_fixture("arcgis/map-layers.json")
+    legend = read_json_fixture("arcgis/map-legend.json")
+
+    if not tiled:
+        service.pop("tileInfo")
+
+    if num_layers:
+        service, layers, legend = scale_arcgis_service(
+            service, layers, legend, num_layers
+        )
+
+    path = re.escape(service_url.split("//", 1)[-1].rstrip("/"))
+    return [
+        route(f"{path}/layers/?\\?", json.dumps(layers)),
+        route(f"{path}/legend/?\\?", json.dumps(legend)),
+        route(f"{path}/?\\?", json.dumps(service)),
+    ]
+
+
+def get_feature_layer_routes(layer_url):
+    path = re.escape(layer_url.split("//", 1)[-1].rstrip("/"))
+    return [route(f"{path}/?\\?", read_fixture("arcgis/feature-layer.json"))]
+
+
+def get_wms_routes(service_url, fixture="wms/demo-wms-max.xml", num_layers=None):
+    """
+    :param service_url: the WMS URL, without query parameters
+    :param num_layers: if provided, the leaf layers of the capabilities are repeated to this number
+    """
+
+    capabilities = read_fixture(fixture)
+    if num_layers:
+        capabilities = scale_wms_capabilities(capabilities, num_layers)
+
+    path = re.escape(service_url.split("//", 1)[-1])
+    return [
+        route(f"{path}\\?.*item=layerDetails", read_fixture("wms/ncwms-layer.json")),
+        route(f"{path}\\?.*request=GetCapabilities", capabilities, XML_CONTENT_TYPE),
+    ]
+
+
+def get_thredds_routes(base_url, service_path, dataset_path):
+    """ :return: routes for the catalog, ISO metadata, WMS capabilities, layer menu and layer details """
+
+    path = re.escape(base_url.split("//", 1)[-1])
+    wms_path = f"{path}/wms/{re.escape(dataset_path)}"
+
+    return [
+        route(
+            f"{path}/catalog/{re.escape(service_path)}/catalog\\.xml",
+            read_fixture("thredds/thredds-catalog.xml"),
+            XML_CONTENT_TYPE,
+        ),
+        route(
+            f"{path}/iso/",
+            read_fixture("thredds/thredds-metadata.xml"),
+            XML_CONTENT_TYPE,
+        ),
+        route(f"{path}/fileServer/", b"", "application/x-netcdf"),
+        route(f"{wms_path}\\?.*item=menu", read_fixture("thredds/thredds-layers.json")),
+        route(
+            f"{wms_path}\\?.*item=layerDetails",
+            read_fixture("thredds/thredds-layer.json"),
+        ),
+        route(
+            f"{wms_path}\\?.*request=GetCapabilities",
+            read_fixture("thredds/thredds-wms.xml"),
+            XML_CONTENT_TYPE,
+        ),
+    ]
+
+
+def get_sciencebase_routes(item_url, service_type, base_url=SCIENCEBASE_URL):
+    """
+    :param item_url: the URL of the ScienceBase item, without query parameters
+    :param service_type: "arcgis" or "wms", for the kind of service backing the item
+    :param base_url: the URL at which the services linked from the item are served
+    """
+
+    item_path = re.escape(item_url.split("//", 1)[-1].rstrip("/"))
+    item = read_fixture(f"sciencebase/{service_type}-item.json")
+    item = item.replace(SCIENCEBASE_URL, base_url)
+
+    base_path = re.escape(base_url.split("//", 1)[-1])
+
+    if service_type == "wms":
+        return [
+            route(f"{item_path}/?\\?", item),
+            route(
+                f"{base_path}/catalogMaps/mapping/ows/wms\\?.*request=getcapabilities",
+                read_fixture("sciencebase/wms-service.xml"),
+                XML_CONTENT_TYPE,
+            ),
+        ]
+
+    service_path = f"{base_path}/arcgis/rest/services/Catalog/service/MapServer"
+    return [
+        route(f"{item_path}/?\\?", item),
+        route(
+            f"{service_path}/layers/?\\?",
+            read_fixture("sciencebase/arcgis-service-layers.json"),
+        ),
+        route(
+            f"{service_path}/legend/?\\?",
+            read_fixture("sciencebase/arcgis-service-legend.json"),
+        ),
+        route(f"{service_path}/?\\?", read_fixture("sciencebase/arcgis-service.json")),
+    ]
+
+
+def scale_arcgis_service(service, layers, legend, num_layers):
+    """ :return: copies of the service, layers and legend data, with flat layers repeated to the number given """
+
+    def repeat_layers(source, id_key):
+        repeated = []
+        for idx in range(num_layers):
+            layer = copy.deepcopy(source[idx % len(source)])
+            layer[id_key] = idx
+            if "name" in layer:
+                layer["name"] = f"{layer['name']} {idx}"
+            if "layerName" in layer:
+                layer["layerName"] = f"{layer['layerName']} {idx}"
+            repeated.append(layer)
+        return repeated
+
+    service = dict(service, layers=repeat_layers(service["layers"], "id"))
+    for layer in service["layers"]:
+        layer.update(parentLayerId=-1, subLayerIds=None)
+
+    layers = dict(layers, layers=repeat_layers(layers["layers"], "id"))
+    for layer in layers["layers"]:
+        layer.update(parentLayer=None, subLayers=[])
+
+    legend = dict(legend, layers=repeat_layers(legend["layers"], "layerId"))
+
+    return service, layers, legend
+
+
+def scale_wms_capabilities(capabilities, num_layers):
+    """ :return: the capabilities document, with its last leaf layer repeated until it has the number of leaf layers given """
+
+    leaf_layers = list(_WMS_LEAF_LAYER.finditer(capabilities))
+    last = leaf_layers[-1]
+
+    copies = "".join(
+        f"{last['open']}{last['name']}_{idx}{last['rest']}"
+        for idx in range(num_layers - len(leaf_layers))
+    )
+    return capabilities[: last.end()] + copies + capabilities[last.end() :]
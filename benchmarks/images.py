@@ -0,0 +1,214 @@
+"""
+Benchmarks the image utilities and the ArcGIS tile mosaic over generated images, from single tiles to print exports.
+Throughput is reported in megapixels per second. Run with: python -m benchmarks.images [--help]
+"""
+from functools import partial
+
+from PIL import Image, ImageDraw
+
+from clients.arcgis import MapServerResource
+from clients.utils.geometry import Extent
+from clients.utils.images import ENCODING_PROFILES, count_colors, encode_image
+from clients.utils.images import image_to_base64, image_to_bytes
+from clients.utils.images import make_color_transparent, overlay_images
+from clients.utils.images import stack_images_vertically
+from clients.utils.profiling import collect_timings
+
+from .fixtures import get_arcgis_routes
+from .transport import route, stub_transport
+from .utils import measure, run_suite
+
+
+IMAGE_MODES = ("RGB", "RGBA", "P")
+IMAGE_SIZES = {"tile": (256, 256), "screen": (1024, 768), "print": (4096, 4096)}
+
+LINE_COLOR = (64, 64, 64)
+LINE_SPACING = 32  # Pixels between the lines drawn over generated images
+
+NUM_LAYERS = 4  # Images overlaid or stacked for each result
+PRINT_REPEAT = 1  # Most repetitions for print sizes, which take seconds each
+
+MAP_URL = "https://arcgis.test/arcgis/rest/services/Tiled/MapServer"
+MOSAIC_SIZES = ("screen", "print")
+
+
+def generate_image(size, mode="RGBA"):
+    """
+    :return: an image of gradients crossed by grid lines, which compresses roughly like a rendered map.
+    RGBA images are transparent where the radial gradient is lightest, and P images have 64 colors.
+    """
+
+    red = Image.linear_gradient("L").resize(size)
+    green = Image.radial_gradient("L").resize(size)
+    blue = red.transpose(Image.Transpose.FLIP_TOP_BOTTOM)
+
+    image = Image.merge("RGB", (red, green, blue))
+
+    draw = ImageDraw.Draw(image)
+    for x in range(0, size[0], LINE_SPACING):
+        draw.line((x, 0, x, size[1]), fill=LINE_COLOR)
+    for y in range(0, size[1], LINE_SPACING):
+        draw.line((0, y, size[0], y), fill=LINE_COLOR)
+
+    if mode == "RGBA":
+        image.putalpha(green.point(lambda v: 0 if v > 192 else 255))
+    elif mode == "P":
+        image = image.quantize(colors=64)
+
+    return image
+
+
+def benchmark_image(func, repeat, size, max_repeat=None):
+    """
+    Measures the function, adding throughput for the number of pixels in the size given,
+    and the average number of images and image memory blocks allocated by each call.
+    """
+
+    repeat = min(repeat, max_repeat or repeat)
+
+    before = Image.core.get_stats()
+    result = measure(func, repeat)
+    after = Image.core.get_stats()
+
+    calls = repeat + 2  # Including warm up and traced calls
+    for stat, key in (("new_count", "images"), ("allocated_blocks", "image_blocks")):
+        result[key] = (after[stat] - before[stat]) / calls
+
+    megapixels = size[0] * size[1] / 1e6
+    result["megapixels"] = megapixels
+    result["megapixels_per_second"] = megapixels / result["median"]
+
+    return result
+
+
+def benchmark_operation(operation, size, mode, repeat, num_images=1, max_repeat=None):
+    """ Measures the operation on a list of images generated only when the benchmark runs """
+
+    images = [generate_image(size, mode) for _ in range(num_images)]
+    return benchmark_image(partial(operation, images), repeat, size, max_repeat)
+
+
+def benchmark_mosaic(size, repeat, max_repeat=None):
+    """ Measures get_image for a tiled map service, with tiles served by a stub transport """
+
+    tile = image_to_bytes(generate_image((256, 256)), "PNG")
+    routes = [route(r"/MapServer/tile/\d+/\d+/\d+", tile, "image/png")]
+    routes.extend(get_arcgis_routes(MAP_URL))
+
+    with stub_transport(routes):
+        client = MapServerResource.get(MAP_URL, lazy=False)
+        extent = get_tiled_extent(client, *size)
+
+        render = partial(client.get_image, extent, *size)
+        result = benchmark_image(render, repeat, size, max_repeat)
+
+        with collect_timings() as timings:
+            render()
+
+    result["phases"] = timings.as_dict()["phases"]
+    return result
+
+
+def get_tiled_extent(client, width, height):
+    """ :return: an extent of the given size in pixels, centered in the service, at the finest zoom level it fits """
+
+    full_extent = client.full_extent
+    full_width = full_extent.xmax - full_extent.xmin
+    full_height = full_extent.ymax - full_extent.ymin
+
+    resolution = max(
+        lod.resolution
+        for lod in client.tile_info.lods
+        if lod.resolution * width <= full_width
+        and lod.resolution * height <= full_height
+    )
+
+    x = full_extent.xmin + full_width / 2
+    y = full_extent.ymin + full_height / 2
+
+    return Extent(
+        {
+            "xmin": x - width * resolution / 2,
+            "ymin": y - height * resolution / 2,
+            "xmax": x + width * resolution / 2,
+            "ymax": y + height * resolution / 2,
+            "spatial_reference": {"wkid": 3857},
+        }
+    )
+
+
+def get_cases():
+    """ :return: a function of the number of repetitions for each named benchmark """
+
+    operations = {
+        "overlay_images": (overlay_images, NUM_LAYERS),
+        "make_color_transparent": (
+            lambda images: make_color_transparent(images[0], LINE_COLOR),
+            1,
+        ),
+        "count_colors": (lambda images: count_colors(images[0]), 1),
+        "image_to_bytes.png": (lambda images: image_to_bytes(images[0], "PNG"), 1),
+        "image_to_base64.png": (lambda images: image_to_base64(images[0], "PNG"), 1),
+    }
+    for profile in ENCODING_PROFILES:
+        to_bytes = partial(image_to_bytes, image_format="PNG", profile=profile)
+        to_raw_image = partial(encode_image, profile=profile)
+
+        operations[f"image_to_bytes.png_{profile}"] = (
+            lambda images, encode=to_bytes: encode(images[0]),
+            1,
+        )
+        operations[f"encode_image.{profile}"] = (
+            lambda images, encode=to_raw_image: encode(images[0]),
+            1,
+        )
+
+    cases = {}
+
+    for size_name, size in IMAGE_SIZES.items():
+        max_repeat = PRINT_REPEAT if size_name == "print" else None
+
+        for name, (operation, num_images) in operations.items():
+            for mode in IMAGE_MODES:
+                cases[f"{name}.{mode.lower()}.{size_name}"] = partial(
+                    benchmark_operation,
+                    operation,
+                    size,
+                    mode,
+                    num_images=num_images,
+                    max_repeat=max_repeat,
+                )
+
+        cases[f"image_to_bytes.jpeg.rgb.{size_name}"] = partial(
+            benchmark_operation,
+            lambda images: image_to_bytes(images[0], "JPEG", quality=75),
+            size,
+            "RGB",
+            max_repeat=max_repeat,
+        )
+        cases[f"stack_images_vertically.rgba.{size_name}"] = partial(
+            benchmark_image,
+            partial(stack_images_vertically, get_legend_images(size)),
+            size=size,
+            max_repeat=max_repeat,
+        )
+
+    for size_name in MOSAIC_SIZES:
+        max_repeat = PRINT_REPEAT if size_name == "print" else None
+        cases[f"tile_mosaic.{size_name}"] = partial(
+            benchmark_mosaic, IMAGE_SIZES[size_name], max_repeat=max_repeat
+        )
+
+    return cases
+
+
+def get_legend_images(size):
+    """ :return: images of decreasing width, which stack to the size given """
+    return [
+        generate_image((size[0] // (idx + 1), size[1] // NUM_LAYERS))
+        for idx in range(NUM_LAYERS)
+    ]
+
+
+if __name__ == "__main__":
+    run_suite("images", get_cases(), description=__doc__)
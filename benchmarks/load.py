@@ -0,0 +1,259 @@
+"""
+Drives concurrent load through the clients against the stub map server, or services at another URL serving the same paths.
+Reports latency histograms for each scenario and each service endpoint. Run with: python -m benchmarks.load [--help]
+"""
+import argparse
+import json
+import platform
+import statistics
+import sys
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from clients.arcgis import FeatureLayerResource, MapServerResource
+from clients.sciencebase import ScienceBaseResource
+from clients.thredds import ThreddsResource
+from clients.utils.geometry import Extent
+from clients.utils.metrics import LatencyHistogram, MetricsAggregator, instrumentation
+from clients.wms import WMSResource
+
+from .images import IMAGE_SIZES, get_tiled_extent
+from .server import StubMapServer, get_service_urls
+
+
+DEFAULT_CONCURRENCY = 8
+DEFAULT_DURATION = 10  # Seconds for which each scenario runs
+PERCENTILES = (50, 90, 99)
+
+IMAGE_SIZE = IMAGE_SIZES["screen"]
+
+
+def get_scenarios(service_urls):
+    """
+    :param service_urls: the URL of each kind of service, keyed as by get_service_urls
+    :return: a function preparing each named scenario, which returns the operation called repeatedly under load
+    """
+
+    def get_loader(resource_type, url):
+        return lambda: lambda: resource_type.get(url, lazy=False)
+
+    def prepare_tiled_image():
+        client = MapServerResource.get(service_urls["arcgis.tiled"], lazy=False)
+        extent = get_tiled_extent(client, *IMAGE_SIZE)
+        return lambda: client.get_image(extent, *IMAGE_SIZE)
+
+    def prepare_export_image():
+        client = MapServerResource.get(service_urls["arcgis.dynamic"], lazy=False)
+        extent = get_image_extent(client.full_extent, *IMAGE_SIZE)
+        return lambda: client.get_image(extent, *IMAGE_SIZE)
+
+    def prepare_feature_query():
+        client = FeatureLayerResource.get(service_urls["arcgis.feature_layer"])
+        return lambda: client.query(where="1=1", out_fields="*")
+
+    def prepare_wms_image():
+        client = WMSResource.get(service_urls["wms"], lazy=False)
+        extent = get_image_extent(client.full_extent, *IMAGE_SIZE)
+        layer_ids = list(client.leaf_layers)[:2]
+        return lambda: client.get_image(extent, *IMAGE_SIZE, layer_ids=layer_ids)
+
+    return {
+        "arcgis.get": get_loader(MapServerResource, service_urls["arcgis.tiled"]),
+        "arcgis.tiled_image": prepare_tiled_image,
+        "arcgis.export_image": prepare_export_image,
+        "arcgis.feature_query": prepare_feature_query,
+        "wms.get": get_loader(WMSResource, service_urls["wms"]),
+        "wms.get_image": prepare_wms_image,
+        "ncwms.get": get_loader(WMSResource, service_urls["ncwms"]),
+        "thredds.get": get_loader(ThreddsResource, service_urls["thredds"]),
+        "sciencebase.arcgis.get": get_loader(
+            ScienceBaseResource, service_urls["sciencebase.arcgis"]
+        ),
+        "sciencebase.wms.get": get_loader(
+            ScienceBaseResource, service_urls["sciencebase.wms"]
+        ),
+    }
+
+
+def get_image_extent(extent, width, height):
+    """ :return: a Web Mercator extent centered in the one given, with the aspect ratio of the image size """
+
+    extent = extent.project_to_web_mercator()
+    x = (extent.xmin + extent.xmax) / 2
+    y = (extent.ymin + extent.ymax) / 2
+    resolution = min(
+        (extent.xmax - extent.xmin) / width, (extent.ymax - extent.ymin) / height
+    )
+
+    return Extent(
+        {
+            "xmin": x - width * resolution / 2,
+            "ymin": y - height * resolution / 2,
+            "xmax": x + width * resolution / 2,
+            "ymax": y + height * resolution / 2,
+            "spatial_reference": {"wkid": 3857},
+        }
+    )
+
+
+def run_load(operation, concurrency=DEFAULT_CONCURRENCY, duration=DEFAULT_DURATION):
+    """
+    Calls the operation from each of a number of threads until the duration has passed.
+    :return: a dict with the number of calls, failures, throughput, latency percentiles and a latency histogram
+    """
+
+    histogram = LatencyHistogram()
+    latencies = []
+    errors = {}
+    lock = threading.Lock()
+
+    stop_time = time.perf_counter() + duration
+
+    def run_worker():
+        while time.perf_counter() < stop_time:
+            start = time.perf_counter()
+            try:
+                operation()
+            except Exception as ex:
+                error = type(ex).__name__
+            else:
+                error = None
+            latency = time.perf_counter() - start
+
+            with lock:
+                histogram.observe(latency)
+                latencies.append(latency)
+                if error:
+                    errors[error] = errors.get(error, 0) + 1
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        for future in [executor.submit(run_worker) for _ in range(concurrency)]:
+            future.result()
+    elapsed = time.perf_counter() - start_time
+
+    result = {
+        "concurrency": concurrency,
+        "duration": elapsed,
+        "calls": len(latencies),
+        "errors": errors,
+        "calls_per_second": len(latencies) / elapsed,
+        "latency": format_histogram(histogram.get_stats()),
+    }
+    if len(latencies) > 1:
+        quantiles = statistics.quantiles(latencies, n=100, method="inclusive")
+        result["percentiles"] = {p: quantiles[p - 1] for p in PERCENTILES}
+
+    return result
+
+
+def format_histogram(stats):
+    """ :return: histogram stats with bucket bounds as strings, so they can be written as JSON """
+    return dict(stats, buckets={str(k): v for k, v in stats["buckets"].items()})
+
+
+def format_request_stats(stats):
+    """ :return: request totals from a metrics aggregator, keyed by "service type/endpoint/status" """
+
+    return {
+        "/".join(str(part) for part in key): dict(
+            totals, latency=format_histogram(totals["latency"])
+        )
+        for key, totals in stats["requests"].items()
+    }
+
+
+def format_summary(name, result):
+    percentiles = result.get("percentiles", {})
+    latencies = " ".join(f"p{p} {percentiles[p] * 1000:.1f} ms" for p in percentiles)
+    errors = sum(result["errors"].values())
+
+    return (
+        f"{name}: {result['calls']} calls, {result['calls_per_second']:.1f}/s, "
+        f"{errors} errors, {latencies}"
+    )
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-k", "--filter", help="only run scenarios containing this text"
+    )
+    parser.add_argument(
+        "-c", "--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="threads"
+    )
+    parser.add_argument(
+        "-d",
+        "--duration",
+        type=float,
+        default=DEFAULT_DURATION,
+        help="seconds for each scenario",
+    )
+    parser.add_argument("-o", "--output", help="write results as JSON to this file")
+    parser.add_argument(
+        "-u", "--url", help="base URL of a running stub server, instead of starting one"
+    )
+    parser.add_argument(
+        "-l", "--latency", type=float, default=0, help="stub seconds per response"
+    )
+    parser.add_argument(
+        "-j", "--jitter", type=float, default=0, help="stub seconds added at random"
+    )
+    parser.add_argument(
+        "-e", "--error-rate", type=float, default=0, help="stub fraction of errors"
+    )
+    parser.add_argument("--layers", type=int, help="stub layers in each service")
+    parser.add_argument(
+        "--features", type=int, default=1000, help="stub features for each query"
+    )
+    args = parser.parse_args(args)
+
+    server = None
+    if args.url:
+        service_urls = get_service_urls(args.url.rstrip("/"))
+    else:
+        server = StubMapServer(
+            latency=args.latency,
+            jitter=args.jitter,
+            error_rate=args.error_rate,
+            num_layers=args.layers,
+            num_features=args.features,
+        ).start()
+        service_urls = server.service_urls
+
+    aggregator = instrumentation.add_listener(MetricsAggregator())
+    results = {}
+
+    try:
+        for name, prepare in get_scenarios(service_urls).items():
+            if args.filter and args.filter not in name:
+                continue
+
+            operation = prepare()
+            aggregator.reset()
+
+            result = run_load(operation, args.concurrency, args.duration)
+            result["requests"] = format_request_stats(aggregator.get_stats())
+            results[name] = result
+
+            print(format_summary(name, result), file=sys.stderr)
+    finally:
+        instrumentation.remove_listener(aggregator)
+        if server is not None:
+            server.stop()
+
+    report = {
+        "suite": "load",
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
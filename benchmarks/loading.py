@@ -0,0 +1,138 @@
+"""
+Benchmarks loading and parsing each kind of service with get(url, lazy=False), answered offline from the test fixtures.
+Services scaled up to thousands of layers are included. Run with: python -m benchmarks.loading [--help]
+"""
+from functools import partial
+
+from clients.arcgis import FeatureLayerResource, MapServerResource
+from clients.sciencebase import ScienceBaseResource
+from clients.thredds import ThreddsResource
+from clients.wms import WMSResource
+
+from .fixtures import get_arcgis_routes, get_feature_layer_routes
+from .fixtures import get_sciencebase_routes, get_thredds_routes, get_wms_routes
+from .transport import stub_transport
+from .utils import measure, run_suite
+
+
+ARCGIS_URL = "https://arcgis.test/arcgis/rest/services/Wetlands/MapServer"
+FEATURE_LAYER_URL = "https://arcgis.test/arcgis/rest/services/prcp/FeatureServer/0"
+WMS_URL = "https://wms.test/cgi-bin/wms"
+NCWMS_URL = "https://ncwms.test/ncWMS/wms"
+SCIENCEBASE_URL = "https://www.sciencebase.gov/catalog/item/{service_type}"
+
+THREDDS_URL = "https://thredds.test/thredds"
+THREDDS_SERVICE = "NWCSC_IS_ALL_SCAN/projections/macav2metdata/DATABASIN"
+THREDDS_DATASET = f"{THREDDS_SERVICE}/macav2metdata.nc"
+
+SCALED_ARCGIS_LAYERS = 5000
+SCALED_WMS_LAYERS = 1000
+SCALED_NCWMS_LAYERS = 500  # Each of which has its own layer details request
+SCALED_REPEAT = 1  # Most repetitions for scaled services, slow to load
+
+
+def benchmark_get(
+    resource_type, url, routes, repeat, count_layers=None, max_repeat=None, **kwargs
+):
+    """ Measures loading the resource at the URL, answered by the routes given """
+
+    load = partial(resource_type.get, url, lazy=False, **kwargs)
+    repeat = min(repeat, max_repeat or repeat)
+
+    with stub_transport(routes) as transport:
+        client = load()  # Warms up before measuring
+        result = measure(load, repeat, warmup=0)
+
+    if transport.unmatched:
+        raise AssertionError(f"Requests without stub routes: {transport.unmatched}")
+
+    if count_layers is not None:
+        result["layers"] = count_layers(client)
+
+    return result
+
+
+def get_cases():
+    """ :return: a function of the number of repetitions for each named benchmark """
+
+    arcgis_layers = lambda client: len(client.layers)
+    wms_layers = lambda client: len(client.leaf_layers)
+
+    cases = {
+        "arcgis.map_service": partial(
+            benchmark_get,
+            MapServerResource,
+            ARCGIS_URL,
+            get_arcgis_routes(ARCGIS_URL),
+            count_layers=arcgis_layers,
+        ),
+        "arcgis.feature_layer": partial(
+            benchmark_get,
+            FeatureLayerResource,
+            FEATURE_LAYER_URL,
+            get_feature_layer_routes(FEATURE_LAYER_URL),
+        ),
+        "wms.demo": partial(
+            benchmark_get,
+            WMSResource,
+            WMS_URL,
+            get_wms_routes(WMS_URL),
+            count_layers=wms_layers,
+        ),
+        "wms.ncwms": partial(
+            benchmark_get,
+            WMSResource,
+            NCWMS_URL,
+            get_wms_routes(NCWMS_URL, "wms/ncwms-max.xml"),
+            count_layers=wms_layers,
+        ),
+        "thredds": partial(
+            benchmark_get,
+            ThreddsResource,
+            f"{THREDDS_URL}/catalog/{THREDDS_SERVICE}/catalog.xml?dataset={THREDDS_DATASET}",
+            get_thredds_routes(THREDDS_URL, THREDDS_SERVICE, THREDDS_DATASET),
+            count_layers=lambda client: len(client.layers),
+        ),
+    }
+
+    for service_type in ("arcgis", "wms"):
+        item_url = SCIENCEBASE_URL.format(service_type=service_type)
+        cases[f"sciencebase.{service_type}"] = partial(
+            benchmark_get,
+            ScienceBaseResource,
+            f"{item_url}/?format=json",
+            get_sciencebase_routes(item_url, service_type),
+        )
+
+    # Synthetic services with thousands of layers
+
+    cases[f"arcgis.map_service_{SCALED_ARCGIS_LAYERS}"] = partial(
+        benchmark_get,
+        MapServerResource,
+        ARCGIS_URL,
+        get_arcgis_routes(ARCGIS_URL, SCALED_ARCGIS_LAYERS),
+        count_layers=arcgis_layers,
+        max_repeat=SCALED_REPEAT,
+    )
+    cases[f"wms.demo_{SCALED_WMS_LAYERS}"] = partial(
+        benchmark_get,
+        WMSResource,
+        WMS_URL,
+        get_wms_routes(WMS_URL, num_layers=SCALED_WMS_LAYERS),
+        count_layers=wms_layers,
+        max_repeat=SCALED_REPEAT,
+    )
+    cases[f"wms.ncwms_{SCALED_NCWMS_LAYERS}"] = partial(
+        benchmark_get,
+        WMSResource,
+        NCWMS_URL,
+        get_wms_routes(NCWMS_URL, "wms/ncwms-max.xml", SCALED_NCWMS_LAYERS),
+        count_layers=wms_layers,
+        max_repeat=SCALED_REPEAT,
+    )
+
+    return cases
+
+
+if __name__ == "__main__":
+    run_suite("loading", get_cases(), description=__doc__)
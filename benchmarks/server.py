@@ -0,0 +1,365 @@
+"""
+A local HTTP server answering like ArcGIS, WMS, ncWMS, THREDDS and ScienceBase services, from the test fixtures.
+Latency, error rates and payload sizes are configurable. Run with: python -m benchmarks.server [--help]
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from clients.utils.images import image_to_bytes
+
+from .fixtures import get_arcgis_routes, get_feature_layer_routes
+from .fixtures import get_sciencebase_routes, get_thredds_routes, get_wms_routes
+from .images import generate_image
+from .transport import StubAdapter, route
+
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8642
+
+TILED_PATH = "/arcgis/rest/services/Tiled/MapServer"
+DYNAMIC_PATH = "/arcgis/rest/services/Dynamic/MapServer"
+FEATURE_LAYER_PATH = "/arcgis/rest/services/Features/FeatureServer/0"
+WMS_PATH = "/wms"
+NCWMS_PATH = "/ncwms/wms"
+SCIENCEBASE_ITEM_PATH = "/catalog/item/{service_type}"
+
+THREDDS_PATH = "/thredds"
+THREDDS_SERVICE = "NWCSC_IS_ALL_SCAN/projections/macav2metdata/DATABASIN"
+THREDDS_DATASET = f"{THREDDS_SERVICE}/macav2metdata.nc"
+
+FEATURE_ID_FIELD = "FID"
+TILE_SIZE = (256, 256)
+
+
+@lru_cache(maxsize=32)
+def render_image(width, height, image_format="PNG"):
+    """ :return: an encoded image of the size given, rendered once for each size requested """
+    return image_to_bytes(generate_image((width, height)), image_format)
+
+
+def get_request_params(url, body=None):
+    """ :return: query string and form parameters with lower case names, each with its last value """
+
+    params = parse_qs(urlsplit(url).query)
+    if body:
+        params.update(parse_qs(body.decode() if isinstance(body, bytes) else body))
+
+    return {key.lower(): values[-1] for key, values in params.items()}
+
+
+def get_service_urls(base_url):
+    """ :return: the URL of each kind of service served from the base URL, as passed to the get method of its client """
+
+    thredds_url = f"{base_url}{THREDDS_PATH}"
+    item_url = base_url + SCIENCEBASE_ITEM_PATH
+
+    return {
+        "arcgis.tiled": f"{base_url}{TILED_PATH}",
+        "arcgis.dynamic": f"{base_url}{DYNAMIC_PATH}",
+        "arcgis.feature_layer": f"{base_url}{FEATURE_LAYER_PATH}",
+        "wms": f"{base_url}{WMS_PATH}",
+        "ncwms": f"{base_url}{NCWMS_PATH}",
+        "thredds": (
+            f"{thredds_url}/catalog/{THREDDS_SERVICE}/catalog.xml"
+            f"?dataset={THREDDS_DATASET}"
+        ),
+        "sciencebase.arcgis": item_url.format(service_type="arcgis") + "/?format=json",
+        "sciencebase.wms": item_url.format(service_type="wms") + "/?format=json",
+    }
+
+
+class StubMapServer(object):
+    """ Serves the fixture routes over HTTP from a background thread, with simulated latency and errors """
+
+    def __init__(
+        self,
+        host=DEFAULT_HOST,
+        port=0,
+        latency=0,
+        jitter=0,
+        error_rate=0,
+        error_status=503,
+        num_layers=None,
+        num_features=1000,
+    ):
+        """
+        :param port: the port to listen on, or 0 for any free port
+        :param latency: seconds to wait before answering each request
+        :param jitter: most seconds added to the latency at random
+        :param error_rate: the fraction of requests answered with the error status instead of content
+        :param num_layers: if provided, ArcGIS and WMS services are scaled up to this number of layers
+        :param num_features: the number of features matching each feature layer query
+        """
+
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.num_layers = num_layers
+        self.num_features = num_features
+
+        self.requests = 0
+        self.errors = 0
+
+        self._lock = threading.Lock()
+        self._random = random.Random()
+        self._thread = None
+
+        self.httpd = ThreadingHTTPServer((host, port), self._create_handler())
+        self.httpd.daemon_threads = True
+
+        self.adapter = StubAdapter(self.get_routes())
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def service_urls(self):
+        return get_service_urls(self.base_url)
+
+    def get_item_url(self, service_type):
+        return self.base_url + SCIENCEBASE_ITEM_PATH.format(service_type=service_type)
+
+    def get_routes(self):
+        """ :return: routes for every service, including the images and queries that offline benchmarks leave out """
+
+        base_url = self.base_url
+        tiled_url = f"{base_url}{TILED_PATH}"
+        dynamic_url = f"{base_url}{DYNAMIC_PATH}"
+        feature_layer_url = f"{base_url}{FEATURE_LAYER_PATH}"
+
+        get_map = r"\?.*request=GetMap"
+        routes = [
+            route(
+                f"{TILED_PATH}/tile/\\d+/\\d+/\\d+",
+                render_image(*TILE_SIZE),
+                "image/png",
+            ),
+            route(f"{DYNAMIC_PATH}/export/?\\?", self.render_export, "image/png"),
+            route(f"{FEATURE_LAYER_PATH}/query", self.render_query),
+            route(f"{WMS_PATH}{get_map}", self.render_get_map, "image/png"),
+            route(f"{NCWMS_PATH}{get_map}", self.render_get_map, "image/png"),
+        ]
+
+        routes.extend(get_arcgis_routes(tiled_url, self.num_layers))
+        routes.extend(get_arcgis_routes(dynamic_url, self.num_layers, tiled=False))
+        routes.extend(get_feature_layer_routes(feature_layer_url))
+        routes.extend(
+            get_wms_routes(f"{base_url}{WMS_PATH}", num_layers=self.num_layers)
+        )
+        routes.extend(
+            get_wms_routes(
+                f"{base_url}{NCWMS_PATH}", "wms/ncwms-max.xml", self.num_layers
+            )
+        )
+        routes.extend(
+            get_thredds_routes(
+                f"{base_url}{THREDDS_PATH}", THREDDS_SERVICE, THREDDS_DATASET
+            )
+        )
+        for service_type in ("arcgis", "wms"):
+            routes.extend(
+                get_sciencebase_routes(
+                    self.get_item_url(service_type), service_type, base_url
+                )
+            )
+
+        return routes
+
+    def render_export(self, url, body=None):
+        params = get_request_params(url, body)
+        width, height = (int(s) for s in params.get("size", "400,400").split(","))
+        return render_image(width, height)
+
+    def render_get_map(self, url, body=None):
+        params = get_request_params(url, body)
+        return render_image(int(params["width"]), int(params["height"]))
+
+    def render_query(self, url, body=None):
+        """ :return: object IDs of all features, or each feature whose ID is in the where clause """
+
+        params = get_request_params(url, body)
+        if params.get("returnidsonly", "").lower() == "true":
+            return json.dumps(
+                {
+                    "objectIdFieldName": FEATURE_ID_FIELD,
+                    "objectIds": list(range(self.num_features)),
+                }
+            )
+
+        where = params.get("where", "")
+        if " IN (" in where:
+            object_ids = json.loads("[" + where.split(" IN (", 1)[1].rstrip(")") + "]")
+        else:
+            object_ids = range(self.num_features)
+
+        return json.dumps(
+            {
+                "objectIdFieldName": FEATURE_ID_FIELD,
+                "geometryType": "esriGeometryPoint",
+                "spatialReference": {"wkid": 102100, "latestWkid": 3857},
+                "fields": [
+                    {
+                        "name": FEATURE_ID_FIELD,
+                        "type": "esriFieldTypeOID",
+                        "alias": "FID",
+                    }
+                ],
+                "features": [
+                    {
+                        "attributes": {FEATURE_ID_FIELD: object_id},
+                        "geometry": {
+                            "x": -13600000 + (object_id % 100) * 1000,
+                            "y": 5700000 + (object_id // 100) * 1000,
+                        },
+                    }
+                    for object_id in object_ids
+                ],
+            }
+        )
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self.httpd.serve_forever, name="stub-map-server", daemon=True
+            )
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self.httpd.shutdown()
+            self._thread.join()
+            self._thread = None
+
+        self.httpd.server_close()
+
+    def serve_forever(self):
+        try:
+            self.httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.httpd.server_close()
+
+    def _create_handler(self):
+        server = self
+
+        class StubRequestHandler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                server.handle(self)
+
+            def do_HEAD(self):
+                server.handle(self)
+
+            def do_POST(self):
+                server.handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        return StubRequestHandler
+
+    def handle(self, handler):
+        """ Answers the request after the configured latency, with an error at the configured rate """
+
+        length = int(handler.headers.get("Content-Length") or 0)
+        body = handler.rfile.read(length) if length else None
+
+        with self._lock:
+            self.requests += 1
+            delay = self.latency + self._random.uniform(0, self.jitter)
+            failed = self._random.random() < self.error_rate
+            if failed:
+                self.errors += 1
+
+        if delay:
+            time.sleep(delay)
+
+        if failed:
+            self._respond(
+                handler, self.error_status, b"Service Unavailable", "text/plain"
+            )
+            return
+
+        stub = self.adapter.match(self.base_url + handler.path)
+        if stub is None:
+            self._respond(handler, 404, b"Not Found", "text/plain")
+            return
+
+        try:
+            content = self.adapter.get_content(stub, self.base_url + handler.path, body)
+        except (KeyError, ValueError) as ex:
+            self._respond(handler, 400, str(ex).encode(), "text/plain")
+            return
+
+        self._respond(handler, stub.status_code, content, stub.content_type)
+
+    @staticmethod
+    def _respond(handler, status_code, content, content_type):
+        handler.send_response(status_code)
+        handler.send_header("Content-Type", content_type)
+        handler.send_header("Content-Length", str(len(content)))
+        handler.end_headers()
+
+        if handler.command != "HEAD":
+            handler.wfile.write(content)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("-p", "--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument(
+        "-l", "--latency", type=float, default=0, help="seconds before each response"
+    )
+    parser.add_argument(
+        "-j", "--jitter", type=float, default=0, help="most seconds added at random"
+    )
+    parser.add_argument(
+        "-e", "--error-rate", type=float, default=0, help="fraction of failed requests"
+    )
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--layers", type=int, help="layers in ArcGIS and WMS services")
+    parser.add_argument(
+        "--features", type=int, default=1000, help="features matching each query"
+    )
+    args = parser.parse_args(args)
+
+    server = StubMapServer(
+        args.host,
+        args.port,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        num_layers=args.layers,
+        num_features=args.features,
+    )
+
+    for name, url in server.service_urls.items():
+        print(f"{name}: {url}", file=sys.stderr)
+
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+""" A stub transport answering client requests with fixture content, so that benchmarks run offline """
+import re
+
+from collections import namedtuple
+from contextlib import contextmanager
+from unittest import mock
+
+from parserutils.elements import get_element, strip_namespaces
+from requests.adapters import BaseAdapter
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+
+from clients.utils.sessions import session_factory
+
+
+Route = namedtuple("Route", "pattern, content, content_type, status_code")
+
+
+def route(pattern, content, content_type="application/json", status_code=200):
+    """
+    :param content: bytes or text, or a function of the request URL and body returning either
+    :return: a route answering requests with URLs matching the pattern (case-insensitive)
+    """
+
+    if isinstance(content, str):
+        content = content.encode()
+
+    return Route(re.compile(pattern, re.I), content, content_type, status_code)
+
+
+class StubAdapter(BaseAdapter):
+    """ Answers each request with the content of the first route matching its URL, or a 404 """
+
+    def __init__(self, routes):
+        super(StubAdapter, self).__init__()
+
+        self.routes = list(routes)
+        self.unmatched = []
+
+    @staticmethod
+    def get_content(stub, url, body=None):
+        """ :return: the content of the route as bytes, rendered for the request if the route is dynamic """
+
+        content = stub.content(url, body) if callable(stub.content) else stub.content
+        return content.encode() if isinstance(content, str) else content
+
+    def match(self, url):
+        for stub in self.routes:
+            if stub.pattern.search(url):
+                return stub
+
+        self.unmatched.append(url)
+        return None
+
+    def send(self, request, **kwargs):
+        stub = self.match(request.url)
+
+        response = Response()
+        response.request = request
+        response.url = request.url
+        response.encoding = "utf-8"
+
+        if stub is None:
+            response.status_code = 404
+            response._content = b""
+        else:
+            content = self.get_content(stub, request.url, request.body)
+
+            response.status_code = stub.status_code
+            response.headers = CaseInsensitiveDict(
+                {"Content-Type": stub.content_type, "Content-Length": str(len(content))}
+            )
+            response._content = b"" if request.method == "HEAD" else content
+
+        return response
+
+    def close(self):
+        pass
+
+
+@contextmanager
+def stub_transport(routes):
+    """
+    Routes every request made by the clients to a stub adapter while the block runs.
+    THREDDS ISO metadata, which is read with urlopen rather than a session, is answered by the same routes.
+    """
+
+    adapter = StubAdapter(routes)
+
+    def get_remote_element(url, element_path=None):
+        stub = adapter.match(url)
+        if stub is None:
+            raise ValueError(f"No stub route for {url}")
+        content = adapter.get_content(stub, url)
+        return get_element(strip_namespaces(content), element_path)
+
+    previous = {
+        prefix: session_factory.mount(prefix, adapter)
+        for prefix in ("http://", "https://")
+    }
+    try:
+        with mock.patch("clients.thredds.get_remote_element", get_remote_element):
+            yield adapter
+    finally:
+        for prefix, previous_adapter in previous.items():
+            session_factory.mount(prefix, previous_adapter)
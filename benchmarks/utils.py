@@ -0,0 +1,202 @@
+""" Measurement, reporting and regression checks shared by every benchmark suite """
+import argparse
+import ctypes
+import ctypes.util
+import gc
+import json
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+
+DEFAULT_REPEAT = 5
+# Ratio by which a result may exceed its baseline before it is a regression
+DEFAULT_TOLERANCE = 0.25
+
+REGRESSION_METRICS = ("median", "peak_bytes", "peak_rss_bytes")
+MEMORY_NOISE = 1024 ** 2  # Increases in memory smaller than this are not regressions
+
+PROC_STATUS = "/proc/self/status"
+PROC_CLEAR_REFS = "/proc/self/clear_refs"
+
+try:
+    _libc = ctypes.CDLL(ctypes.util.find_library("c"))
+    _libc.malloc_trim  # Only in glibc
+except (AttributeError, OSError):
+    _libc = None
+
+
+def measure(func, repeat=DEFAULT_REPEAT, warmup=1):
+    """
+    Times repeated calls to func, then traces memory for one more call, which is slower while tracing.
+    Memory allocated outside of Python (such as image data) is only reported as peak resident memory, on Linux.
+    :return: a dict with wall times in seconds, and bytes and blocks allocated by the traced call
+    """
+
+    for _ in range(warmup):
+        func()
+
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        started = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - started)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        resident = reset_peak_rss()
+        func()
+        peak_rss = read_peak_rss()
+        after = tracemalloc.take_snapshot()
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    allocated = [s for s in after.compare_to(before, "lineno") if s.size_diff > 0]
+
+    return {
+        "repeat": repeat,
+        "min": min(times),
+        "median": statistics.median(times),
+        "mean": statistics.fmean(times),
+        "peak_bytes": peak_bytes,
+        "peak_rss_bytes": None if resident is None else max(peak_rss - resident, 0),
+        "allocated_bytes": sum(s.size_diff for s in allocated),
+        "allocated_blocks": sum(s.count_diff for s in allocated),
+    }
+
+
+def compare_results(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """ :return: a message for each metric exceeding its baseline value by more than the tolerance """
+
+    regressions = []
+
+    for name, result in results.items():
+        expected = baseline.get(name)
+        if expected is None:
+            continue
+
+        for metric in REGRESSION_METRICS:
+            value, limit = result.get(metric), expected.get(metric)
+            if value is None or not limit:
+                continue
+
+            if metric.endswith("_bytes") and value - limit < MEMORY_NOISE:
+                continue
+            if value > limit * (1 + tolerance):
+                regressions.append(
+                    f"{name}: {metric} {value:.6g} exceeds baseline {limit:.6g} "
+                    f"by {(value / limit - 1):.0%}"
+                )
+
+    return regressions
+
+
+def read_peak_rss():
+    """ :return: the most memory resident since the peak was last reset, in bytes, or None if unavailable """
+    return _read_proc_status("VmHWM")
+
+
+def reset_peak_rss():
+    """
+    Resets peak resident memory to the current value, which is only possible on Linux.
+    :return: the current resident memory in bytes, or None if the peak could not be reset
+    """
+
+    if _libc is not None:
+        _libc.malloc_trim(
+            0
+        )  # Returns freed memory, which would otherwise be reused without raising the peak
+
+    try:
+        with open(PROC_CLEAR_REFS, "w") as clear_refs:
+            clear_refs.write("5")
+    except OSError:
+        return None
+
+    return _read_proc_status("VmRSS")
+
+
+def _read_proc_status(field):
+    try:
+        with open(PROC_STATUS) as status:
+            for line in status:
+                if line.startswith(f"{field}:"):
+                    return int(line.split()[1]) * 1024  # Reported in kB
+    except OSError:
+        pass
+
+    return None
+
+
+def run_suite(suite, cases, args=None, description=None):
+    """
+    Runs the named benchmark cases from the command line, writing results as JSON.
+    Exits with status 1 if any result regresses from the baseline provided.
+    :param cases: a dict of case names to functions of the number of repetitions, each returning a measurement
+    """
+
+    parser = argparse.ArgumentParser(
+        prog=f"benchmarks.{suite}", description=description
+    )
+    parser.add_argument("-k", "--filter", help="only run cases containing this text")
+    parser.add_argument("-n", "--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument(
+        "-o", "--output", help="file to write results to (stdout if omitted)"
+    )
+    parser.add_argument(
+        "-b", "--baseline", help="results file to check for regressions"
+    )
+    parser.add_argument("-t", "--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    options = parser.parse_args(args)
+
+    results = {}
+    for name, case in cases.items():
+        if options.filter and options.filter not in name:
+            continue
+
+        results[name] = case(options.repeat)
+        print(format_result(name, results[name]), file=sys.stderr)
+
+    report = {
+        "suite": suite,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+
+    if options.output:
+        with open(options.output, "w") as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print()
+
+    if options.baseline:
+        with open(options.baseline) as baseline:
+            baseline = json.load(baseline)["results"]
+
+        regressions = compare_results(results, baseline, options.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+
+        if regressions:
+            sys.exit(1)
+
+    return report
+
+
+def format_result(name, result):
+    summary = (
+        f"{name}: median {result['median'] * 1000:.2f}ms, "
+        f"peak {result['peak_bytes'] / 1024 ** 2:.2f}MiB"
+    )
+    if result.get("peak_rss_bytes") is not None:
+        summary += f", peak resident {result['peak_rss_bytes'] / 1024 ** 2:.2f}MiB"
+
+    return summary
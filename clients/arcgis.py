@@ -6,6 +6,7 @@ import re
 import requests
 
 from PIL import Image
+from contextvars import copy_context
 from threading import Thread
 from urllib.parse import urlparse, urlsplit
 
@@ -29,6 +30,9 @@ from .exceptions import (
     ImageError,
     NoLayers,
     ServiceError,
+    ServiceMisconfigured,
+    ServiceTimeout,
+    ServiceUnavailable,
 )
 from .query.arcgis import (
     FEATURE_LAYER_QUERY,
@@ -40,10 +44,16 @@ from .query.fields import CommaSeparatedField, DrawingInfoField, ExtentField
 from .query.fields import ObjectField, SpatialReferenceField, TimeInfoField
 from .resources import ClientResource, DEFAULT_USER_AGENT
 from .utils import classproperty
+from .utils.concurrency import concurrency_limiters, map_concurrently
 from .utils.conversion import to_renderer
+from .utils.deadlines import Deadline
 from .utils.geometry import Extent, TileLevels, SpatialReference
 from .utils.images import base64_to_image, count_colors, image_to_base64, overlay_images
-from .utils.images import stack_images_vertically
+from .utils.images import RawImage, stack_images_vertically
+from .utils.legends import build_legend_atlas
+from .utils.metrics import instrumented
+from .utils.profiling import timed_phase
+from .utils.sessions import get_session
 
 
 logger = logging.getLogger(__name__)
@@ -132,6 +142,8 @@ class ArcGISResource(ClientResource):
             status_code = 404  # Service not found
         elif "configuration error" in message:
             status_code = 503  # Service unavailable (approximates configuration issue)
+            if error_class is ServiceError:
+                error_class = ServiceMisconfigured
         else:
             status_code = error.get("code", 500)
 
@@ -300,21 +312,31 @@ class ArcGISTiledImageResource(ArcGISServerResource):
 
         self.validate_tile_scheme()
 
-    def generate_image_from_query(self, extent, width, height, image_path, params):
+    def generate_image_from_query(
+        self, extent, width, height, image_path, params, deadline=None, raw=False
+    ):
+        """
+        :param raw:
+            If True, return a RawImage: the exported image as served, unless it must be stitched across the
+            central meridian, or tiles must be mosaicked, in which case the result is encoded as PNG
+        """
+
+        deadline = Deadline.from_value(deadline)
 
         try:
             if self.tile_info is not None:
-                tiled_image = self._get_tiled_image(extent, width, height)
+                tiled_image = self._get_tiled_image(extent, width, height, deadline)
 
                 # Paste image for extent left of the central meridian, if it exists
                 if extent.has_negative_extent():
                     negative_extent = extent.get_negative_extent()
                     negative_image = self._get_tiled_image(
-                        negative_extent, width, height
+                        negative_extent, width, height, deadline
                     )
-                    tiled_image.paste(negative_image, (0, 0), negative_image)
+                    with timed_phase("composite"):
+                        tiled_image.paste(negative_image, (0, 0), negative_image)
 
-                return tiled_image
+                return self._to_raw_image(tiled_image) if raw else tiled_image
 
             # TODO: support more than just Web Mercator
             # TODO: validate bbox == bboxSR (imageSR is target)
@@ -332,21 +354,37 @@ class ArcGISTiledImageResource(ArcGISServerResource):
 
             image_params.update(params or {})
 
-            image_data = io.BytesIO(self._make_request(image_url, image_params).content)
-            image_object = Image.open(image_data).convert("RGBA")
+            response = self._make_request(
+                image_url, image_params, deadline=deadline, endpoint="export"
+            )
+
+            # Pass the exported image through untouched if no pixels need to change
+            content_type = response.headers.get("content-type", "")
+            if raw and content_type.startswith("image/"):
+                if not extent.has_negative_extent():
+                    return RawImage(response.content, content_type)
+
+            with timed_phase("decode") as phase:
+                phase.bytes = len(response.content)
+                image_object = Image.open(io.BytesIO(response.content)).convert("RGBA")
 
             # Paste image for extent left of the central meridian, if it exists
             if extent.has_negative_extent():
                 image_params["bbox"] = extent.get_negative_extent().as_bbox_string()
-                response = self._make_request(image_url, image_params)
-                negative_data = io.BytesIO(response.content)
-                negative_image = Image.open(negative_data).convert("RGBA")
-                image_object.paste(negative_image, (0, 0), negative_image)
+                response = self._make_request(
+                    image_url, image_params, deadline=deadline, endpoint="export"
+                )
+                with timed_phase("decode") as phase:
+                    phase.bytes = len(response.content)
+                    negative_data = io.BytesIO(response.content)
+                    negative_image = Image.open(negative_data).convert("RGBA")
+                with timed_phase("composite"):
+                    image_object.paste(negative_image, (0, 0), negative_image)
 
-            return image_object
+            return self._to_raw_image(image_object) if raw else image_object
 
-        except (BadExtent, HTTPError, ImageError):
-            raise  # Caught from self._get_tiled_image
+        except (BadExtent, HTTPError, ImageError, ServiceTimeout, ServiceUnavailable):
+            raise  # Caught from self._get_tiled_image, or no longer requesting
 
         except requests.exceptions.HTTPError as ex:
             raise HTTPError(
@@ -364,7 +402,11 @@ class ArcGISTiledImageResource(ArcGISServerResource):
                 url=image_url,
             )
 
-    def _get_tiled_image(self, extent, width, height):
+    def _to_raw_image(self, image):
+        with timed_phase("encode"):
+            return RawImage.from_image(image, profile=self.encoding_profile)
+
+    def _get_tiled_image(self, extent, width, height, deadline=None):
 
         tile_levels = TileLevels([lod.resolution for lod in self.tile_info.lods])
         target_resolution = extent.get_image_resolution(width, height)
@@ -496,8 +538,9 @@ class ArcGISTiledImageResource(ArcGISServerResource):
                 ):
                     tile_threads.append(
                         Thread(
-                            target=self._render_single_tile,
+                            target=copy_context().run,  # Timed with the image
                             args=(
+                                self._render_single_tile,
                                 zoom_level,
                                 row,
                                 column,
@@ -506,6 +549,7 @@ class ArcGISTiledImageResource(ArcGISServerResource):
                                 tile_height_in_pixels,
                                 tile_width_in_pixels,
                                 base_image,
+                                deadline,
                             ),
                         )
                     )
@@ -514,33 +558,40 @@ class ArcGISTiledImageResource(ArcGISServerResource):
             for thread in tile_threads:
                 thread.join()
 
-            base_image.load()
-
-            offset_from_first_x = int(math.floor(offset_from_first_x))
-            offset_from_first_y = int(math.floor(offset_from_first_y))
-            cropped_image = base_image.crop(
-                (
-                    offset_from_first_x,
-                    offset_from_first_y,
-                    width + offset_from_first_x,
-                    height + offset_from_first_y,
+            if deadline is not None and deadline.expired:
+                # Tiles not rendered in time are missing: fail rather than returning a partial image
+                raise self._deadline_error(
+                    self._url, deadline, tile_info=self.tile_info
                 )
-            )
 
-            if shift_x != 0 or shift_y != 0:
-                shifted_image = Image.new("RGBA", (width, height))
-                shifted_image.paste(
-                    cropped_image,
+            with timed_phase("crop"):
+                base_image.load()
+
+                offset_from_first_x = int(math.floor(offset_from_first_x))
+                offset_from_first_y = int(math.floor(offset_from_first_y))
+                cropped_image = base_image.crop(
                     (
-                        int(math.ceil(shift_x / resolution)),
-                        int(math.ceil(shift_y / resolution)),
-                    ),
+                        offset_from_first_x,
+                        offset_from_first_y,
+                        width + offset_from_first_x,
+                        height + offset_from_first_y,
+                    )
                 )
-                cropped_image = shifted_image
+
+                if shift_x != 0 or shift_y != 0:
+                    shifted_image = Image.new("RGBA", (width, height))
+                    shifted_image.paste(
+                        cropped_image,
+                        (
+                            int(math.ceil(shift_x / resolution)),
+                            int(math.ceil(shift_y / resolution)),
+                        ),
+                    )
+                    cropped_image = shifted_image
 
             return cropped_image
 
-        except BadExtent:
+        except (BadExtent, ServiceTimeout, ServiceUnavailable):
             raise
         except (IOError, ValueError) as ex:
             raise ImageError(
@@ -560,6 +611,7 @@ class ArcGISTiledImageResource(ArcGISServerResource):
         tile_height,
         tile_width,
         base_image,
+        deadline=None,
     ):
         tile_url = "{base_url}/tile/{zoom}/{row}/{col}".format(
             base_url=self._url.strip("/"),
@@ -570,7 +622,9 @@ class ArcGISTiledImageResource(ArcGISServerResource):
         tile_params = {"token": self._token} if self._token else {}
 
         try:
-            response = self._make_request(tile_url, tile_params)
+            response = self._make_request(
+                tile_url, tile_params, deadline=deadline, hedge=True, endpoint="tile"
+            )
         except requests.exceptions.HTTPError as ex:
             raise HTTPError(
                 "The ArcGIS single tile query did not respond correctly",
@@ -580,10 +634,14 @@ class ArcGISTiledImageResource(ArcGISServerResource):
                 status_code=getattr(ex.response, "status_code", None),
             )
 
-        base_image.paste(
-            Image.open(io.BytesIO(response.content)).convert("RGBA"),
-            (int(col * tile_width), int(row * tile_height)),
-        )
+        with timed_phase("decode") as phase:
+            phase.bytes = len(response.content)
+            tile_image = Image.open(io.BytesIO(response.content)).convert("RGBA")
+
+        with timed_phase("composite"):
+            base_image.paste(
+                tile_image, (int(col * tile_width), int(row * tile_height))
+            )
 
     def validate_tile_scheme(self):
         """
@@ -640,6 +698,8 @@ class MapLayerResource(ArcGISLayerResource):
     definition_query = TextField(name="definitionExpression", required=False)
     popup_type = TextField(name="htmlPopupType", required=False)
 
+    _endpoint = "layers"
+
     class Meta:
         case_sensitive_fields = False
         get_parameters = {"f": "json"}
@@ -668,6 +728,7 @@ class MapLegendResource(ArcGISSecureResource):
     values = ObjectField(class_name="LegendValue", required=False)
 
     _client_descriptor = ArcGISResource._client_descriptor
+    _endpoint = "legend"
 
     class Meta:
         case_sensitive_fields = False
@@ -721,6 +782,7 @@ class MapServerResource(ArcGISTiledImageResource):
             strict=self._strict,
             session=(self._layer_session or self._session),
             bypass_version=self._bypass_version,
+            deadline=self._deadline,
             bulk_key="layers",
             bulk_defaults={"currentVersion": self.version},
             **self.arcgis_credentials,
@@ -746,6 +808,7 @@ class MapServerResource(ArcGISTiledImageResource):
             strict=self._strict,
             session=(self._layer_session or self._session),
             bypass_version=self._bypass_version,
+            deadline=self._deadline,
             bulk_key="layers.legend",
             bulk_defaults={"currentVersion": self.version},
             **self.arcgis_credentials,
@@ -757,21 +820,17 @@ class MapServerResource(ArcGISTiledImageResource):
         for layer in self.layers:
             layer.legend = legend_map.get(layer.id, [])
 
-        # Update legend element images for raster layers with more than three elements
+        # Update legend element images for raster layers with three elements (most common)
 
         for layer in (
-            l for l in self.layers if "raster" in l.type.lower() and len(l.legend) >= 3
+            l for l in self.layers if "raster" in l.type.lower() and len(l.legend) == 3
         ):
-            max_colors = max(
-                [count_colors(base64_to_image(l.image_base64)) for l in layer.legend]
-            )
+            # Decode each element once, to count colors and to stack them if needed
+            images = [base64_to_image(l.image_base64) for l in layer.legend]
 
-            if max_colors and max_colors > 3 and len(layer.legend) == 3:
-                # If there are more than 3 colors (transparent, border, fill), then this is stretched.
-                # But we only need to do something different if there are 3 patches (most common)
-                images = []
+            # If there are more than 3 colors (transparent, border, fill), then this is stretched
+            if any(count_colors(image, max_colors=3) > 3 for image in images):
                 for element in layer.legend:
-                    images.append(base64_to_image(element.image_base64))
                     element.image_base64 = None
                     element.url = None
 
@@ -780,6 +839,23 @@ class MapServerResource(ArcGISTiledImageResource):
                     stack_images_vertically(images)
                 )
 
+    def get_legend_atlas(self, **kwargs):
+        """
+        Packs the legend swatches of every layer into one sprite image, each distinct swatch once
+        :param kwargs: passed to clients.utils.legends.build_legend_atlas
+        :return: a LegendAtlas with swatch positions keyed by (layer id, legend element index)
+        """
+
+        return build_legend_atlas(
+            (
+                ((layer.id, idx), element.image_base64)
+                for layer in self.layers
+                for idx, element in enumerate(layer.legend or [])
+            ),
+            **kwargs,
+        )
+
+    @instrumented("get_image", timed=True)
     def get_image(
         self,
         extent,
@@ -789,6 +865,8 @@ class MapServerResource(ArcGISTiledImageResource):
         layer_defs="",
         layers="",
         time="",
+        deadline=None,
+        raw=False,
         **kwargs,
     ):
         """
@@ -801,6 +879,10 @@ class MapServerResource(ArcGISTiledImageResource):
             Otherwise, a JSON string or dict with keys corresponding to layer-specific definition expressions
         :param layers:
             A string with either "show:" or "hide:" preceding a comma-separated list of layer ids
+        :param deadline:
+            A Deadline, or number of seconds, within which all image and tile requests must complete
+        :param raw:
+            If True, return a RawImage with the exported image bytes and content type, undecoded if possible
         """
 
         image_params = {
@@ -822,7 +904,13 @@ class MapServerResource(ArcGISTiledImageResource):
             )  # Dynamic layers take over for layerdefs: this saves URL space
 
         return self.generate_image_from_query(
-            extent, width, height, "export", params=image_params
+            extent,
+            width,
+            height,
+            "export",
+            params=image_params,
+            deadline=deadline,
+            raw=raw,
         )
 
     def _generate_dynamic_layers(self, custom_renderers, layer_defs, layers):
@@ -896,11 +984,13 @@ class GeometryServiceClient(object):
     Intended for internal use, so no validation of URL, etc is performed.
     """
 
-    def __init__(self, service_url):
+    def __init__(self, service_url, session=None):
         self.service_url = get_base_url(service_url, True)
         if self.service_url.endswith("/project"):
             self.service_url = self.service_url[: self.service_url.index("/project")]
 
+        self._session = session or get_session()
+
     def project_extent(self, extent, to_spatial_ref):
         """
         Projects the extent of a dataset or layer to the projection described by to_spatial_ref.
@@ -936,7 +1026,7 @@ class GeometryServiceClient(object):
         }
 
         try:
-            response = requests.get(url, headers=headers, params=params)
+            response = self._session.get(url, headers=headers, params=params)
             response.raise_for_status()
         except requests.exceptions.HTTPError as ex:
             raise HTTPError(
@@ -1022,6 +1112,7 @@ class FeatureLayerResource(ArcGISLayerResource):
         get_parameters = {"f": "json"}
         match_fuzzy_keys = True
 
+    @instrumented("get_image", timed=True)
     def get_image(
         self,
         extent,
@@ -1030,6 +1121,8 @@ class FeatureLayerResource(ArcGISLayerResource):
         custom_renderers=None,
         layer_defs=None,
         time="",
+        deadline=None,
+        raw=False,
         **kwargs,
     ):
         """
@@ -1037,6 +1130,10 @@ class FeatureLayerResource(ArcGISLayerResource):
             A JSON string or dict containing renderer JSON objects indexed by layer id (WMS ID).
         :param layer_defs:
             A JSON string or dict with indices corresponding to the feature layer definition expression:
+        :param deadline:
+            A Deadline, or number of seconds, checked before each feature query is sent
+        :param raw:
+            If True, return a RawImage with the rendered image encoded as PNG
         :param kwargs:
             May contain an ArcGIS token as "token" for secure feature layer image requests
         """
@@ -1062,6 +1159,9 @@ class FeatureLayerResource(ArcGISLayerResource):
             extras = ", ".join(k for k in kwargs if k not in query_kwargs)
             logger.warning(f"Ignoring {self.client_name} query fields: {extras}")
 
+        deadline = Deadline.from_value(deadline)
+        self._get_timeout(deadline=deadline)  # Fails fast once the deadline has passed
+
         id_query = self.query(
             where=layer_def or "",
             time=time or "",
@@ -1080,18 +1180,18 @@ class FeatureLayerResource(ArcGISLayerResource):
         transparent_background = (0, 0, 0, 0)
         object_ids = id_query["objectIds"]
         full_image = Image.new("RGBA", (width, height), transparent_background)
-        starting_record = 0
 
         # Override max_record_count for services with too many features to reproject
         max_features = self.max_feature_request or self.max_record_count
         max_features = min(self.max_record_count, max_features)
 
-        while True:
-            object_ids_to_get = object_ids[
-                starting_record : starting_record + max_features
-            ]
-            if not object_ids_to_get:
-                break
+        id_chunks = [
+            object_ids[start : start + max_features]
+            for start in range(0, len(object_ids), max_features)
+        ]
+        limiter = concurrency_limiters.get_limiter(self._url)
+
+        def query_features(object_ids_to_get):
 
             # Specific criteria for geometries has already been applied in the query for IDs
             id_where_clause = "{object_field} IN {formatted_id_list}".format(
@@ -1100,10 +1200,16 @@ class FeatureLayerResource(ArcGISLayerResource):
                 .replace("[", "(")
                 .replace("]", ")"),
             )
-            query_results = self.query(
-                where=id_where_clause, out_sr=3857, out_fields="*", **query_kwargs
-            )
 
+            self._get_timeout(deadline=deadline)
+            with limiter.request(None if deadline is None else deadline.remaining):
+                return self.query(
+                    where=id_where_clause, out_sr=3857, out_fields="*", **query_kwargs
+                )
+
+        # Query subsets of features concurrently, but generate and overlay their images in order
+
+        for query_results in map_concurrently(query_features, id_chunks):
             if "error" in query_results:
                 self.handle_error(
                     query_results,
@@ -1112,14 +1218,18 @@ class FeatureLayerResource(ArcGISLayerResource):
                 )
 
             # Generate the sub-images for each subset query and overlay it on the current image
-            sub_image = self.generate_sub_image(
-                extent, width, height, renderer, query_results
-            )
-            full_image = overlay_images(
-                [full_image, sub_image], background_color=transparent_background
-            )
+            with timed_phase("render"):
+                sub_image = self.generate_sub_image(
+                    extent, width, height, renderer, query_results
+                )
+            with timed_phase("composite"):
+                full_image = overlay_images(
+                    [full_image, sub_image], background_color=transparent_background
+                )
 
-            starting_record += max_features
+        if raw:
+            with timed_phase("encode"):
+                return RawImage.from_image(full_image, profile=self.encoding_profile)
 
         return full_image
 
@@ -1187,20 +1297,42 @@ class FeatureServerResource(ArcGISServerResource):
                 "The ArcGIS feature service does not have any layers", url=self._url
             )
 
+    @instrumented("get_image", timed=True)
     def get_image(
-        self, extent, width, height, custom_renderers=None, layer_defs=None, **kwargs
+        self,
+        extent,
+        width,
+        height,
+        custom_renderers=None,
+        layer_defs=None,
+        deadline=None,
+        raw=False,
+        **kwargs,
     ):
+        """ :param raw: if True, return a RawImage with the composited layer images encoded as PNG """
+
         final_image = Image.new("RGBA", (width, height), (0, 0, 0, 0))
+        deadline = Deadline.from_value(deadline)  # Shared by all layers
 
         if self._token:
             kwargs["token"] = self._token
 
         for layer in self.layers:
-            final_image.paste(
-                layer.get_image(
-                    extent, width, height, custom_renderers, layer_defs, **kwargs
-                )
+            layer_image = layer.get_image(
+                extent,
+                width,
+                height,
+                custom_renderers,
+                layer_defs,
+                deadline=deadline,
+                **kwargs,
             )
+            with timed_phase("composite"):
+                final_image.paste(layer_image)
+
+        if raw:
+            with timed_phase("encode"):
+                return RawImage.from_image(final_image, profile=self.encoding_profile)
 
         return final_image
 
@@ -1251,8 +1383,12 @@ class ImageServerResource(ArcGISTiledImageResource):
         get_parameters = {"f": "json"}
         match_fuzzy_keys = True
 
-    def get_image(self, extent, width, height, **kwargs):
-        """ Note: if tiled, extent will be modified to allow fetching tiles at appropriate zoom level """
+    @instrumented("get_image", timed=True)
+    def get_image(self, extent, width, height, deadline=None, raw=False, **kwargs):
+        """
+        Note: if tiled, extent will be modified to allow fetching tiles at appropriate zoom level
+        :param raw: if True, return a RawImage with the exported image bytes and content type, undecoded if possible
+        """
 
         image_params = {
             "pixelType": self.pixel_type,
@@ -1263,5 +1399,11 @@ class ImageServerResource(ArcGISTiledImageResource):
         image_params.update(kwargs)
 
         return self.generate_image_from_query(
-            extent, width, height, "exportImage", params=image_params
+            extent,
+            width,
+            height,
+            "exportImage",
+            params=image_params,
+            deadline=deadline,
+            raw=raw,
         )
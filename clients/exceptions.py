@@ -45,10 +45,18 @@ class ServiceError(ClientRequestError):
     """ A class to represent a range of service errors differentiated by status code """
 
 
+class ServiceMisconfigured(ServiceError):
+    """ A class to represent services reporting their own configuration errors, which will not resolve on retry """
+
+
 class ServiceTimeout(ServiceError, requests.exceptions.Timeout):
     """ A class to represent server-side timeouts, not client (408) """
 
 
+class ServiceUnavailable(NetworkError):
+    """ A class to represent requests not sent while the service host is known to be down """
+
+
 class ImageError(ClientError):
     def __init__(self, message, params=None, tile_info=None, **kwargs):
         super(ImageError, self).__init__(message, **kwargs)
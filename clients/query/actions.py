@@ -1,13 +1,28 @@
 import json
+from contextvars import ContextVar
 from restle import actions
 
 from ..utils.geometry import Extent
 from ..utils.geometry import SpatialReference
+from ..utils.metrics import RequestEvent, get_response_size, instrumentation
+from ..utils.profiling import timed_phase
+
+
+_querying = ContextVar("querying", default=None)
 
 
 class QueryAction(actions.Action):
     """ Perform a query on a feature service layer """
 
+    def __call__(self, resource, **kwargs):
+        """ Overridden to report the queried resource with each request made by the query """
+
+        token = _querying.set(resource)
+        try:
+            return super(QueryAction, self).__call__(resource, **kwargs)
+        finally:
+            _querying.reset(token)
+
     def prepare_params(self, params):
         """ Serializes extent, dictionary, and list parameter values as JSON """
 
@@ -17,3 +32,23 @@ class QueryAction(actions.Action):
             elif isinstance(v, (dict, list)):
                 params[k] = json.dumps(v)
         return super(QueryAction, self).prepare_params(params)
+
+    def do_request(self, url, params, content_type, session=None):
+        """ Overridden to report each query as a request event to any metrics listeners """
+
+        resource = _querying.get()
+        service_type = None if resource is None else type(resource).__name__
+        event = RequestEvent(service_type, "query", url, method=self.http_method)
+
+        try:
+            with timed_phase("network") as phase:
+                response = super(QueryAction, self).do_request(
+                    url, params, content_type, session
+                )
+                phase.bytes = get_response_size(response)
+        except Exception as ex:
+            instrumentation.emit_request(event.finish(error=ex))
+            raise
+
+        instrumentation.emit_request(event.finish(response))
+        return response
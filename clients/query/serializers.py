@@ -1,7 +1,14 @@
+from functools import lru_cache
+from xml.etree.ElementTree import ParseError, XMLPullParser
+
 from restle.serializers import JSONSerializer
 from parserutils.elements import element_to_object
 
 
+# Attribute names renamed with their tag, as by element_to_object, so they do not clash with object properties
+OBJECT_PROPERTIES = {"children", "type", "value"}
+
+
 class XMLToJSONSerializer(JSONSerializer):
     """ Deserializes XML as though it were JSON """
 
@@ -9,3 +16,114 @@ class XMLToJSONSerializer(JSONSerializer):
     def to_dict(s):
         root, data = element_to_object(s)
         return data[root]
+
+
+class StreamingXMLToJSONSerializer(XMLToJSONSerializer):
+    """
+    Deserializes XML to the same data as XMLToJSONSerializer, but parses it incrementally: each element is converted
+    as soon as it is read and then discarded, so no element tree of the whole document is built alongside the data.
+    The document text is still read whole, and all of the resulting data is returned at once.
+    """
+
+    chunk_size = 2**16  # Bytes or characters of the document fed to the parser at a time
+
+    @classmethod
+    def to_dict(cls, s):
+        parser = XMLPullParser(events=("start", "end"))
+        # The element, its converted children, and its last child awaiting a tail, for each open element
+        open_elements = []
+        converted = []
+
+        try:
+            for start in range(0, len(s), cls.chunk_size):
+                parser.feed(s[start : start + cls.chunk_size])
+                cls._read_events(parser, open_elements, converted)
+
+            parser.close()
+            cls._read_events(parser, open_elements, converted)
+
+        except ParseError:
+            # Prefixes without namespace declarations are not well-formed, but are read once namespaces are stripped
+            return super(StreamingXMLToJSONSerializer, cls).to_dict(s)
+
+        return converted[0] if converted else {}
+
+    @classmethod
+    def _read_events(cls, parser, open_elements, converted):
+        for event, element in parser.read_events():
+            if event == "start":
+                if open_elements:
+                    # Previous siblings are complete, tails included: keep only their converted data
+                    parent = open_elements[-1]
+                    cls._convert_last_child(parent)
+                    del parent[0][:-1]
+
+                open_elements.append([element, [], None])
+                continue
+
+            current = open_elements.pop()
+            cls._convert_last_child(current)
+            del element[:]
+
+            tag = _strip_namespace(element.tag)
+
+            obj = {}
+            _accumulate_values(obj, current[1])
+            _accumulate_values(
+                obj,
+                (
+                    (_strip_namespace(k), v)
+                    for k, v in element.attrib.items()
+                    if v and v.strip()
+                ),
+                tag,
+            )
+
+            if open_elements:
+                # Tail is read once the next sibling or the parent is
+                open_elements[-1][2] = (tag, obj, element)
+            else:
+                converted.append(_with_text(obj, element.text, element.tail))
+
+    @staticmethod
+    def _convert_last_child(open_element):
+        if open_element[2] is not None:
+            tag, obj, element = open_element[2]
+            open_element[1].append((tag, _with_text(obj, element.text, element.tail)))
+            open_element[2] = None
+
+
+@lru_cache(maxsize=4096)
+def _strip_namespace(name):
+    """ :return: the tag or attribute name without its namespace, shared by every element with the same name """
+    return name.rpartition("}")[2]
+
+
+def _accumulate_values(obj, values, tag=None):
+    """ Adds each value under its key, collecting values for repeated keys in a list """
+
+    for key, val in values:
+        # Ensure XML tags don't override or get overridden by object properties
+        key = f"{tag}_{key}" if tag and key in OBJECT_PROPERTIES else key
+        val = val.strip() if isinstance(val, str) else val
+
+        if key not in obj:
+            obj[key] = val
+        elif isinstance(obj[key], list):
+            obj[key].append(val)
+        else:
+            obj[key] = [obj[key], val]
+
+
+def _with_text(obj, text, tail):
+    """ :return: the object with its text and tail as value, or only the text if there is nothing else """
+
+    text_values = [t for t in ((text or "").strip(), (tail or "").strip()) if t]
+    text_values = (text_values[0] if len(text_values) == 1 else text_values) or ""
+
+    if not obj:
+        return text_values
+    elif text_values:
+        obj["value"] = text_values
+
+    return obj
@@ -1,5 +1,8 @@
+import asyncio
 import copy
+import itertools
 import requests
+import time
 
 from parserutils.collections import setdefaults, wrap_value
 from parserutils.strings import ALPHANUMERIC, snake_to_camel
@@ -7,9 +10,17 @@ from restle.resources import Resource
 from restle.exceptions import HTTPException, MissingFieldException, NotFoundException
 
 from .exceptions import ClientError, ContentError, HTTPError, MissingFields
-from .exceptions import NetworkError, ServiceError, ServiceTimeout, UnsupportedVersion
+from .exceptions import NetworkError, ServiceError, ServiceTimeout, ServiceUnavailable
+from .exceptions import UnsupportedVersion
 from .utils import classproperty
+from .utils.cache import negative_cache
+from .utils.concurrency import OVERLOAD_STATUSES, concurrency_limiters
 from .utils.conversion import to_words
+from .utils.deadlines import Deadline
+from .utils.metrics import RequestEvent, get_response_size, instrumentation
+from .utils.profiling import timed_phase
+from .utils.retries import RetryPolicy, circuit_breakers
+from .utils.sessions import ClientSession, DEFAULT_TIMEOUT, create_session
 
 
 DEFAULT_USER_AGENT = "Mozilla/5.0 (compatible; +https://databasin.org)"
@@ -21,18 +32,24 @@ class ClientResource(Resource):
     # Public class / instance variables
 
     default_spatial_ref = None
+    encoding_profile = "fast"  # Of ENCODING_PROFILES, for raw images not passed through
+    hedge_policy = None  # A HedgingPolicy, to hedge requests to idempotent endpoints
     incoming_casing = "camel"
     minimum_version = None
+    retry_policy = RetryPolicy()
     supported_versions = ()
 
     # Private class / instance constants
 
     _client_descriptor = None
     _client_user_agent = DEFAULT_USER_AGENT
+    _endpoint = "metadata"  # The kind of endpoint loaded, as reported to metrics listeners
+    _hedged = False  # Whether loading this resource is idempotent and cheap enough to hedge
 
     # Private variables instantiated in Resource.get
 
     _bypass_version = False
+    _deadline = None
     _layer_session = None
 
     def __init__(self, default_spatial_ref=None, **kwargs):
@@ -41,8 +58,7 @@ class ClientResource(Resource):
         if isinstance(session, type):
             session = session()
         elif not session:
-            session = requests.Session()
-            session.headers.update({"User-agent": self._client_user_agent})
+            session = create_session(user_agent=self._client_user_agent)
 
         if default_spatial_ref:
             self.default_spatial_ref = default_spatial_ref
@@ -106,10 +122,24 @@ class ClientResource(Resource):
     ):
         """ Populates a list of resources with only one external map service request """
 
+        with instrumentation.span("bulk_get", cls.__name__, url):
+            return cls._bulk_load(
+                url, strict, session, bulk_key, bulk_defaults, **kwargs
+            )
+
+    @classmethod
+    def _bulk_load(cls, url, strict, session, bulk_key, bulk_defaults, **kwargs):
+        """ Requests and populates resources for bulk_get """
+
+        # Shared by the request and each resource populated from it
+        deadline = kwargs["deadline"] = Deadline.from_value(kwargs.get("deadline"))
+
         self = cls.get(url, strict=strict, lazy=True, session=session, **kwargs)
 
         try:
-            response = self._make_request()
+            response = self._make_request(deadline=deadline)
+        except ClientError:
+            raise  # Prevents double wrapping errors that inherit from types handled below
         except requests.exceptions.HTTPError as ex:
             reason = getattr(ex.response, "reason", None)
             status_code = getattr(ex.response, "status_code", None)
@@ -225,7 +255,8 @@ class ClientResource(Resource):
                 resource = cls()
                 resource._get(url, **kwargs)
                 resource._url = url
-                resource.populate_field_values(data)
+                resource._populate(data)
+                resource._deadline = None  # Limits only the bulk_get call
                 objects.append(resource)
 
         return objects
@@ -234,38 +265,89 @@ class ClientResource(Resource):
     def get(cls, url, strict=True, lazy=True, session=None, **kwargs):
         """ Overridden to capture strict and lazy settings in the instance """
 
-        # Call lazily first for initialization only
-        self = super(ClientResource, cls).get(
-            url, strict=strict, lazy=True, session=session
-        )
-        self._lazy = lazy
-        self._strict = strict
+        with instrumentation.span("get", cls.__name__, url):
 
-        self._get(url, strict=strict, lazy=lazy, session=session, **kwargs)
+            # Call lazily first for initialization only
+            self = super(ClientResource, cls).get(
+                url, strict=strict, lazy=True, session=session
+            )
+            self._lazy = lazy
+            self._strict = strict
 
-        if not self._lazy:
-            self._load_resource()  # Load now that initialization is complete
+            self._get(url, strict=strict, lazy=lazy, session=session, **kwargs)
+
+            try:
+                if not self._lazy:
+                    self._load_resource()  # Load now that initialization is complete
+            finally:
+                # The deadline limits only this call: resources loaded lazily afterwards are not limited by it
+                self._deadline = None
 
         return self
 
+    @classmethod
+    async def aget(cls, url, strict=True, lazy=True, session=None, **kwargs):
+        """
+        Convenience for calling get from a coroutine: get runs as is in a worker thread, blocking that thread
+        on each request, and fanning out to layers, legends or NcWMS details with its own threads as it would.
+        This is not native async I/O: no request is made on the event loop, and no thread is saved.
+        Pass lazy=False to load in the worker thread: fields of lazy resources load, and block, on first access.
+        """
+
+        return await asyncio.to_thread(
+            cls.get, url, strict=strict, lazy=lazy, session=session, **kwargs
+        )
+
+    @classmethod
+    async def abulk_get(cls, url, **kwargs):
+        """
+        Convenience for calling bulk_get from a coroutine, in a worker thread blocked on its request:
+        this is not native async I/O, and no request is made on the event loop
+        """
+        return await asyncio.to_thread(cls.bulk_get, url, **kwargs)
+
     def _get(self, url, **kwargs):
         """ Override in children to implement pre-load functionality after instance creation in get """
 
         self._bypass_version = kwargs.pop("bypass_version", False)
+        self._deadline = Deadline.from_value(kwargs.pop("deadline", None))
         self._layer_session = kwargs.pop("layer_session", None) or self._session
 
     def _load_resource(self, as_unicode=True):
-        """ Overridden to customize clients exception handling """
+        """ Overridden to customize clients exception handling, and to remember services known to be broken """
+
+        cache_key = negative_cache.get_key(
+            self._url, self._params, bypass_version=self._bypass_version
+        )
+        cached_error = negative_cache.get(cache_key)
+
+        if cached_error is not None:
+            service_type = type(self).__name__
+            event = RequestEvent(service_type, self._endpoint, self._url, cache="hit")
+            instrumentation.emit_request(event.finish(error=cached_error))
+            raise cached_error
+
+        try:
+            self._load_resource_data(as_unicode)
+        except ClientError as ex:
+            negative_cache.add(cache_key, ex)
+            raise
+
+    def _load_resource_data(self, as_unicode=True):
+        """ Requests and populates resource data, raising client errors for any failure """
 
         try:
+            response = self._make_request(
+                deadline=self._deadline, hedge=self._hedged, cache="miss"
+            )
+
             if as_unicode:
-                super(ClientResource, self)._load_resource()
+                data = self._meta.deserializer.to_dict(response.text)
             else:
                 # Uses response.content (not response.text) for ASCII serialization
-                response = self._make_request()
-                self.populate_field_values(
-                    self._meta.deserializer.to_dict(response.content)
-                )
+                data = self._meta.deserializer.to_dict(response.content)
+
+            self._populate(data)
 
         except ClientError:
             raise  # Prevents double wrapping errors that inherit from types handled below
@@ -313,7 +395,7 @@ class ClientResource(Resource):
             unicode_error = isinstance(ex, UnicodeEncodeError)
 
             if unicode_error and as_unicode:
-                self._load_resource(as_unicode=False)
+                self._load_resource_data(as_unicode=False)
             elif unicode_error:
                 raise  # Already tried ASCII (response.content)
             else:
@@ -324,20 +406,189 @@ class ClientResource(Resource):
                     url=self._url,
                 )
 
-    def _make_request(self, url=None, params=None, **kwargs):
-        """ Encapsulates adding Data Basin user-agent to header for all requests """
+    def _populate(self, data):
+        """ Populates field values from loaded data, reported as a span to any metrics listeners """
+
+        service_type = type(self).__name__
+
+        with instrumentation.span("populate_field_values", service_type, self._url):
+            self.populate_field_values(data)
+
+    def _make_request(
+        self,
+        url=None,
+        params=None,
+        deadline=None,
+        hedge=False,
+        endpoint=None,
+        cache=None,
+        **kwargs,
+    ):
+        """
+        Encapsulates adding Data Basin user-agent to header for all requests, and applying timeouts.
+        Failed requests are retried according to self.retry_policy, but not sent at all to hosts known to be down.
+        Requests to each host are limited to the concurrency the host has been shown to handle.
+        Each request, with its retries, is reported as one RequestEvent to any metrics listeners.
+        :param deadline: a Deadline, or seconds, limiting the timeout to what remains of an operation's budget
+        :param hedge: if True, and self.hedge_policy is set, slow requests are duplicated: only for idempotent requests
+        :param endpoint: the kind of endpoint requested (metadata, layers, legend, tile, export, query)
+        :param cache: "miss" if the request was made only because no failure was cached for it
+        :param method: "head" to send a HEAD request with the session, which otherwise sends GET
+        """
 
         url = self._url if url is None else url
         params = self._params if params is None else params
 
+        event = RequestEvent(
+            type(self).__name__, endpoint or self._endpoint, url, cache=cache
+        )
+
+        try:
+            with timed_phase("network") as phase:
+                response = self._send_with_retries(
+                    url, params, Deadline.from_value(deadline), hedge, event, **kwargs
+                )
+                phase.bytes = get_response_size(response)
+        except Exception as ex:
+            instrumentation.emit_request(event.finish(error=ex))
+            raise
+
+        instrumentation.emit_request(event.finish(response))
+        return response
+
+    def _send_with_retries(self, url, params, deadline, hedge, event, **kwargs):
+        """ Sends and retries a request for _make_request, counting retries in the event """
+
+        timeout = kwargs.pop("timeout", None)
+
         headers = kwargs.pop("headers", self._session.headers)
         headers["User-agent"] = self._client_user_agent
 
-        response = self._session.get(url, params=params, headers=headers, **kwargs)
-        response.raise_for_status()
+        breaker = circuit_breakers.get_breaker(url)
+        limiter = concurrency_limiters.get_limiter(url)
+
+        for attempt in itertools.count():
+            event.retries = attempt
+
+            kwargs["timeout"] = self._get_timeout(url, timeout, deadline)
+
+            if not limiter.acquire(None if deadline is None else deadline.remaining):
+                raise self._deadline_error(url, deadline, params=params)
+
+            # Checked last, so that a probe of a suspended host is always sent once allowed
+            if not breaker.allow_request():
+                limiter.release()
+                raise ServiceUnavailable(
+                    "The map service host is not responding: requests are suspended",
+                    params=params,
+                    url=url,
+                )
+
+            try:
+                if hedge and self.hedge_policy is not None:
+                    response = self._send_hedged_request(
+                        limiter, url, params=params, headers=headers, **kwargs
+                    )
+                else:
+                    response = self._send_request(
+                        limiter, url, params=params, headers=headers, **kwargs
+                    )
+            except requests.exceptions.RequestException as ex:
+                breaker.record_failure()
+
+                if isinstance(ex, requests.exceptions.Timeout):
+                    if deadline is not None and deadline.expired:
+                        raise self._deadline_error(
+                            url, deadline, params=params, underlying=ex
+                        )
+
+                delay = self.retry_policy.get_delay(attempt, error=ex)
+                if not self._can_retry(delay, deadline):
+                    raise
+            except Exception:
+                breaker.cancel_probe()  # Not sent, or failed without any outcome
+                raise
+            else:
+                breaker.record_response(response)
+
+                delay = self.retry_policy.get_delay(attempt, response=response)
+                if not self._can_retry(delay, deadline):
+                    break
+
+            self.retry_policy.sleep(delay)
+
+        try:
+            response.raise_for_status()
+        except requests.exceptions.HTTPError as ex:
+            if ex.response is None:
+                ex.response = response  # Preserves status code for error handling
+            raise
 
         return response
 
+    def _send_request(self, limiter, url, **kwargs):
+        """ Sends a request in a slot already acquired from the limiter, adapting its limit to the outcome """
+
+        started = time.monotonic()
+        send = getattr(self._session, kwargs.pop("method", "get"))
+
+        try:
+            response = send(url, **kwargs)
+        except requests.exceptions.Timeout:
+            limiter.release(overloaded=True)
+            raise
+        except Exception:
+            limiter.release()
+            raise
+
+        overloaded = response.status_code in OVERLOAD_STATUSES
+        limiter.release(time.monotonic() - started, overloaded=overloaded)
+
+        return response
+
+    def _send_hedged_request(self, limiter, url, **kwargs):
+        """ Sends a request as in _send_request, with a duplicate in its own slot if it is slow to complete """
+
+        return self.hedge_policy.send(
+            url,
+            lambda: self._send_request(limiter, url, **kwargs),
+            acquire_slot=lambda: limiter.acquire(0),
+            release_slot=limiter.release,
+        )
+
+    def _can_retry(self, delay, deadline=None):
+        """ :return: True if a retry is due, and would be sent before any deadline """
+
+        if delay is None:
+            return False
+        return deadline is None or delay < deadline.remaining
+
+    def _get_timeout(self, url=None, timeout=None, deadline=None):
+        """
+        :return: the timeout for a request, or the session default, limited by what remains before a deadline
+        :raise ServiceTimeout: if the deadline has already passed
+        """
+
+        if timeout is None:
+            if isinstance(self._session, ClientSession):
+                timeout = self._session.timeout
+            else:
+                timeout = DEFAULT_TIMEOUT
+
+        if deadline is None:
+            return timeout
+        elif deadline.expired:
+            raise self._deadline_error(url or self._url, deadline)
+
+        return deadline.limit(timeout)
+
+    def _deadline_error(self, url, deadline, **kwargs):
+        return ServiceTimeout(
+            f"The map service did not respond within the deadline of {deadline.seconds} seconds",
+            url=url,
+            **kwargs,
+        )
+
     def populate_field_values(self, data):
         """ Overridden to define custom API for all resources, and validate Extent """
 
@@ -364,6 +615,13 @@ class ClientResource(Resource):
         class_name = type(self).__name__
         raise NotImplementedError(f"{class_name}.get_image")
 
+    async def aget_image(self, extent, width, height, **kwargs):
+        """
+        Convenience for calling get_image from a coroutine, in a worker thread blocked until it is rendered:
+        tiles and images are still requested on threads, not on the event loop
+        """
+        return await asyncio.to_thread(self.get_image, extent, width, height, **kwargs)
+
     def validate_version(self, version=None):
         """ Validates version against min and max defined on resource """
 
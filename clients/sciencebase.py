@@ -9,6 +9,8 @@ from .arcgis import ArcGISSecureResource, MapServerResource
 from .exceptions import HTTPError, NoLayers, ValidationError
 from .resources import ClientResource
 from .query.fields import DictField, ListField, ObjectField
+from .utils.metrics import instrumented
+from .utils.sessions import create_session, get_session
 from .wms import WMSResource
 
 
@@ -42,16 +44,22 @@ class ScienceBaseSession(SbSession, object):
         """ Overridden to reuse active login credentials without new login """
 
         super(ScienceBaseSession, self).__init__()
+
+        # Replace the session created by SbSession with a pooled one, keeping its headers
+        session = create_session()
+        session.headers.update(self._session.headers)
+        self._session = session
+
         init_sbsession(self, josso_session_id=josso_session_id, username=username)
 
     def get_public_url(self, response):
         return self._remove_josso_param(response.url)
 
-    def get_json(self, url, external_id=None):
-        """ Overridden to improve error handling """
+    def get_json(self, url, external_id=None, timeout=None):
+        """ Overridden to improve error handling, and to apply timeouts """
 
         url = update_url_params(url, format="json")
-        response = self._session.get(url)
+        response = self._session.get(url, timeout=timeout)
 
         try:
             response.raise_for_status()
@@ -67,17 +75,17 @@ class ScienceBaseSession(SbSession, object):
                 error, underlying=ex, url=url, status_code=response.status_code
             )
 
-        return self._get_json(response, external_id)
+        return self._get_json(response, external_id, timeout)
 
-    def _get_json(self, response, external_id=None):
+    def _get_json(self, response, external_id=None, timeout=None):
         """ Overridden to customize response content for ScienceBase items """
 
         if "/item/" in response.url:
-            return self._get_item_json(response, external_id)
+            return self._get_item_json(response, external_id, timeout)
 
         return super(ScienceBaseSession, self)._get_json(response)
 
-    def _get_item_json(self, response, external_id=None):
+    def _get_item_json(self, response, external_id=None, timeout=None):
         """ Adds derived information to an itemSettings property """
 
         item_json = super(ScienceBaseSession, self)._get_json(response)
@@ -90,8 +98,10 @@ class ScienceBaseSession(SbSession, object):
         if "permissions" not in item_json:
             # Permissions will be excluded from response if the requesting account doesn't have WRITE access
             try:
-                requests.get(
-                    self.get_public_url(response), params={"format": "json"}
+                get_session().get(
+                    self.get_public_url(response),
+                    params={"format": "json"},
+                    timeout=timeout,
                 ).raise_for_status()
             except requests.exceptions.HTTPError:
                 is_private = True  # Must be private if anonymous GET fails
@@ -273,13 +283,18 @@ class ScienceBaseResource(ClientResource):
             self._service_client = MapServerResource.get(
                 self.service_url,
                 lazy=True,
+                deadline=self._deadline,
                 **(self.arcgis_credentials if self.private else {}),
             )
             self.arcgis_credentials.update(self._service_client.arcgis_credentials)
 
         elif self.service_type == "wms":
             self._service_client = WMSResource.get(
-                self.service_url, lazy=True, token=self._token, token_id="josso"
+                self.service_url,
+                lazy=True,
+                token=self._token,
+                token_id="josso",
+                deadline=self._deadline,
             )
             self.josso_credentials.update(self._service_client.wms_credentials)
 
@@ -350,7 +365,8 @@ class ScienceBaseResource(ClientResource):
     def _load_resource(self):
         """ Overridden to make session handling compatible with SbSession """
 
-        self.populate_field_values(self._session.get_json(self._url, self._external_id))
+        timeout = self._get_timeout(deadline=self._deadline)
+        self._populate(self._session.get_json(self._url, self._external_id, timeout))
 
     def populate_field_values(self, data):
 
@@ -465,6 +481,7 @@ class ScienceBaseResource(ClientResource):
                     originator_txt += "({})".format(originator["company"])
                 self.originators.append(originator_txt)
 
+    @instrumented("get_image", timed=True)
     def get_image(self, extent, width, height, **kwargs):
         return self.get_service_client().get_image(
             extent=extent, width=width, height=height, **kwargs
@@ -6,5 +6,14 @@ from .wms_tests import WMSTestCase
 from .conversion_tests import ConversionTestCase
 from .geometry_tests import ExtentTestCase, SpatialReferenceTestCase, TileLevelsTestCase
 from .images_tests import ImagesTestCase
+from .legends_tests import LegendsTestCase
 from .query_tests import ActionsTestCase, FieldsTestCase, SerializersTestCase
 from .resource_tests import ClientResourceTestCase
+from .sessions_tests import SessionsTestCase
+from .deadlines_tests import DeadlinesTestCase
+from .retries_tests import RetriesTestCase
+from .cache_tests import NegativeCacheTestCase
+from .concurrency_tests import ConcurrencyTestCase
+from .hedging_tests import HedgingTestCase
+from .metrics_tests import MetricsTestCase
+from .profiling_tests import ProfilingTestCase
@@ -20,8 +20,10 @@ from ..arcgis import (
 )
 from ..exceptions import BadExtent, BadTileScheme, NoLayers, UnsupportedVersion
 from ..exceptions import ContentError, HTTPError, ImageError, ServiceError
+from ..exceptions import ServiceMisconfigured, ServiceTimeout
 from ..query.fields import RENDERER_DEFAULTS
 from ..utils.conversion import to_renderer
+from ..utils.profiling import collect_timings
 
 from .utils import MAPSERVICE_IMG_DIMS, ResourceTestCase, mock_thread
 from .utils import get_default_image, get_extent, get_extent_dict, get_object
@@ -358,6 +360,15 @@ class ArcGISTestCase(ResourceTestCase):
             ):
                 ImageServerResource.get(error_url, lazy=False)
 
+        with self.assertRaises(ServiceMisconfigured) as error:
+            MapServerResource.get(self.config_url, lazy=False)
+        self.assertEqual(error.exception.status_code, 503)
+
+        with self.assertRaises(ServiceError) as error:
+            MapServerResource.get(self.token_required_url, lazy=False)
+        self.assertNotIsInstance(error.exception, ServiceMisconfigured)
+        self.assertEqual(error.exception.status_code, 401)
+
         error_url = self.no_map_layers_url
         with self.assertRaises(
             NoLayers, msg=f"NoLayers not raised for map service: {error_url}"
@@ -827,6 +838,10 @@ class ArcGISTestCase(ResourceTestCase):
             target_hash="34595cff458cf8a204df84c5ef959984",
         )
 
+        self.assert_get_raw_image(
+            client, passthrough=False, dimensions=MAPSERVICE_IMG_DIMS, layers="show:0"
+        )
+
         extent = get_extent(web_mercator=True)
         extent.xmin -= 10
         extent.xmax += 10
@@ -840,6 +855,18 @@ class ArcGISTestCase(ResourceTestCase):
             target_hash="736d99610d0097be78651ecdae4714bb",
         )
 
+        # Test timings for each phase of tiled image generation, including tile threads
+
+        with collect_timings() as timings:
+            client.get_image(client.full_extent, *MAPSERVICE_IMG_DIMS)
+
+        tile_count = timings.get("network")["count"]
+        self.assertGreater(tile_count, 1)
+        self.assertEqual(timings.get("decode")["count"], tile_count)
+        self.assertGreater(timings.get("decode")["bytes"], 0)
+        self.assertEqual(timings.get("crop")["count"], 1)
+        self.assertGreater(timings.duration, 0)
+
         # Test non-tiled image generation
 
         client.tile_info = None
@@ -861,6 +888,11 @@ class ArcGISTestCase(ResourceTestCase):
             layers="show:0",
         )
 
+        # Test exported images are passed through, unless stitched across the central meridian
+
+        self.assert_get_raw_image(client, layers="show:0")
+        self.assert_get_raw_image(client, passthrough=False, extent=extent)
+
     @requests_mock.Mocker()
     def test_invalid_mapservice_image_request(self, mock_request):
         self.mock_arcgis_client(mock_request, "map")
@@ -881,6 +913,12 @@ class ArcGISTestCase(ResourceTestCase):
             with self.assertRaises(ImageError):
                 client.get_image(client.full_extent, *MAPSERVICE_IMG_DIMS)
 
+        # Fails once the deadline for all tiles has passed
+        with mock.patch("clients.arcgis.Thread", mock_thread):
+            client._session = self.mock_mapservice_session(self.error_path)
+            with self.assertRaises(ServiceTimeout):
+                client.get_image(client.full_extent, *MAPSERVICE_IMG_DIMS, deadline=0)
+
         self.assert_tile_scheme(client)
 
         # Test non-tiled image responses
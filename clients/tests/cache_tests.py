@@ -0,0 +1,218 @@
+import requests_mock
+
+from requests import exceptions
+from unittest import mock
+
+from ..exceptions import BadTileScheme, HTTPError, NoLayers, ServiceError
+from ..exceptions import ServiceMisconfigured, ServiceTimeout, ServiceUnavailable
+from ..exceptions import UnsupportedVersion
+from ..utils.cache import ContentCache, NegativeCache, negative_cache
+from ..utils.retries import RetryPolicy
+
+from .resource_tests import TestResource
+from .utils import ResourceTestCase
+
+
+class NegativeCacheTestCase(ResourceTestCase):
+    def setUp(self):
+        super(NegativeCacheTestCase, self).setUp()
+
+        self.resources_directory = self.data_directory / "resources"
+
+        self.client_url = "https://test.client.org/single/"
+        self.client_path = self.resources_directory / "test-client.json"
+        self.min_url = "https://test.client.org/invalid_min/"
+        self.min_path = self.resources_directory / "test-invalid-min.json"
+
+    def test_negative_cache(self):
+
+        cache = NegativeCache(ttl=60, max_entries=2)
+
+        # Test classification of errors
+
+        self.assertTrue(cache.is_cacheable(NoLayers("none")))
+        self.assertTrue(cache.is_cacheable(BadTileScheme("tiles")))
+        self.assertTrue(cache.is_cacheable(UnsupportedVersion("version")))
+        self.assertTrue(cache.is_cacheable(ServiceMisconfigured("config")))
+        self.assertTrue(cache.is_cacheable(ServiceError("auth", status_code=401)))
+        self.assertTrue(cache.is_cacheable(ServiceError("denied", status_code=403)))
+        self.assertTrue(cache.is_cacheable(ServiceError("missing", status_code=404)))
+        self.assertTrue(cache.is_cacheable(HTTPError("missing", status_code=404)))
+        self.assertTrue(cache.is_cacheable(HTTPError("gone", status_code=410)))
+
+        self.assertFalse(cache.is_cacheable(ServiceError("unknown")))
+        self.assertFalse(cache.is_cacheable(ServiceError("busy", status_code=503)))
+        self.assertFalse(cache.is_cacheable(ServiceError("error", status_code=500)))
+        self.assertFalse(cache.is_cacheable(ServiceError("token", status_code=498)))
+        self.assertFalse(cache.is_cacheable(ServiceError("token", status_code=499)))
+        self.assertFalse(cache.is_cacheable(ServiceTimeout("slow", status_code=504)))
+        self.assertFalse(cache.is_cacheable(ServiceUnavailable("down")))
+        self.assertFalse(cache.is_cacheable(HTTPError("broken", status_code=500)))
+        self.assertFalse(cache.is_cacheable(HTTPError("auth", status_code=401)))
+        self.assertFalse(cache.is_cacheable(ValueError("other")))
+
+        # Test keys by URL, params and options
+
+        key = cache.get_key(self.client_url, {"f": "json", "token": "abc"})
+        same_key = cache.get_key(self.client_url, {"token": "abc", "f": "json"})
+        self.assertEqual(key, same_key)
+        self.assertNotEqual(key, cache.get_key(self.client_url, {"f": "json"}))
+        self.assertNotEqual(
+            key, cache.get_key(self.client_url, {"f": "json"}, bypass_version=True)
+        )
+        self.assertEqual(
+            cache.get_key(self.client_url),
+            cache.get_key(self.client_url, bypass_version=False),
+        )
+
+        # Test that cached errors are raised again until they expire
+
+        error = ServiceError("missing", status_code=404, url=self.client_url)
+        cache.add(key, error)
+        cache.add("transient", ServiceTimeout("slow"))
+
+        self.assertEqual(len(cache), 1)
+        self.assertIsNone(cache.get("transient"))
+
+        with self.assertRaises(ServiceError) as cached:
+            cache.raise_cached(key)
+
+        self.assertIsNot(cached.exception, error)
+        self.assertEqual(cached.exception.status_code, 404)
+        self.assertEqual(cached.exception.url, self.client_url)
+
+        with mock.patch("clients.utils.cache.time.monotonic", return_value=10 ** 9):
+            self.assertIsNone(cache.get(key))
+        self.assertEqual(len(cache), 0)
+
+        # Test that the oldest entries are dropped when full
+
+        for idx in range(3):
+            cache.add(f"key{idx}", NoLayers(f"none{idx}"))
+
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get("key0"))
+        self.assertIsNotNone(cache.get("key2"))
+
+        cache.remove("key2")
+        self.assertIsNone(cache.get("key2"))
+
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+        # Test that a time to live of zero disables caching
+
+        cache.ttl = 0
+        cache.add(key, error)
+        self.assertIsNone(cache.get(key))
+
+    def test_content_cache(self):
+
+        cache = ContentCache(ttl=60, max_entries=2)
+
+        # Test that content is reused until it expires
+
+        cache.add("legend", b"content")
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.get("legend"), b"content")
+        self.assertIsNone(cache.get("other"))
+
+        with mock.patch("clients.utils.cache.time.monotonic", return_value=10 ** 9):
+            self.assertIsNone(cache.get("legend"))
+        self.assertEqual(len(cache), 0)
+
+        # Test that the oldest entries are dropped when full, counting re-added entries as newest
+
+        cache.add("key0", b"0")
+        cache.add("key1", b"1")
+        cache.add("key0", b"00")
+        cache.add("key2", b"2")
+
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get("key1"))
+        self.assertEqual(cache.get("key0"), b"00")
+
+        cache.remove("key0")
+        self.assertIsNone(cache.get("key0"))
+
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+        # Test that a time to live of zero disables caching
+
+        cache.ttl = 0
+        cache.add("legend", b"content")
+        self.assertIsNone(cache.get("legend"))
+
+    @requests_mock.Mocker()
+    def test_cached_access_denied(self, mock_request):
+
+        # Test that access denied is cached per token, so a new token is requested
+
+        mock_request.get(self.client_url, status_code=401)
+        denied_url = f"{self.client_url}?token=expired"
+
+        for _ in range(2):
+            with self.assertRaises(ServiceError) as error:
+                TestResource.get(denied_url, lazy=False)
+            self.assertEqual(error.exception.status_code, 401)
+
+        self.assertEqual(mock_request.call_count, 1)
+
+        self.mock_mapservice_request(
+            mock_request.get, self.client_url, self.client_path
+        )
+        client = TestResource.get(f"{self.client_url}?token=renewed", lazy=False)
+        self.assertEqual(client.id, "single")
+        self.assertEqual(mock_request.call_count, 2)
+
+        with self.assertRaises(ServiceError):
+            TestResource.get(denied_url, lazy=False)
+        self.assertEqual(mock_request.call_count, 2)
+
+    @requests_mock.Mocker()
+    def test_cached_load_failures(self, mock_request):
+
+        # Test that classified failures are raised again without requests
+
+        mock_request.get(self.client_url, status_code=404)
+
+        for _ in range(3):
+            with self.assertRaises(HTTPError) as error:
+                TestResource.get(self.client_url, lazy=False)
+            self.assertEqual(error.exception.status_code, 404)
+
+        self.assertEqual(mock_request.call_count, 1)
+
+        # Test that validation failures are cached separately from bypassed validation
+
+        self.mock_mapservice_request(mock_request.get, self.min_url, self.min_path)
+
+        with self.assertRaises(UnsupportedVersion):
+            TestResource.get(self.min_url, lazy=False)
+        with self.assertRaises(UnsupportedVersion):
+            TestResource.get(self.min_url, lazy=False)
+
+        self.assertEqual(mock_request.call_count, 2)
+
+        client = TestResource.get(self.min_url, lazy=False, bypass_version=True)
+        self.assertEqual(client.version, 9.9)
+        self.assertEqual(mock_request.call_count, 3)
+
+        # Test that transient failures are not cached
+
+        negative_cache.clear()
+        mock_request.get(self.client_url, exc=exceptions.ReadTimeout)
+
+        with mock.patch.object(TestResource, "retry_policy", RetryPolicy(retries=0)):
+            for _ in range(2):
+                with self.assertRaises(ServiceTimeout):
+                    TestResource.get(self.client_url, lazy=False)
+
+        self.assertEqual(mock_request.call_count, 5)
+        self.assertEqual(len(negative_cache), 0)
+
+        self.mock_mapservice_request(
+            mock_request.get, self.client_url, self.client_path
+        )
+        self.assertEqual(TestResource.get(self.client_url, lazy=False).id, "single")
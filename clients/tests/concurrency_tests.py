@@ -0,0 +1,183 @@
+import requests_mock
+import threading
+
+from requests import exceptions
+from unittest import mock
+
+from ..exceptions import HTTPError
+from ..utils.concurrency import AdaptiveLimiter, LimiterRegistry
+from ..utils.concurrency import concurrency_limiters, map_concurrently
+from ..utils.retries import RetryPolicy
+
+from .resource_tests import TestResource
+from .utils import ResourceTestCase
+
+
+class ConcurrencyTestCase(ResourceTestCase):
+    def setUp(self):
+        super(ConcurrencyTestCase, self).setUp()
+
+        self.client_url = "https://test.client.org/single/"
+        self.client_path = self.data_directory / "resources" / "test-client.json"
+
+    def test_adaptive_limiter(self):
+
+        limiter = AdaptiveLimiter(initial_limit=2, min_limit=1, max_limit=4)
+        self.assertEqual(
+            limiter.get_stats(), {"limit": 2, "in_flight": 0, "queued": 0}
+        )
+
+        # Test additive increase while latency stays flat
+
+        for _ in range(4):
+            self.assertTrue(limiter.acquire())
+            limiter.release(0.1)
+
+        self.assertEqual(limiter.get_stats()["limit"], 3)
+
+        for _ in range(20):
+            self.assertTrue(limiter.acquire())
+            limiter.release(0.1)
+
+        self.assertEqual(limiter.get_stats()["limit"], 4)
+
+        # Test no increase when latency rises well above the baseline
+
+        limit = limiter.limit = 3.0
+        for _ in range(5):
+            self.assertTrue(limiter.acquire())
+            limiter.release(1.0)
+
+        self.assertEqual(limiter.limit, limit)
+
+        # Test multiplicative decrease on overload, no lower than the minimum
+
+        self.assertTrue(limiter.acquire())
+        limiter.release(overloaded=True)
+        self.assertEqual(limiter.limit, 1.5)
+
+        self.assertTrue(limiter.acquire())
+        limiter.release(overloaded=True)
+        self.assertEqual(limiter.limit, 1)
+
+        # Test that requests beyond the limit are queued
+
+        self.assertTrue(limiter.acquire())
+        self.assertFalse(limiter.acquire(timeout=0.01))
+
+        waiting = threading.Thread(target=limiter.acquire)
+        waiting.start()
+
+        while not limiter.get_stats()["queued"]:
+            waiting.join(0.001)
+
+        self.assertEqual(
+            limiter.get_stats(), {"limit": 1, "in_flight": 1, "queued": 1}
+        )
+
+        limiter.release()
+        waiting.join()
+
+        self.assertEqual(
+            limiter.get_stats(), {"limit": 1, "in_flight": 1, "queued": 0}
+        )
+
+        # Test request slots held for other kinds of requests
+
+        limiter = AdaptiveLimiter(initial_limit=2)
+
+        with limiter.request():
+            self.assertEqual(limiter.get_stats()["in_flight"], 1)
+        self.assertEqual(limiter.get_stats()["in_flight"], 0)
+
+        with self.assertRaises(exceptions.ReadTimeout):
+            with limiter.request():
+                raise exceptions.ReadTimeout
+        self.assertEqual(limiter.get_stats()["limit"], 1)
+
+        with limiter.request():
+            with self.assertRaises(exceptions.Timeout):
+                with limiter.request(timeout=0.01):
+                    pass
+
+    def test_limiter_registry(self):
+
+        registry = LimiterRegistry(initial_limit=3, max_limit=8)
+
+        limiter = registry.get_limiter(self.client_url)
+        other_path = registry.get_limiter("https://test.client.org/other/")
+        other_host = registry.get_limiter("https://other.client.org/")
+        self.assertIs(limiter, other_path)
+        self.assertIsNot(limiter, other_host)
+        self.assertEqual(limiter.get_stats()["limit"], 3)
+        self.assertEqual(limiter.max_limit, 8)
+
+        registry.configure_host("test.client.org", initial_limit=16, max_limit=64)
+
+        limiter = registry.get_limiter(self.client_url)
+        self.assertEqual(limiter.get_stats()["limit"], 16)
+        self.assertEqual(limiter.max_limit, 64)
+
+        limiter.acquire()
+        self.assertEqual(
+            registry.get_stats(),
+            {
+                "test.client.org": {"limit": 16, "in_flight": 1, "queued": 0},
+                "other.client.org": {"limit": 3, "in_flight": 0, "queued": 0},
+            },
+        )
+
+        registry.reset()
+        self.assertEqual(registry.get_stats(), {})
+
+    def test_map_concurrently(self):
+
+        self.assertEqual(map_concurrently(str, []), [])
+        self.assertEqual(map_concurrently(str, [1]), ["1"])
+        self.assertEqual(
+            map_concurrently(str, range(50), max_workers=4),
+            [str(i) for i in range(50)],
+        )
+
+        def fail_on_three(item):
+            if item == 3:
+                raise ValueError(item)
+            return item
+
+        with self.assertRaises(ValueError):
+            map_concurrently(fail_on_three, range(6))
+
+    @requests_mock.Mocker()
+    def test_resource_concurrency(self, mock_request):
+        self.mock_mapservice_request(
+            mock_request.get, self.client_url, self.client_path
+        )
+
+        limiter = concurrency_limiters.get_limiter(self.client_url)
+        initial_limit = limiter.limit
+
+        TestResource.get(self.client_url, lazy=False)
+        self.assertGreater(limiter.limit, initial_limit)
+        self.assertEqual(limiter.get_stats()["in_flight"], 0)
+
+        # Test that throttling and timeouts cut the limit
+
+        mock_request.get(self.client_url, status_code=429)
+
+        with mock.patch.object(TestResource, "retry_policy", RetryPolicy(retries=0)):
+            with self.assertRaises(HTTPError):
+                TestResource.get(self.client_url, lazy=False)
+
+            self.assertLess(limiter.limit, initial_limit)
+            self.assertEqual(limiter.get_stats()["in_flight"], 0)
+
+            limit = limiter.limit
+            mock_request.get(self.client_url, exc=exceptions.ConnectTimeout)
+
+            with self.assertRaises(exceptions.Timeout):
+                TestResource.get(self.client_url, lazy=False)
+
+            self.assertLess(limiter.limit, limit)
+            self.assertEqual(limiter.get_stats()["in_flight"], 0)
+
+        self.assertIn("test.client.org", concurrency_limiters.get_stats())
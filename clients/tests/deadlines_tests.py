@@ -0,0 +1,139 @@
+import json
+import requests_mock
+
+from requests import exceptions
+
+from ..exceptions import ServiceTimeout
+from ..utils.deadlines import Deadline
+from ..utils.sessions import DEFAULT_TIMEOUT
+
+from .resource_tests import TestResource
+from .utils import ResourceTestCase
+
+
+class DeadlinesTestCase(ResourceTestCase):
+    def setUp(self):
+        super(DeadlinesTestCase, self).setUp()
+
+        self.clients_directory = self.data_directory / "resources"
+
+        self.client_url = "https://test.client.org/single/"
+        self.client_path = self.clients_directory / "test-client.json"
+        self.bulk_url = "https://test.client.org/bulk/"
+        self.bulk_path = self.clients_directory / "test-client-bulk.json"
+
+    def test_deadline(self):
+
+        self.assertIsNone(Deadline.from_value(None))
+
+        deadline = Deadline.from_value(30)
+        self.assertIs(Deadline.from_value(deadline), deadline)
+        self.assertEqual(deadline.seconds, 30)
+        self.assertFalse(deadline.expired)
+        self.assertTrue(0 < deadline.remaining <= 30)
+
+        # Test timeouts limited by the time remaining
+
+        self.assertTrue(25 < deadline.limit() <= 30)
+        self.assertEqual(deadline.limit(10), 10)
+        self.assertTrue(25 < deadline.limit(120) <= 30)
+
+        connect, read = deadline.limit(DEFAULT_TIMEOUT)
+        self.assertEqual(connect, 10)
+        self.assertTrue(25 < read <= 30)
+
+        connect, read = deadline.limit((None, 5))
+        self.assertTrue(25 < connect <= 30)
+        self.assertEqual(read, 5)
+
+        # Test expired deadlines
+
+        deadline = Deadline(0)
+        self.assertTrue(deadline.expired)
+        self.assertEqual(deadline.remaining, 0)
+        self.assertTrue(0 < deadline.limit(10) < 1)
+
+    @requests_mock.Mocker()
+    def test_default_timeouts(self, mock_request):
+        self.mock_mapservice_request(
+            mock_request.get, self.client_url, self.client_path
+        )
+
+        TestResource.get(self.client_url, lazy=False)
+        self.assertEqual(mock_request.last_request.timeout, DEFAULT_TIMEOUT)
+
+        # Test that sessions not created from the factory are also given timeouts
+
+        session = self.mock_mapservice_session(self.client_path)
+        TestResource.get(self.client_url, lazy=False, session=session)
+
+        self.assertEqual(session.get.call_args[1]["timeout"], DEFAULT_TIMEOUT)
+
+    @requests_mock.Mocker()
+    def test_resource_deadlines(self, mock_request):
+        self.mock_mapservice_request(
+            mock_request.get, self.client_url, self.client_path
+        )
+
+        client = TestResource.get(self.client_url, lazy=False, deadline=30)
+        self.assertIsNone(client._deadline)
+        self.assertEqual(client.id, "single")
+
+        connect, read = mock_request.last_request.timeout
+        self.assertEqual(connect, 10)
+        self.assertTrue(25 < read <= 30)
+
+        # Test that the deadline limits only the get call, not fields loaded lazily after it has passed
+
+        deadline = Deadline(30)
+        client = TestResource.get(self.client_url, lazy=True, deadline=deadline)
+        deadline.expires -= 60
+
+        self.assertTrue(deadline.expired)
+        self.assertEqual(client.id, "single")
+        self.assertEqual(mock_request.last_request.timeout, DEFAULT_TIMEOUT)
+
+        # Test that bulk resources are requested within the deadline, but are not limited by it afterwards
+
+        session = self.mock_mapservice_session(self.bulk_path)
+        response = session.get.return_value
+        response.json.return_value = json.loads(response.text)
+
+        deadline = Deadline(30)
+        clients = TestResource.bulk_get(
+            self.bulk_url, session=session, deadline=deadline
+        )
+        self.assertTrue(clients)
+        for client in clients:
+            self.assertIsNone(client._deadline)
+
+        connect, read = session.get.call_args[1]["timeout"]
+        self.assertEqual(connect, 10)
+        self.assertTrue(25 < read <= 30)
+
+        # Test that requests are not sent once the deadline has passed
+
+        request_count = mock_request.call_count
+
+        with self.assertRaises(ServiceTimeout):
+            TestResource.get(self.client_url, lazy=False, deadline=Deadline(0))
+        with self.assertRaises(ServiceTimeout):
+            TestResource.bulk_get(self.bulk_url, deadline=0)
+
+        self.assertEqual(mock_request.call_count, request_count)
+
+        # Test that timeouts are reported as exceeding the deadline
+
+        deadline = Deadline(30)
+
+        def expire_deadline(request, context):
+            deadline.expires -= 60
+            raise exceptions.ReadTimeout
+
+        mock_request.get(self.client_url, text=expire_deadline)
+
+        with self.assertRaises(ServiceTimeout) as error:
+            TestResource.get(self.client_url, lazy=False, deadline=deadline)
+
+        self.assertIn("deadline", str(error.exception))
+        self.assertIsInstance(error.exception.underlying, exceptions.ReadTimeout)
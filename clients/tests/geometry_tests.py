@@ -7,6 +7,7 @@ from ..arcgis import ARCGIS_RESOLUTIONS
 from ..exceptions import BadExtent, BadSpatialReference
 from ..utils.geometry import Extent, SpatialReference, TileLevels
 from ..utils.geometry import extract_significant_digits, union_extent
+from ..utils.geometry import get_transformer, project_extents
 from ..utils.geometry import (
     GLOBAL_EXTENT_WEB_MERCATOR,
     GLOBAL_EXTENT_WGS84,
@@ -604,6 +605,57 @@ class ExtentTestCase(GeometryTestCase):
         self.assertEqual(result.as_list(precision=7), target)
         self.assertEqual(result.spatial_reference.srs, mercator_srs)
 
+    def test_project_extents(self):
+
+        # Test invalid cases
+
+        with self.assertRaises(ValueError, msg="Invalid target projection"):
+            project_extents([get_extent()], "EPSG:26910")
+
+        extent_dict = get_extent().as_dict()
+        extent_dict["spatialReference"] = {"wkid": 44000}
+        with self.assertRaises(
+            ValueError, msg="Spatial reference is not valid for proj4"
+        ):
+            project_extents([get_extent(), Extent(extent_dict)])
+
+        # Test success cases
+
+        self.assertEqual(project_extents([]), [])
+
+        extents = [
+            get_extent(),
+            get_extent(web_mercator=True),
+            Extent([-120, 40, -110, 45], spatial_reference="EPSG:4326"),
+            Extent([500000, 4000000, 600000, 4100000], spatial_reference="EPSG:26910"),
+            Extent([0, 0, 10, 10], spatial_reference={"wkid": 4326}),
+        ]
+        for target_srs, project in (
+            ("EPSG:3857", Extent.project_to_web_mercator),
+            ("EPSG:4326", Extent.project_to_geographic),
+        ):
+            # Test batched extents are projected as they would be one at a time
+            targets = [project(extent) for extent in extents]
+            results = project_extents(extents, target_srs)
+
+            self.assertEqual(len(results), len(targets))
+            for result, target in zip(results, targets):
+                self.assertEqual(result.as_list(), target.as_list())
+                self.assertEqual(result.spatial_reference.srs, target_srs)
+                self.assertIsNot(result, target)
+
+        # Test transformers are created once for each pair of projections
+        get_transformer.cache_clear()
+
+        project_extents(extents)
+        project_extents(extents)
+        cache_info = get_transformer.cache_info()
+        self.assertEqual(cache_info.misses, 2)
+        self.assertEqual(cache_info.hits, 2)
+
+        with self.assertRaises(BadSpatialReference):
+            get_transformer("EPSG:0", "EPSG:3857")
+
     def test_extent_get_scale_string(self):
 
         image_width = 946
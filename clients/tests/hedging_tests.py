@@ -0,0 +1,215 @@
+import threading
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextvars import ContextVar
+from requests import exceptions
+from unittest import mock
+
+from ..utils.hedging import HedgingPolicy
+
+from .resource_tests import TestResource
+from .utils import ResourceTestCase
+
+
+class HedgingTestCase(ResourceTestCase):
+    def setUp(self):
+        super(HedgingTestCase, self).setUp()
+
+        self.client_url = "https://test.client.org/single/"
+        self.client_path = self.data_directory / "resources" / "test-client.json"
+
+    def test_hedging_policy(self):
+
+        policy = HedgingPolicy(percentile=90, max_extra_ratio=0.1, min_samples=5)
+
+        # Test that requests are not hedged until enough latencies are recorded
+
+        for latency in (0.1, 0.2, 0.3, 0.4):
+            policy.record(self.client_url, latency)
+        self.assertIsNone(policy.get_delay(self.client_url))
+
+        for latency in range(5, 11):
+            policy.record(self.client_url, latency / 10)
+
+        self.assertEqual(policy.get_delay(self.client_url), 1.0)
+        self.assertIsNone(policy.get_delay("https://other.client.org/"))
+
+        policy.min_delay = 2
+        self.assertEqual(policy.get_delay(self.client_url), 2)
+
+        # Test that duplicates are capped as a ratio of requests
+
+        self.assertFalse(policy.allow_hedge(self.client_url))
+
+        policy._hosts["test.client.org"]["requests"] = 20
+        self.assertFalse(policy.allow_hedge(self.client_url, lambda: False))
+        self.assertTrue(policy.allow_hedge(self.client_url))
+        self.assertTrue(policy.allow_hedge(self.client_url))
+        self.assertFalse(policy.allow_hedge(self.client_url))
+
+        self.assertEqual(
+            policy.get_stats(),
+            {"test.client.org": {"requests": 20, "hedged": 2, "delay": 2}},
+        )
+
+        policy.reset()
+        self.assertEqual(policy.get_stats(), {})
+
+    def test_hedged_send(self):
+
+        policy = HedgingPolicy(max_extra_ratio=1, min_samples=1, min_delay=0.01)
+        policy.record(self.client_url, 0.01)
+
+        # Test that a fast response is returned without sending a duplicate
+
+        self.assertEqual(policy.send(self.client_url, lambda: "fast"), "fast")
+        self.assertEqual(policy.get_stats()["test.client.org"]["hedged"], 0)
+
+        # Test that the duplicate of a stalled request wins
+
+        stalled = threading.Event()
+        responses = [mock.Mock(stalled=True), mock.Mock(stalled=False)]
+
+        def send_request():
+            response = responses.pop(0)
+            if response.stalled:
+                stalled.wait(5)
+            return response
+
+        stalled_response = responses[0]
+        response = policy.send(self.client_url, send_request)
+        self.assertFalse(response.stalled)
+        self.assertEqual(policy.get_stats()["test.client.org"]["hedged"], 1)
+
+        executor = policy._executor
+        self.assertIsNotNone(executor)
+
+        stalled.set()
+
+        for _ in range(50):  # The discarded response is closed once received
+            if stalled_response.close.called:
+                break
+            threading.Event().wait(0.01)
+
+        self.assertTrue(stalled_response.close.called)
+        response.close.assert_not_called()
+
+        # Test that attempts are sent from the same executor
+
+        self.assertEqual(policy.send(self.client_url, lambda: "fast"), "fast")
+        self.assertIs(policy._executor, executor)
+
+        # Test that no duplicate is sent while all workers are busy
+
+        policy = HedgingPolicy(
+            max_extra_ratio=1, min_samples=1, min_delay=0.01, max_workers=1
+        )
+        policy.record(self.client_url, 0.01)
+
+        calls = []
+
+        def send_slowly():
+            calls.append(1)
+            threading.Event().wait(0.1)
+            return "slow"
+
+        self.assertEqual(policy.send(self.client_url, send_slowly), "slow")
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(policy.get_stats()["test.client.org"]["hedged"], 0)
+
+        # Test that no duplicate is sent without a free slot
+
+        policy = HedgingPolicy(max_extra_ratio=1, min_samples=1, min_delay=0.01)
+        policy.record(self.client_url, 0.01)
+
+        calls = []
+        self.assertEqual(
+            policy.send(self.client_url, send_slowly, acquire_slot=lambda: False),
+            "slow",
+        )
+        self.assertEqual(len(calls), 1)
+
+        # Test that the slot of a duplicate cancelled before it is sent is released
+
+        policy = HedgingPolicy(max_extra_ratio=1, min_samples=1, min_delay=0.01)
+        policy.record(self.client_url, 0.01)
+
+        executor = ThreadPoolExecutor(max_workers=1)
+        unsent = Future()
+
+        def submit(fn, *args):
+            return executor.submit(fn, *args) if not calls else unsent
+
+        calls = []
+        policy._executor = mock.Mock(submit=submit)
+        release_slot = mock.Mock()
+
+        self.assertEqual(
+            policy.send(self.client_url, send_slowly, release_slot=release_slot),
+            "slow",
+        )
+        self.assertTrue(unsent.cancelled())
+        self.assertEqual(release_slot.call_count, 1)
+        executor.shutdown()
+
+        # Test that each attempt is sent with the context of the caller
+
+        policy = HedgingPolicy(max_extra_ratio=1, min_samples=1, min_delay=0.01)
+        policy.record(self.client_url, 0.01)
+
+        context_var = ContextVar("context_var", default=None)
+        context_var.set("caller")
+        seen = []
+
+        def send_in_context():
+            seen.append(context_var.get())
+            threading.Event().wait(0.05 if len(seen) == 1 else 0)
+            return "sent"
+
+        self.assertEqual(policy.send(self.client_url, send_in_context), "sent")
+        self.assertEqual(seen, ["caller", "caller"])
+
+        # Test that the first error is raised only if both requests fail
+
+        policy = HedgingPolicy(max_extra_ratio=1, min_samples=1, min_delay=0.01)
+        policy.record(self.client_url, 0.01)
+
+        def fail_slowly():
+            threading.Event().wait(0.05)
+            raise exceptions.ConnectionError("failed")
+
+        with self.assertRaises(exceptions.ConnectionError):
+            policy.send(self.client_url, fail_slowly)
+
+        self.assertEqual(policy.get_stats()["test.client.org"]["hedged"], 1)
+
+    def test_hedged_requests(self):
+
+        stalled = threading.Event()
+        calls = []
+
+        def get(url, **kwargs):
+            calls.append(url)
+            if len(calls) == 1:
+                stalled.wait(5)
+            return mock.Mock(status_code=200, stalled=len(calls) == 1)
+
+        session = mock.Mock(headers={}, get=get)
+        client = TestResource.get(self.client_url, lazy=True, session=session)
+
+        policy = HedgingPolicy(max_extra_ratio=1, min_samples=1, min_delay=0.01)
+        policy.record(self.client_url, 0.01)
+
+        with mock.patch.object(TestResource, "hedge_policy", policy):
+
+            # Test that requests are hedged only when specified as idempotent
+
+            response = client._make_request(hedge=True)
+            stalled.set()
+
+            self.assertFalse(response.stalled)
+            self.assertEqual(len(calls), 2)
+            self.assertEqual(policy.get_stats()["test.client.org"]["hedged"], 1)
+
+            client._make_request()
+            self.assertEqual(len(calls), 3)
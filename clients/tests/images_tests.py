@@ -12,8 +12,9 @@ from ..utils.images import (
     image_to_string,
 )
 from ..utils.images import count_colors, make_color_transparent
-from ..utils.images import overlay_images, stack_images_vertically
-from ..utils.images import IMG_BASE64_PREFIX
+from ..utils.images import encode_image, overlay_images, stack_images_vertically
+from ..utils.images import Base64Writer, write_image_base64
+from ..utils.images import IMG_BASE64_PREFIX, RawImage
 
 from .utils import BaseTestCase
 
@@ -55,6 +56,43 @@ class ImagesTestCase(BaseTestCase):
         test_base64 = image_to_base64(test_image, image_format="JPEG")
         self.assertEqual(test_base64, TEST_JPG_BASE64)
 
+        # Test TIFF conversion, which is saved by seeking back
+
+        test_base64 = image_to_base64(self.test_png, image_format="TIFF")
+        self.assertEqual(b64decode(test_base64), image_to_bytes(self.test_png, "TIFF"))
+
+        test_image = base64_to_image(test_base64)
+        self.assertEqual(test_image.format, "TIFF")
+        self.assertEqual(test_image.tobytes(), self.test_png.tobytes())
+
+        test_string = image_to_string(self.test_png, "TIFF", prefix=False)
+        self.assertEqual(test_string, test_base64.decode())
+
+    def test_write_image_base64(self):
+
+        # Test base64 is the same however writes are split
+
+        data = bytes(range(256)) * 3
+        for size in (1, 2, 3, 4, 7, 64):
+            output = io.BytesIO()
+            with Base64Writer(output) as writer:
+                for start in range(0, len(data), size):
+                    writer.write(memoryview(data)[start : start + size])
+            self.assertEqual(output.getvalue(), b64encode(data))
+
+        # Test writing to binary and text outputs, with and without a prefix
+
+        expected = image_to_base64(self.test_png, "PNG")
+
+        output = write_image_base64(self.test_png, io.BytesIO(), "PNG")
+        self.assertEqual(output.getvalue(), expected)
+
+        output = write_image_base64(self.test_png, io.StringIO(), "PNG", prefix=True)
+        self.assertEqual(output.getvalue(), (IMG_BASE64_PREFIX + expected).decode())
+
+        with self.assertRaises(ValueError):
+            write_image_base64(None, io.BytesIO())
+
     def test_image_to_bytes(self):
 
         with self.assertRaises(ValueError):
@@ -76,8 +114,70 @@ class ImagesTestCase(BaseTestCase):
         test_bytes = image_to_bytes(self.test_jpg, quality=100, optimize=True)
         self.assertEqual(test_bytes, TEST_JPG_BYTES)
 
-    @mock.patch("clients.utils.images.requests.get")
-    def test_image_to_string(self, mock_get):
+        # Test encoding profiles
+
+        with self.assertRaises(ValueError):
+            image_to_bytes(self.test_png, profile="nope")
+
+        for profile in ("fast", "balanced", "small"):
+            test_bytes = image_to_bytes(self.test_jpg, "PNG", profile=profile)
+            decoded = Image.open(io.BytesIO(test_bytes))
+            self.assertEqual(decoded.convert("RGB").tobytes(), self.test_jpg.tobytes())
+
+        # Test images with few colors are stored losslessly in a palette, unless encoding fast
+
+        few_colors = Image.new("RGBA", (64, 64), (0, 0, 0, 0))
+        few_colors.paste((205, 205, 205, 255), (0, 0, 32, 32))
+
+        decoded = Image.open(io.BytesIO(image_to_bytes(few_colors, profile="balanced")))
+        self.assertEqual(decoded.mode, "P")
+        self.assertEqual(decoded.convert("RGBA").tobytes(), few_colors.tobytes())
+
+        decoded = Image.open(io.BytesIO(image_to_bytes(few_colors, profile="fast")))
+        self.assertEqual(decoded.mode, "RGBA")
+
+    def test_encode_image(self):
+
+        with self.assertRaises(ValueError):
+            encode_image(None)
+        with self.assertRaises(ValueError):
+            encode_image(self.test_jpg, profile="nope")
+
+        gradient = Image.linear_gradient("L")
+        many_colors = Image.merge(
+            "RGB", (gradient, gradient.rotate(90), Image.radial_gradient("L"))
+        )
+
+        self.assertEqual(encode_image(many_colors).content_type, "image/png")
+        self.assertEqual(encode_image(many_colors, "small").content_type, "image/webp")
+        self.assertEqual(encode_image(self.test_png, "small").content_type, "image/png")
+
+        transparent = many_colors.convert("RGBA")
+        transparent.putpixel((0, 0), (0, 0, 0, 0))
+        self.assertEqual(encode_image(transparent, "small").content_type, "image/png")
+
+        raw_image = encode_image(many_colors, "small", image_format="jpeg")
+        self.assertEqual(raw_image.content_type, "image/jpeg")
+        self.assertEqual(raw_image.to_image().size, many_colors.size)
+
+        # Test raw images encoded as PNG with the fast profile, unless another is given
+
+        raw_image = RawImage.from_image(many_colors)
+        self.assertEqual(raw_image.content_type, "image/png")
+        self.assertEqual(
+            raw_image.content, encode_image(many_colors, "fast", "PNG").content
+        )
+
+        raw_image = RawImage.from_image(self.test_png, "GIF", profile="small")
+        self.assertEqual(raw_image.content_type, "image/gif")
+        self.assertEqual(
+            raw_image.content, image_to_bytes(self.test_png, "GIF", profile="small")
+        )
+
+    @mock.patch("clients.utils.images.get_session")
+    def test_image_to_string(self, mock_session):
+
+        mock_get = mock_session.return_value.get
 
         # Test invalid cases
 
@@ -187,11 +287,32 @@ class ImagesTestCase(BaseTestCase):
         self.assertEqual(color_count, 0)
 
         color_count = count_colors(self.test_png)
-        self.assertEqual(color_count, 1.75)
+        self.assertEqual(color_count, 3)
 
         color_count = count_colors(self.test_jpg)
         self.assertEqual(color_count, 6)
 
+        # Test counting stops once there are more colors than the maximum
+
+        self.assertEqual(count_colors(self.test_jpg, max_colors=3), 4)
+        self.assertEqual(count_colors(self.test_png, max_colors=3), 3)
+        self.assertEqual(count_colors(self.test_png, max_colors=1), 2)
+
+        gradient = Image.linear_gradient("L")
+        self.assertEqual(count_colors(gradient), 256)
+        self.assertEqual(count_colors(gradient.convert("RGBA")), 256)
+        self.assertEqual(count_colors(gradient.convert("RGB"), max_colors=3), 4)
+
+        # Test palette colors are counted once, and differ by transparency
+
+        palette_image = Image.new("P", (2, 1))
+        palette_image.putpalette([10, 20, 30, 10, 20, 30])
+        palette_image.putpixel((1, 0), 1)
+        self.assertEqual(count_colors(palette_image), 1)
+
+        palette_image.info["transparency"] = 1
+        self.assertEqual(count_colors(palette_image), 2)
+
     def test_overlay_images(self):
 
         with self.assertRaises(ValueError):
@@ -207,6 +328,20 @@ class ImagesTestCase(BaseTestCase):
         result = get_base64_for(overlaid, "PNG")
         self.assertEqual(result, TEST_OVERLAID_PNG_JPG)
 
+        # Test that fully transparent images are skipped, and opaque images hide those below
+
+        transparent = Image.new("RGBA", self.test_jpg.size, (0, 0, 0, 0))
+        overlaid = overlay_images([self.test_png, self.test_jpg, transparent])
+        result = get_base64_for(overlaid, "PNG")
+        self.assertEqual(result, TEST_OVERLAID_PNG_JPG)
+
+        overlaid = overlay_images([transparent, self.test_jpg])
+        self.assertEqual(overlaid.mode, "RGBA")
+        self.assertEqual(overlaid.tobytes(), self.test_jpg.convert("RGBA").tobytes())
+
+        with self.assertRaises(ValueError):
+            overlay_images([self.test_jpg, Image.new("RGBA", (1, 1))])
+
     def test_make_color_transparent(self):
 
         with self.assertRaises(ValueError):
@@ -224,6 +359,47 @@ class ImagesTestCase(BaseTestCase):
         result = get_base64_for(transparent.convert("RGB"), "JPEG")
         self.assertEqual(result, TEST_TRANPARENT_JPG)
 
+        # Test replacing a color in the palette of a "P" mode image without converting it
+
+        palette_image = self.test_jpg.quantize(colors=8)
+        color = tuple(palette_image.getpalette()[:3]) + (255,)
+
+        expected = make_color_transparent(palette_image, color, (1, 2, 3, 0))
+        transparent = make_color_transparent(
+            palette_image, color, (1, 2, 3, 0), keep_palette=True
+        )
+        self.assertEqual(transparent.mode, "P")
+        self.assertEqual(transparent.info["transparency"][0], 0)
+        self.assertEqual(transparent.convert("RGBA").tobytes(), expected.tobytes())
+        self.assertNotIn("transparency", palette_image.info)
+
+        unchanged = make_color_transparent(
+            palette_image, (1, 2, 3, 4), keep_palette=True
+        )
+        self.assertIsNot(unchanged, palette_image)
+        self.assertEqual(unchanged.tobytes(), palette_image.tobytes())
+
+        # Test the image passed in is never modified, even if already RGBA
+
+        rgba_image = self.test_jpg.convert("RGBA")
+        color = rgba_image.getpixel((0, 0))
+        original = rgba_image.tobytes()
+
+        transparent = make_color_transparent(rgba_image, color)
+        self.assertIsNot(transparent, rgba_image)
+        self.assertEqual(transparent.getpixel((0, 0)), (255, 255, 255, 0))
+        self.assertEqual(rgba_image.tobytes(), original)
+
+        # Test RGBA images are modified in place only when asked, and other modes are still converted
+
+        transparent = make_color_transparent(rgba_image, color, inplace=True)
+        self.assertIs(transparent, rgba_image)
+        self.assertEqual(rgba_image.getpixel((0, 0)), (255, 255, 255, 0))
+
+        transparent = make_color_transparent(self.test_jpg, color[:3], inplace=True)
+        self.assertIsNot(transparent, self.test_jpg)
+        self.assertEqual(self.test_jpg.mode, "RGB")
+
     def test_stack_images_vertically(self):
 
         with self.assertRaises(ValueError):
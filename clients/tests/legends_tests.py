@@ -0,0 +1,139 @@
+from base64 import b64encode
+from PIL import Image
+from unittest import mock
+
+from ..arcgis import MapServerResource
+from ..utils.images import RawImage, image_to_base64, image_to_string
+from ..utils.legends import LegendAtlas, build_legend_atlas
+
+from .utils import BaseTestCase
+
+
+class LegendsTestCase(BaseTestCase):
+    def setUp(self):
+        super(LegendsTestCase, self).setUp()
+
+        self.red = Image.new("RGBA", (20, 20), (255, 0, 0, 255))
+        self.blue = Image.new("RGB", (20, 10), (0, 0, 255))
+        self.wide = Image.new("RGBA", (60, 20), (0, 255, 0, 128))
+
+    def assert_swatch(self, atlas, key, image):
+        swatch = atlas.get_swatch(key)
+        self.assertEqual(swatch.size, image.size)
+        self.assertEqual(swatch.tobytes(), image.convert("RGBA").tobytes())
+
+    def test_build_legend_atlas(self):
+        """ Tests packing of legend images, in every supported encoding, into one atlas """
+
+        atlas = build_legend_atlas(
+            [
+                ("image", self.red),
+                ("base64", image_to_base64(self.blue, "PNG")),
+                ("data_url", image_to_string(self.wide, "PNG")),
+                ("raw", RawImage.from_image(self.blue, "GIF")),
+                ("bytes", RawImage.from_image(self.wide).content),
+                ("missing", None),
+            ]
+        )
+
+        self.assertIsInstance(atlas, LegendAtlas)
+        self.assertEqual(atlas.swatch_count, 3)
+        self.assertEqual(
+            set(atlas.index), {"image", "base64", "data_url", "raw", "bytes"}
+        )
+        self.assertEqual(atlas.image.mode, "RGBA")
+
+        self.assert_swatch(atlas, "image", self.red)
+        self.assert_swatch(atlas, "base64", self.blue)
+        self.assert_swatch(atlas, "raw", self.blue)
+        self.assert_swatch(atlas, "data_url", self.wide)
+        self.assert_swatch(atlas, "bytes", self.wide)
+
+        # Swatches with the same pixels share a position, regardless of encoding
+        self.assertIs(atlas.index["base64"], atlas.index["raw"])
+        self.assertIs(atlas.index["data_url"], atlas.index["bytes"])
+
+        # Swatches are packed from tallest and widest, with padding between them
+        self.assertEqual(atlas.get_box("data_url"), (0, 0, 60, 20))
+        self.assertEqual(atlas.get_box("image"), (61, 0, 81, 20))
+        self.assertEqual(atlas.get_box("base64"), (82, 0, 102, 10))
+        self.assertEqual(atlas.image.size, (102, 20))
+
+    def test_build_legend_atlas_dict(self):
+        """ Tests atlases built from a dict of images, wrapping rows at the max width """
+
+        atlas = build_legend_atlas(
+            {"red": self.red, "wide": self.wide}, max_width=64, padding=0
+        )
+        self.assertEqual(atlas.get_box("wide"), (0, 0, 60, 20))
+        self.assertEqual(atlas.get_box("red"), (0, 20, 20, 40))
+        self.assertEqual(atlas.image.size, (60, 40))
+
+        # Swatches wider than the max width get a row of their own
+        atlas = build_legend_atlas({"wide": self.wide}, max_width=10)
+        self.assertEqual(atlas.image.size, (60, 20))
+
+    def test_build_legend_atlas_empty(self):
+        """ Tests that an atlas without legend images is an empty one pixel image """
+
+        atlas = build_legend_atlas([("missing", None)])
+        self.assertEqual(atlas.index, {})
+        self.assertEqual(atlas.swatch_count, 0)
+        self.assertEqual(atlas.image.size, (1, 1))
+
+    def test_build_legend_atlas_decodes_once(self):
+        """ Tests that the same encoded legend image is only decoded once """
+
+        encoded = image_to_base64(self.red, "PNG")
+        legend_images = [(idx, encoded) for idx in range(10)]
+
+        with mock.patch("clients.utils.legends.Image.open", wraps=Image.open) as opened:
+            atlas = build_legend_atlas(legend_images)
+
+        self.assertEqual(opened.call_count, 1)
+        self.assertEqual(len(atlas.index), 10)
+        self.assertEqual(atlas.swatch_count, 1)
+
+    def test_legend_atlas_encoding(self):
+        """ Tests encoding of an atlas as a PNG, and as a dict serializable as JSON """
+
+        atlas = build_legend_atlas({("layer", 0): self.red, ("layer", 1): self.blue})
+
+        encoded = atlas.encode()
+        self.assertEqual(encoded.content_type, "image/png")
+        self.assertEqual(encoded.to_image().size, atlas.image.size)
+
+        as_dict = atlas.as_dict()
+        self.assertTrue(as_dict["image"].startswith("data:image/png;base64,"))
+        self.assertEqual(as_dict["width"], atlas.image.width)
+        self.assertEqual(as_dict["height"], atlas.image.height)
+        self.assertEqual(set(as_dict["index"]), {"layer/0", "layer/1"})
+        self.assertEqual(
+            as_dict["index"]["layer/1"], {"x": 21, "y": 0, "width": 20, "height": 10}
+        )
+
+    def test_map_service_legend_atlas(self):
+        """ Tests atlases of map service legends, keyed by layer id and legend element index """
+
+        red_base64 = b64encode(RawImage.from_image(self.red).content).decode()
+        blue_base64 = b64encode(RawImage.from_image(self.blue).content).decode()
+
+        layers = [
+            mock.Mock(
+                id=0,
+                legend=[
+                    mock.Mock(image_base64=red_base64),
+                    mock.Mock(image_base64=blue_base64),
+                ],
+            ),
+            mock.Mock(id=3, legend=[mock.Mock(image_base64=red_base64)]),
+            mock.Mock(id=4, legend=None),
+        ]
+        client = mock.Mock(spec=MapServerResource, layers=layers)
+
+        atlas = MapServerResource.get_legend_atlas(client, padding=0)
+
+        self.assertEqual(set(atlas.index), {(0, 0), (0, 1), (3, 0)})
+        self.assertEqual(atlas.swatch_count, 2)
+        self.assertIs(atlas.index[0, 0], atlas.index[3, 0])
+        self.assert_swatch(atlas, (0, 1), self.blue)
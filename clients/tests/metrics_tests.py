@@ -0,0 +1,243 @@
+import requests_mock
+
+from unittest import mock
+
+from ..arcgis import FeatureLayerResource
+from ..exceptions import HTTPError
+from ..utils.metrics import MetricsAggregator, MetricsListener
+from ..utils.metrics import OpenTelemetryAdapter, PrometheusAdapter
+from ..utils.metrics import RequestEvent, Span, get_url_template, instrumentation
+
+from .resource_tests import TestResource
+from .utils import ResourceTestCase
+
+
+class EventRecorder(MetricsListener):
+    def __init__(self):
+        self.requests = []
+        self.spans = []
+
+    def on_request(self, event):
+        self.requests.append(event)
+
+    def on_span(self, span):
+        self.spans.append(span)
+
+
+class MetricsTestCase(ResourceTestCase):
+    def setUp(self):
+        super(MetricsTestCase, self).setUp()
+
+        self.resources_directory = self.data_directory / "resources"
+
+        self.client_url = "https://test.client.org/single/"
+        self.client_path = self.resources_directory / "test-client.json"
+        self.bulk_url = "https://test.client.org/bulk/"
+        self.bulk_path = self.resources_directory / "test-client-bulk.json"
+
+        self.recorder = instrumentation.add_listener(EventRecorder())
+        self.addCleanup(instrumentation.clear)
+
+    def test_url_template(self):
+
+        self.assertEqual(get_url_template(None), "")
+        self.assertEqual(get_url_template("/rest/services"), "/rest/services")
+        self.assertEqual(
+            get_url_template("https://test.client.org/MapServer/tile/3/10/-2?f=image"),
+            "https://test.client.org/MapServer/tile/{id}/{id}/{id}",
+        )
+        self.assertEqual(
+            get_url_template("https://test.client.org/arcgis/FeatureServer/12/query"),
+            "https://test.client.org/arcgis/FeatureServer/{id}/query",
+        )
+
+    @requests_mock.Mocker()
+    def test_resource_events(self, mock_request):
+        self.mock_mapservice_request(
+            mock_request.get, self.client_url, self.client_path
+        )
+
+        # Test request events and spans for a resource load
+
+        TestResource.get(self.client_url, lazy=False)
+
+        self.assertEqual(len(self.recorder.requests), 1)
+
+        event = self.recorder.requests[0]
+        self.assertEqual(event.service_type, "TestResource")
+        self.assertEqual(event.endpoint, "metadata")
+        self.assertEqual(event.operation, "get")
+        self.assertEqual(event.url_template, self.client_url)
+        self.assertEqual(event.status, "200")
+        self.assertEqual(event.bytes, len(self.client_path.read_bytes()))
+        self.assertEqual(event.retries, 0)
+        self.assertEqual(event.cache, "miss")
+        self.assertGreaterEqual(event.latency, 0)
+
+        populate, get = self.recorder.spans
+        self.assertEqual(populate.operation, "populate_field_values")
+        self.assertIs(populate.parent, get)
+        self.assertEqual(get.operation, "get")
+        self.assertIsNone(get.parent)
+        self.assertEqual(get.service_type, "TestResource")
+        self.assertIsNone(get.error)
+        self.assertGreaterEqual(get.duration, populate.duration)
+
+        # Test spans for bulk loads, with one populate span per resource
+
+        self.mock_mapservice_request(mock_request.get, self.bulk_url, self.bulk_path)
+        self.recorder.spans.clear()
+
+        TestResource.bulk_get(self.bulk_url)
+
+        operations = [span.operation for span in self.recorder.spans]
+        self.assertEqual(operations[-1], "bulk_get")
+        self.assertEqual(operations.count("populate_field_values"), 3)
+
+        # Test failed requests, and failures answered from the negative cache
+
+        missing_url = "https://test.client.org/missing/"
+        mock_request.get(missing_url, status_code=404)
+        self.recorder.requests.clear()
+        self.recorder.spans.clear()
+
+        for _ in range(2):
+            with self.assertRaises(HTTPError):
+                TestResource.get(missing_url, lazy=False)
+
+        missed, cached = self.recorder.requests
+        self.assertEqual((missed.status, missed.cache), ("404", "miss"))
+        self.assertEqual((cached.status, cached.cache), ("404", "hit"))
+        self.assertEqual(cached.error, "HTTPError")
+        self.assertEqual(
+            [span.error for span in self.recorder.spans], ["HTTPError"] * 2
+        )
+
+    @requests_mock.Mocker()
+    def test_query_events(self, mock_request):
+
+        layer_url = "https://test.client.org/arcgis/FeatureServer/0"
+        mock_request.post(f"{layer_url}/query", json={"features": []})
+
+        layer = FeatureLayerResource.get(layer_url, lazy=True)
+        layer.query(where="1=1")
+
+        event = self.recorder.requests[-1]
+        self.assertEqual(event.service_type, "FeatureLayerResource")
+        self.assertEqual(event.endpoint, "query")
+        self.assertEqual(event.method, "POST")
+        self.assertEqual(event.status, "200")
+        self.assertEqual(
+            event.url_template,
+            "https://test.client.org/arcgis/FeatureServer/{id}/query",
+        )
+
+    def test_listeners(self):
+
+        aggregator = instrumentation.add_listener(MetricsAggregator(buckets=(1, 10)))
+        failing = instrumentation.add_listener(mock.Mock(spec=MetricsListener))
+        failing.on_request.side_effect = ValueError("listener failed")
+
+        # Test that listener errors are logged without interrupting others
+
+        with self.assertLogs("clients.utils.metrics", level="ERROR"):
+            instrumentation.emit_request(
+                self.get_event("tile", 200, latency=0.5, size=100)
+            )
+
+        instrumentation.remove_listener(failing)
+        self.assertEqual(len(self.recorder.requests), 1)
+
+        instrumentation.emit_request(self.get_event("tile", 200, latency=5, size=50))
+        instrumentation.emit_request(self.get_event("tile", 503, retries=2))
+        instrumentation.emit_request(self.get_event("metadata", None, cache="hit"))
+
+        with self.assertRaises(ValueError):
+            with instrumentation.span("get_image", "MapServerResource"):
+                raise ValueError("failed")
+
+        stats = aggregator.get_stats()
+
+        tiles = stats["requests"][("MapServerResource", "tile", "200")]
+        self.assertEqual(tiles["count"], 2)
+        self.assertEqual(tiles["bytes"], 150)
+        self.assertEqual(tiles["latency"]["buckets"], {1: 1, 10: 2})
+        self.assertEqual(tiles["latency"]["mean"], 2.75)
+        self.assertEqual(tiles["latency"]["max"], 5)
+
+        failed = stats["requests"][("MapServerResource", "tile", "503")]
+        self.assertEqual((failed["count"], failed["retries"]), (1, 2))
+
+        cached = stats["requests"][("MapServerResource", "metadata", "cached")]
+        self.assertEqual((cached["cache_hits"], cached["cache_misses"]), (1, 0))
+
+        span = stats["spans"][("MapServerResource", "get_image")]
+        self.assertEqual((span["count"], span["errors"]), (1, 1))
+
+        aggregator.reset()
+        self.assertEqual(aggregator.get_stats(), {"requests": {}, "spans": {}})
+
+    def test_adapters(self):
+
+        event = self.get_event("tile", 200, latency=0.5, size=100)
+        span = Span("get_image", "MapServerResource", self.client_url).finish()
+
+        # Test Prometheus-style metrics
+
+        metrics = [mock.Mock() for _ in range(4)]
+        adapter = PrometheusAdapter(*metrics)
+        adapter.on_request(event)
+        adapter.on_span(span)
+
+        labels = {
+            "service_type": "MapServerResource",
+            "endpoint": "tile",
+            "status": "200",
+        }
+        metrics[0].labels.assert_called_with(**labels)
+        metrics[0].labels().inc.assert_called_with()
+        metrics[1].labels().observe.assert_called_with(0.5)
+        metrics[2].labels().inc.assert_called_with(100)
+        metrics[3].labels.assert_called_with(
+            service_type="MapServerResource", operation="get_image", error=""
+        )
+        metrics[3].labels().observe.assert_called_with(span.duration)
+
+        # Test OpenTelemetry-style metrics and traces
+
+        meter = mock.Mock()
+        meter.create_counter.side_effect = lambda *args, **kwargs: mock.Mock()
+        meter.create_histogram.side_effect = lambda *args, **kwargs: mock.Mock()
+        tracer = mock.Mock()
+        adapter = OpenTelemetryAdapter(meter, tracer)
+        adapter.on_request(event)
+        adapter.on_span(span)
+
+        adapter.requests.add.assert_called_once()
+        adapter.response_size.add.assert_called_once()
+        adapter.request_duration.record.assert_called_once()
+        adapter.operation_duration.record.assert_called_once()
+
+        tracer.start_span.assert_called_once()
+        self.assertEqual(
+            tracer.start_span.call_args.args, ("MapServerResource.get_image",)
+        )
+        self.assertEqual(
+            tracer.start_span.call_args.kwargs["start_time"],
+            int(span.start_time * 1e9),
+        )
+        tracer.start_span().end.assert_called_with(
+            end_time=int(span.end_time * 1e9)
+        )
+
+    def get_event(self, endpoint, status_code, latency=None, size=None, **kwargs):
+        url = "https://test.client.org/arcgis/rest/services/Test/MapServer"
+
+        event = RequestEvent("MapServerResource", endpoint, url)
+        event.status_code = status_code
+        event.latency = latency
+        event.bytes = size
+
+        for key, val in kwargs.items():
+            setattr(event, key, val)
+        return event
@@ -0,0 +1,96 @@
+import threading
+import time
+
+from ..utils.concurrency import map_concurrently
+from ..utils.metrics import MetricsListener, instrumentation, instrumented
+from ..utils.profiling import PhaseTimings, collect_timings, timed_phase
+
+from .utils import BaseTestCase
+
+
+class ProfilingTestCase(BaseTestCase):
+    def test_phase_timings(self):
+
+        timings = PhaseTimings()
+        timings.add("network", 0.5, 100)
+        timings.add("network", 0.25)
+        timings.add("decode", 0.125, 100)
+
+        self.assertEqual(
+            timings.get("network"), {"count": 2, "duration": 0.75, "bytes": 100}
+        )
+        self.assertEqual(timings.get("crop"), {"count": 0, "duration": 0.0, "bytes": 0})
+        self.assertIsNone(timings.duration)
+
+        timings.finish()
+        self.assertEqual(set(timings.as_dict()["phases"]), {"network", "decode"})
+        self.assertGreaterEqual(timings.as_dict()["duration"], 0)
+
+    def test_collect_timings(self):
+
+        # Test that phases are not timed without a collector
+
+        with timed_phase("decode") as phase:
+            phase.bytes = 10
+
+        # Test that phases are collected by every enclosing collector
+
+        with collect_timings() as outer:
+            with timed_phase("network") as phase:
+                phase.bytes = 10
+
+            with collect_timings() as inner:
+                with timed_phase("decode") as phase:
+                    phase.bytes = 20
+                    time.sleep(0.01)
+
+        self.assertEqual(outer.get("network")["bytes"], 10)
+        self.assertEqual(outer.get("decode")["bytes"], 20)
+        self.assertEqual(inner.get("network")["count"], 0)
+        self.assertEqual(inner.get("decode")["bytes"], 20)
+        self.assertGreaterEqual(inner.get("decode")["duration"], 0.01)
+        self.assertGreaterEqual(outer.duration, inner.duration)
+
+        # Test that phases are collected from concurrent calls
+
+        def decode(item):
+            with timed_phase("decode") as phase:
+                phase.bytes = item
+
+        with collect_timings() as timings:
+            map_concurrently(decode, range(1, 11))
+
+            thread = threading.Thread(target=decode, args=(100,))
+            thread.start()
+            thread.join()
+
+        self.assertEqual(timings.get("decode")["count"], 10)
+        self.assertEqual(timings.get("decode")["bytes"], 55)
+
+    def test_timed_spans(self):
+
+        class TimedResource(object):
+            _url = "https://test.client.org/MapServer"
+
+            @instrumented("get_image", timed=True)
+            def get_image(self):
+                with timed_phase("composite"):
+                    return "image"
+
+        spans = []
+        listener = MetricsListener()
+        listener.on_span = spans.append
+
+        # Test that timings are collected only while there are listeners
+
+        self.assertEqual(TimedResource().get_image(), "image")
+
+        instrumentation.add_listener(listener)
+        self.addCleanup(instrumentation.clear)
+
+        self.assertEqual(TimedResource().get_image(), "image")
+
+        span = spans[0]
+        self.assertEqual(span.operation, "get_image")
+        self.assertEqual(span.timings.get("composite")["count"], 1)
+        self.assertIn("composite", span.as_dict()["timings"]["phases"])
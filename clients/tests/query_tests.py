@@ -1,5 +1,7 @@
 import json
 
+from unittest import mock
+
 from restle.serializers import JSONSerializer, URLSerializer
 
 from ..query.actions import QueryAction
@@ -7,7 +9,7 @@ from ..query.fields import DictField, ListField, ObjectField
 from ..query.fields import BaseExtentField, ExtentField, SpatialReferenceField
 from ..query.fields import CommaSeparatedField, DrawingInfoField, TimeInfoField
 from ..query.fields import DRAWING_INFO_ALIASES, TIME_INFO_ALIASES
-from ..query.serializers import XMLToJSONSerializer
+from ..query.serializers import StreamingXMLToJSONSerializer, XMLToJSONSerializer
 from ..resources import ClientResource
 from ..utils.geometry import Extent, SpatialReference
 
@@ -380,3 +382,52 @@ class SerializersTestCase(BaseTestCase):
         }
 
         self.assertEqual(serializer.to_dict(serialized), deserialized)
+
+    def test_streaming_xml_to_json_serializer(self):
+        serializer = StreamingXMLToJSONSerializer()
+        serialized = '<a root="true"><b first="true">bbb</b><c>ccc</c>aaa</a>'
+        deserialized = {
+            "b": {"first": "true", "value": "bbb"},
+            "c": ["ccc", "aaa"],
+            "root": "true",
+        }
+
+        self.assertEqual(serializer.to_dict(serialized), deserialized)
+        self.assertEqual(serializer.to_dict(serialized.encode()), deserialized)
+        self.assertEqual(serializer.to_dict(""), {})
+
+        # Test namespaces, tails and attributes named like object properties, read in small chunks
+
+        serialized = (
+            '<a xmlns:x="urn:x"><x:b x:value="1" type="t">t<c/>tail</x:b> mid '
+            "<b>2</b> end<d> </d></a>"
+        )
+        deserialized = {
+            "b": [
+                {"c": "tail", "b_value": "1", "b_type": "t", "value": ["t", "mid"]},
+                ["2", "end"],
+            ],
+            "d": "",
+        }
+        with mock.patch.object(StreamingXMLToJSONSerializer, "chunk_size", 3):
+            self.assertEqual(serializer.to_dict(serialized), deserialized)
+            self.assertEqual(serializer.to_dict(serialized.encode()), deserialized)
+
+        # Test prefixes without namespace declarations are read as they are without streaming
+
+        serialized = '<a><x:b x:id="1">bbb</x:b></a>'
+        deserialized = {"b": {"id": "1", "value": "bbb"}}
+        self.assertEqual(serializer.to_dict(serialized), deserialized)
+
+        # Test every XML fixture is read the same as without streaming
+
+        for data_path in sorted(self.data_directory.glob("**/*.xml")):
+            with open(data_path, "rb") as data_file:
+                content = data_file.read()
+
+            with mock.patch.object(StreamingXMLToJSONSerializer, "chunk_size", 100):
+                self.assertEqual(
+                    serializer.to_dict(content),
+                    XMLToJSONSerializer.to_dict(content),
+                    data_path,
+                )
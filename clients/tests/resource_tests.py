@@ -1,3 +1,4 @@
+import asyncio
 import json
 
 from requests import exceptions
@@ -8,6 +9,7 @@ from ..exceptions import ServiceError, ServiceTimeout, UnsupportedVersion
 from ..query.fields import CommaSeparatedField, DictField, ExtentField
 from ..query.fields import ListField, ObjectField, SpatialReferenceField
 from ..resources import DEFAULT_USER_AGENT, ClientResource
+from ..utils.cache import negative_cache
 
 from .utils import ResourceTestCase, get_extent
 
@@ -263,12 +265,16 @@ class ClientResourceTestCase(ResourceTestCase):
         session = self.mock_mapservice_session(self.client_path, ok=False)
 
         for status_code in (401, 403):
+            negative_cache.clear()  # Service errors are remembered per URL
+
             session.get.return_value.status_code = status_code
-            with self.assertRaises(ServiceError):
+            with self.assertRaises(ServiceError) as error:
                 TestResource.get(self.client_url, lazy=False, session=session)
+            self.assertEqual(error.exception.status_code, status_code)
 
         # Test all other explicitly handled exceptions
 
+        negative_cache.clear()
         session = self.mock_mapservice_session(self.client_path)
 
         session.get.side_effect = exceptions.Timeout
@@ -297,6 +303,48 @@ class ClientResourceTestCase(ResourceTestCase):
             with self.assertRaises(NotImplementedError):
                 client.get_image(get_extent(), 32, 32)
 
+    def test_async_requests(self):
+
+        # Test async load resource
+
+        session = self.mock_mapservice_session(self.client_path)
+        client = asyncio.run(TestResource.aget(self.client_url, session=session))
+
+        # Test lazy by default, as with get
+        self.assertFalse(client._populated_field_values)
+        self.assertEqual(session.get.call_count, 0)
+
+        client = asyncio.run(
+            TestResource.aget(self.client_url, lazy=False, session=session)
+        )
+        self.assertTrue(client._populated_field_values)
+        self.assertEqual(session.get.call_count, 1)
+
+        self.assertEqual(client.id, "single")
+        self.assertEqual(client.version, 10.2)
+        self.assertEqual(client.extent.as_list(), [-180.0, -90.0, 180.0, 90.0])
+
+        with self.assertRaises(NotImplementedError):
+            asyncio.run(client.aget_image(get_extent(), 32, 32))
+
+        # Test async bulk get
+
+        session = self.mock_bulk_session(self.bulk_path)
+        self.assert_bulk_clients(
+            asyncio.run(TestResource.abulk_get(self.bulk_url, session=session))
+        )
+
+        # Test that async requests raise the same errors
+
+        session = self.mock_mapservice_session(self.client_path, ok=False)
+        with self.assertRaises(HTTPError):
+            asyncio.run(TestResource.aget(self.client_url, lazy=False, session=session))
+
+        session = self.mock_mapservice_session(self.client_path)
+        session.get.side_effect = exceptions.Timeout
+        with self.assertRaises(ServiceTimeout):
+            asyncio.run(TestResource.aget(self.client_url, lazy=False, session=session))
+
     def test_validate_version(self):
 
         # Test minimum version support
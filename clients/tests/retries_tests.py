@@ -0,0 +1,269 @@
+import requests_mock
+import time
+
+from email.utils import formatdate
+from requests import exceptions
+from unittest import mock
+
+from ..exceptions import HTTPError, ServiceTimeout, ServiceUnavailable
+from ..utils.concurrency import concurrency_limiters
+from ..utils.deadlines import Deadline
+from ..utils.retries import CircuitBreaker, CircuitBreakerRegistry, RetryPolicy
+from ..utils.retries import circuit_breakers
+
+from .resource_tests import TestResource
+from .utils import ResourceTestCase
+
+
+class RetriesTestCase(ResourceTestCase):
+    def setUp(self):
+        super(RetriesTestCase, self).setUp()
+
+        self.client_url = "https://test.client.org/single/"
+        self.client_path = self.data_directory / "resources" / "test-client.json"
+
+        self.retry_policy = RetryPolicy(retries=2, backoff=0.5)
+        self.retry_policy.sleep = mock.Mock()
+
+    def mock_response(self, status_code, headers=None):
+        return mock.Mock(status_code=status_code, headers=headers or {})
+
+    def test_retry_policy(self):
+
+        policy = RetryPolicy(retries=2, backoff=0.5, max_backoff=0.75)
+
+        # Test retryable statuses and errors with jittered backoff
+
+        for status_code in (429, 502, 503, 504):
+            delay = policy.get_delay(0, response=self.mock_response(status_code))
+            self.assertTrue(0 <= delay <= 0.5)
+
+            delay = policy.get_delay(1, response=self.mock_response(status_code))
+            self.assertTrue(0 <= delay <= 0.75)
+
+        for error in (exceptions.ConnectionError(), exceptions.ReadTimeout()):
+            self.assertIsNotNone(policy.get_delay(0, error=error))
+
+        # Test requests that are not retried
+
+        self.assertIsNone(policy.get_delay(2, response=self.mock_response(503)))
+        self.assertIsNone(policy.get_delay(0, response=self.mock_response(200)))
+        self.assertIsNone(policy.get_delay(0, response=self.mock_response(404)))
+        self.assertIsNone(policy.get_delay(0, response=self.mock_response(500)))
+        self.assertIsNone(policy.get_delay(0, error=exceptions.InvalidURL()))
+
+        no_retries = RetryPolicy(retries=0)
+        self.assertIsNone(no_retries.get_delay(0, error=exceptions.Timeout()))
+
+        # Test Retry-After as seconds and as an HTTP date
+
+        response = self.mock_response(503, {"Retry-After": "3"})
+        self.assertEqual(policy.get_delay(0, response=response), 3)
+
+        retry_date = formatdate(time.time() + 10)
+        response = self.mock_response(429, {"Retry-After": retry_date})
+        self.assertTrue(8 <= policy.get_delay(0, response=response) <= 10)
+
+        response = self.mock_response(503, {"Retry-After": "3600"})
+        self.assertIsNone(policy.get_delay(0, response=response))
+
+        response = self.mock_response(503, {"Retry-After": "soon"})
+        self.assertTrue(0 <= policy.get_delay(0, response=response) <= 0.5)
+
+    def test_circuit_breaker(self):
+
+        breaker = CircuitBreaker(failure_threshold=2, recovery_timeout=30)
+        self.assertTrue(breaker.allow_request())
+
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        breaker.record_success()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+        breaker.record_response(self.mock_response(503))
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(breaker.allow_request())
+
+        # Test that one probe is allowed after the recovery timeout
+
+        breaker.opened_at -= 30
+
+        self.assertTrue(breaker.allow_request())
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertFalse(breaker.allow_request())
+
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(breaker.allow_request())
+
+        breaker.opened_at -= 30
+
+        self.assertTrue(breaker.allow_request())
+        breaker.record_response(self.mock_response(404))
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(breaker.allow_request())
+
+        # Test that a probe that is not sent is cancelled, and one without an outcome abandoned
+
+        breaker = CircuitBreaker(
+            failure_threshold=1, recovery_timeout=30, probe_timeout=60
+        )
+        breaker.record_failure()
+        breaker.opened_at -= 30
+
+        self.assertTrue(breaker.allow_request())
+        breaker.cancel_probe()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertTrue(breaker.allow_request())
+        self.assertFalse(breaker.allow_request())
+
+        breaker.probed_at -= 60
+        self.assertTrue(breaker.allow_request())
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+
+        breaker.record_success()
+        breaker.cancel_probe()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+        # Test one breaker per host, configurable per host
+
+        registry = CircuitBreakerRegistry(failure_threshold=3)
+        breaker = registry.get_breaker(self.client_url)
+
+        self.assertIs(breaker, registry.get_breaker("https://TEST.client.org/other/"))
+        self.assertIsNot(breaker, registry.get_breaker("https://other.client.org/"))
+        self.assertEqual(breaker.failure_threshold, 3)
+
+        registry.configure_host("test.client.org", failure_threshold=10)
+        self.assertEqual(registry.get_breaker(self.client_url).failure_threshold, 10)
+
+        registry.reset()
+        self.assertIsNot(registry.get_breaker(self.client_url), breaker)
+
+    @requests_mock.Mocker()
+    def test_resource_retries(self, mock_request):
+
+        with open(self.client_path) as client_data:
+            client_json = client_data.read()
+
+        # Test retry after transient errors
+
+        mock_request.get(
+            self.client_url,
+            [
+                {"status_code": 503},
+                {"exc": exceptions.ConnectTimeout},
+                {"status_code": 200, "text": client_json},
+            ],
+        )
+
+        with mock.patch.object(TestResource, "retry_policy", self.retry_policy):
+            client = TestResource.get(self.client_url, lazy=False)
+
+        self.assertEqual(client.id, "single")
+        self.assertEqual(mock_request.call_count, 3)
+        self.assertEqual(self.retry_policy.sleep.call_count, 2)
+
+        # Test errors raised once retries are exhausted
+
+        mock_request.get(self.client_url, status_code=502)
+
+        with mock.patch.object(TestResource, "retry_policy", self.retry_policy):
+            with self.assertRaises(HTTPError) as error:
+                TestResource.get(self.client_url, lazy=False)
+
+        self.assertEqual(error.exception.status_code, 502)
+        self.assertEqual(mock_request.call_count, 6)
+
+        # Test Retry-After beyond the deadline is not waited for
+
+        mock_request.get(
+            self.client_url, status_code=503, headers={"Retry-After": "20"}
+        )
+
+        with mock.patch.object(TestResource, "retry_policy", self.retry_policy):
+            with self.assertRaises(HTTPError):
+                TestResource.get(self.client_url, lazy=False, deadline=Deadline(10))
+
+        self.assertEqual(mock_request.call_count, 7)
+
+        # Test no retries for errors other than connection errors and timeouts
+
+        mock_request.get(self.client_url, status_code=404)
+
+        with mock.patch.object(TestResource, "retry_policy", self.retry_policy):
+            with self.assertRaises(HTTPError):
+                TestResource.get(self.client_url, lazy=False)
+
+        self.assertEqual(mock_request.call_count, 8)
+
+    @requests_mock.Mocker()
+    def test_resource_circuit_breaker(self, mock_request):
+        mock_request.get(self.client_url, exc=exceptions.ConnectTimeout)
+
+        policy = RetryPolicy(retries=0)
+
+        with mock.patch.object(TestResource, "retry_policy", policy):
+            for _ in range(circuit_breakers.failure_threshold):
+                with self.assertRaises(ServiceTimeout):
+                    TestResource.get(self.client_url, lazy=False)
+
+            # Test that requests are short-circuited while the host is down
+
+            request_count = mock_request.call_count
+
+            with self.assertRaises(ServiceUnavailable):
+                TestResource.get(self.client_url, lazy=False)
+            with self.assertRaises(ServiceUnavailable):
+                TestResource.bulk_get("https://test.client.org/bulk/")
+
+            self.assertEqual(mock_request.call_count, request_count)
+
+            # Test that a successful probe resumes requests
+
+            circuit_breakers.get_breaker(self.client_url).opened_at -= 60
+            self.mock_mapservice_request(
+                mock_request.get, self.client_url, self.client_path
+            )
+
+            self.assertEqual(TestResource.get(self.client_url, lazy=False).id, "single")
+            self.assertEqual(TestResource.get(self.client_url, lazy=False).id, "single")
+
+    @requests_mock.Mocker()
+    def test_resource_circuit_breaker_probe(self, mock_request):
+        self.mock_mapservice_request(
+            mock_request.get, self.client_url, self.client_path
+        )
+
+        breaker = circuit_breakers.get_breaker(self.client_url)
+        for _ in range(breaker.failure_threshold):
+            breaker.record_failure()
+        breaker.opened_at -= breaker.recovery_timeout
+
+        # Test that requests stopped before they are sent do not take the probe
+
+        with self.assertRaises(ServiceTimeout):
+            TestResource.get(self.client_url, lazy=False, deadline=-1)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+        limiter = concurrency_limiters.get_limiter(self.client_url)
+        with mock.patch.object(limiter, "acquire", return_value=False):
+            with self.assertRaises(ServiceTimeout):
+                TestResource.get(self.client_url, lazy=False, deadline=5)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+        # Test that a probe failing without any outcome is cancelled
+
+        mock_request.get(self.client_url, exc=KeyError)
+        with self.assertRaises(KeyError):
+            TestResource.get(self.client_url, lazy=False)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+        self.mock_mapservice_request(
+            mock_request.get, self.client_url, self.client_path
+        )
+        self.assertEqual(TestResource.get(self.client_url, lazy=False).id, "single")
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual(limiter.in_flight, 0)
+        self.assertEqual(mock_request.call_count, 2)
@@ -0,0 +1,123 @@
+import requests_mock
+
+from requests.adapters import HTTPAdapter
+
+from ..resources import DEFAULT_USER_AGENT, ClientResource
+from ..utils.sessions import DEFAULT_TIMEOUT, ClientSession, SessionFactory
+from ..utils.sessions import create_session, get_session, session_factory
+
+from .utils import BaseTestCase
+
+
+class SessionsTestCase(BaseTestCase):
+    def setUp(self):
+        super(SessionsTestCase, self).setUp()
+
+        self.service_url = "https://test.client.org/sessions/"
+
+    def test_create_session(self):
+
+        session = create_session()
+        self.assertIsInstance(session, ClientSession)
+        self.assertEqual(session.timeout, DEFAULT_TIMEOUT)
+        self.assertNotEqual(session.headers["User-agent"], DEFAULT_USER_AGENT)
+
+        session = create_session(user_agent=DEFAULT_USER_AGENT, timeout=5)
+        self.assertEqual(session.timeout, 5)
+        self.assertEqual(session.headers["User-agent"], DEFAULT_USER_AGENT)
+
+        # Sessions are distinct, but share connection pools
+
+        other_session = create_session()
+        self.assertIsNot(session, other_session)
+        self.assertIs(
+            session.get_adapter(self.service_url),
+            other_session.get_adapter(self.service_url),
+        )
+
+        # Resources without a session are given a pooled one
+
+        resource = ClientResource()
+        self.assertIsInstance(resource._session, ClientSession)
+        self.assertEqual(resource._session.headers["User-agent"], DEFAULT_USER_AGENT)
+        self.assertIs(
+            resource._session.get_adapter(self.service_url),
+            session.get_adapter(self.service_url),
+        )
+
+    def test_get_session(self):
+
+        session = get_session()
+        self.assertIs(session, get_session())
+        self.assertIs(session, session_factory.get_session())
+
+    @requests_mock.Mocker()
+    def test_session_timeouts(self, mock_request):
+        mock_request.get(self.service_url, text="{}")
+
+        session = create_session()
+
+        session.get(self.service_url)
+        self.assertEqual(mock_request.last_request.timeout, DEFAULT_TIMEOUT)
+
+        session.get(self.service_url, timeout=30)
+        self.assertEqual(mock_request.last_request.timeout, 30)
+
+    def test_session_factory(self):
+
+        factory = SessionFactory(pool_maxsize=4, timeout=60)
+
+        session = factory.create_session()
+        self.assertEqual(session.timeout, 60)
+
+        adapter = session.get_adapter(self.service_url)
+        self.assertEqual(adapter._pool_maxsize, 4)
+
+        # Test per-host pool sizes
+
+        shared_session = factory.get_session()
+        factory.configure_host("test.client.org", pool_maxsize=32)
+
+        host_session = factory.create_session()
+        host_adapter = host_session.get_adapter(self.service_url)
+        self.assertEqual(host_adapter._pool_maxsize, 32)
+        self.assertIs(shared_session.get_adapter(self.service_url), host_adapter)
+
+        other_url = "http://other.client.org/sessions/"
+        self.assertEqual(host_session.get_adapter(other_url)._pool_maxsize, 4)
+        similar_url = "http://test.client.org.other.org/sessions/"
+        self.assertEqual(host_session.get_adapter(similar_url)._pool_maxsize, 4)
+
+        # Test that unrelated sessions are not affected
+
+        self.assertIs(session.get_adapter(self.service_url), adapter)
+
+        factory.configure_host("https://secure.client.org", pool_maxsize=8)
+
+        host_session = factory.create_session()
+        secure_url = "https://secure.client.org/sessions/"
+        self.assertEqual(host_session.get_adapter(secure_url)._pool_maxsize, 8)
+        insecure_url = "http://secure.client.org/sessions/"
+        self.assertEqual(host_session.get_adapter(insecure_url)._pool_maxsize, 4)
+
+        # Test mounting other transport adapters
+
+        other_adapter = HTTPAdapter()
+        previous = factory.mount("https://test.client.org/", other_adapter)
+        self.assertIs(previous, host_adapter)
+        self.assertIs(shared_session.get_adapter(self.service_url), other_adapter)
+        self.assertIs(
+            factory.create_session().get_adapter(self.service_url), other_adapter
+        )
+        self.assertIsNone(factory.mount("stub://", other_adapter))
+
+        # Closing one session leaves the shared pools open
+
+        pool_manager = adapter.poolmanager
+        pool_manager.connection_from_url(self.service_url)
+
+        session.close()
+        self.assertEqual(len(pool_manager.pools), 1)
+
+        factory.close()
+        self.assertEqual(len(pool_manager.pools), 0)
@@ -1,9 +1,12 @@
 import requests_mock
+import threading
 
+from requests import exceptions
 from unittest import mock
 from parserutils.urls import get_base_url, url_to_parts
 
 from ..exceptions import HTTPError, ImageError, ValidationError
+from ..utils.retries import RetryPolicy
 from ..utils.geometry import Extent
 from ..thredds import ThreddsResource
 
@@ -48,10 +51,7 @@ class THREDDSTestCase(ResourceTestCase):
             f"&request=GetLegendGraphic&layer={self.layer_name}&colorbaronly=True"
         )
 
-    def mock_thredds_client(self, mock_request, mock_metadata):
-        with open(self.metadata_path) as iso_metadata:
-            mock_metadata.return_value = iso_metadata.read()
-
+    def mock_thredds_client(self, mock_request):
         mock_request.head(self.download_url, status_code=200)
 
         self.mock_mapservice_request(
@@ -79,8 +79,7 @@ class THREDDSTestCase(ResourceTestCase):
         self.assertEqual(result, "THREDDS service")
 
     @requests_mock.Mocker()
-    @mock.patch("clients.thredds.get_remote_element")
-    def test_invalid_thredds_url(self, mock_request, mock_metadata):
+    def test_invalid_thredds_url(self, mock_request):
 
         # Test with invalid url
         session = self.mock_mapservice_session(self.data_directory / "test.html")
@@ -124,7 +123,7 @@ class THREDDSTestCase(ResourceTestCase):
             ThreddsResource.get(self.catalog_url, session=session, lazy=False)
 
         # Test with broken layer menu endpoint
-        self.mock_thredds_client(mock_request, mock_metadata)
+        self.mock_thredds_client(mock_request)
         self.mock_mapservice_request(
             mock_request.get, self.layer_menu_url, self.layer_menu_path, ok=False
         )
@@ -133,9 +132,8 @@ class THREDDSTestCase(ResourceTestCase):
             ThreddsResource.get(self.catalog_url, lazy=False)
 
     @requests_mock.Mocker()
-    @mock.patch("clients.thredds.get_remote_element")
-    def test_valid_thredds_request(self, mock_request, mock_metadata):
-        self.mock_thredds_client(mock_request, mock_metadata)
+    def test_valid_thredds_request(self, mock_request):
+        self.mock_thredds_client(mock_request)
 
         # Test variables initialized before query with alternate WMS version
 
@@ -323,10 +321,65 @@ class THREDDSTestCase(ResourceTestCase):
         self.assertEqual(first_layer.supported_styles, ["boxfill", "contour"])
 
     @requests_mock.Mocker()
-    @mock.patch("clients.thredds.get_remote_element")
-    def test_valid_thredds_image_request(self, mock_request, mock_metadata):
+    def test_concurrent_thredds_requests(self, mock_request):
+        self.mock_thredds_client(mock_request)
+
+        # Test ISO metadata is fetched while layer ids are requested (mocked requests are sent one at a time)
+
+        both_requested = threading.Barrier(2, timeout=5)
+        make_request = ThreddsResource._make_request
+        waited = []
+
+        def make_request_together(resource, url=None, *args, **kwargs):
+            if url in (self.metadata_url, self.layer_menu_url):
+                waited.append(url)
+                both_requested.wait()  # Raises if either is requested only after the other
+            return make_request(resource, url, *args, **kwargs)
+
+        patched = mock.patch.object(
+            ThreddsResource, "_make_request", make_request_together
+        )
+        with patched:
+            client = ThreddsResource.get(self.catalog_url, lazy=False)
+
+        self.assertEqual(len(waited), 2)
+        self.assertFalse(both_requested.broken)
+
+        self.assertEqual(client.download_url, self.download_url)
+        self.assertEqual(client.access_constraints, "northwestknowledge.net")
+        self.assertEqual([l.id for l in client.layers], [self.layer_name])
+        self.assertEqual([l.layer_order for l in client.layers], [0])
+
+        # Test ISO metadata and the download URL are requested with the session
+
+        requested = [(r.method, r.url) for r in mock_request.request_history]
+        self.assertIn(("HEAD", self.download_url), requested)
+        self.assertIn(("GET", self.metadata_url), requested)
+
+        # Test a download URL that does not respond is left unset, without failing the load
+
+        mock_request.head(self.download_url, exc=exceptions.ConnectTimeout)
+        with mock.patch.object(ThreddsResource, "retry_policy", RetryPolicy(retries=0)):
+            client = ThreddsResource.get(self.catalog_url, lazy=False)
+
+        self.assertIsNone(client.download_url)
+        self.assertEqual([l.id for l in client.layers], [self.layer_name])
+
+        mock_request.head(self.download_url, status_code=404)
+        client = ThreddsResource.get(self.catalog_url, lazy=False)
+        self.assertIsNone(client.download_url)
+
+        # Test that broken ISO metadata fails the load
+
+        mock_request.get(self.metadata_url, status_code=500)
+        with mock.patch.object(ThreddsResource, "retry_policy", RetryPolicy(retries=0)):
+            with self.assertRaises(HTTPError):
+                ThreddsResource.get(self.catalog_url, lazy=False)
+
+    @requests_mock.Mocker()
+    def test_valid_thredds_image_request(self, mock_request):
 
-        self.mock_thredds_client(mock_request, mock_metadata)
+        self.mock_thredds_client(mock_request)
         client = ThreddsResource.get(self.catalog_url, lazy=False)
 
         self.assert_get_image(client, layer_ids=[self.layer_name], style_ids=["ferret"])
@@ -351,11 +404,16 @@ class THREDDSTestCase(ResourceTestCase):
             params={"version": "1.1.1"},
         )
 
+        # Test a color marked transparent is fixed, in a palette if raw
+
+        self.assert_get_transparent_image(
+            client, layer_ids=[self.layer_name], style_ids=["ferret"]
+        )
+
     @requests_mock.Mocker()
-    @mock.patch("clients.thredds.get_remote_element")
-    def test_invalid_thredds_image_request(self, mock_request, mock_metadata):
+    def test_invalid_thredds_image_request(self, mock_request):
 
-        self.mock_thredds_client(mock_request, mock_metadata)
+        self.mock_thredds_client(mock_request)
         client = ThreddsResource.get(self.catalog_url, lazy=False)
 
         valid_image_args = (32, 32, [self.layer_name], ["ferret"])
@@ -9,7 +9,11 @@ from io import BytesIO
 from PIL import Image
 from unittest import mock
 
+from ..utils.cache import legend_cache, negative_cache
+from ..utils.concurrency import concurrency_limiters
 from ..utils.geometry import Extent, SpatialReference
+from ..utils.images import RawImage
+from ..utils.retries import circuit_breakers
 from ..wms import WMS_EXCEPTION_FORMAT
 
 
@@ -133,6 +137,12 @@ class BaseTestCase(unittest.TestCase):
     def setUp(self):
         self.data_directory = get_test_directory() / "data"
 
+        # Failures in one test must not suspend requests in another
+        circuit_breakers.reset()
+        concurrency_limiters.reset()
+        negative_cache.clear()
+        legend_cache.clear()
+
     def _assert_props(self, target_data, props):
         if props is None:
             props = set(target_data.keys())
@@ -276,6 +286,58 @@ class ResourceTestCase(BaseTestCase):
         self.assertEqual(img.mode, "RGBA")
         self.assertEqual(md5(img.tobytes()).hexdigest(), target_hash)
 
+    def assert_get_raw_image(
+        self, client, passthrough=True, extent=None, dimensions=None, **image_params
+    ):
+        """ Asserts the image bytes are served untouched if passed through, or else encoded as a PNG """
+
+        image_path = self.data_directory / "test.png"
+        client._session = self.mock_mapservice_session(
+            image_path, mode="rb", headers={"content-type": "image/png"}
+        )
+
+        if dimensions is None:
+            dimensions = DEFAULT_IMG_DIMS
+        raw_image = client.get_image(
+            extent or client.full_extent, *dimensions, raw=True, **image_params
+        )
+
+        self.assertIsInstance(raw_image, RawImage)
+        self.assertEqual(raw_image.content_type, "image/png")
+
+        if passthrough:
+            self.assertEqual(raw_image.content, image_path.read_bytes())
+        else:
+            self.assertNotEqual(raw_image.content, image_path.read_bytes())
+            self.assertEqual(raw_image.to_image().size, dimensions)
+
+    def assert_get_transparent_image(self, client, **image_params):
+        """ Asserts a color marked transparent in an RGB image is fixed, in a palette if raw and it has few colors """
+
+        image = Image.new("RGB", DEFAULT_IMG_DIMS, (1, 2, 3))
+        image.paste((255, 0, 0), (0, 0, 16, 16))
+        image_bytes = BytesIO()
+        image.save(image_bytes, "PNG", transparency=(1, 2, 3))
+
+        client._session = self.mock_mapservice_session(
+            self.data_directory / "test.png",
+            mode="rb",
+            headers={"content-type": "image/png"},
+        )
+        client._session.get.return_value.content = image_bytes.getvalue()
+
+        img = client.get_image(client.full_extent, *DEFAULT_IMG_DIMS, **image_params)
+        self.assertEqual(img.mode, "RGBA")
+        self.assertEqual(img.getpixel((0, 0)), (255, 0, 0, 255))
+        self.assertEqual(img.getpixel((31, 31)), (255, 255, 255, 0))
+
+        raw_image = client.get_image(
+            client.full_extent, *DEFAULT_IMG_DIMS, raw=True, **image_params
+        )
+        raw_img = raw_image.to_image()
+        self.assertEqual(raw_img.mode, "P")
+        self.assertEqual(raw_img.convert("RGBA").tobytes(), img.tobytes())
+
     def mock_mapservice_request(
         self,
         mock_method,
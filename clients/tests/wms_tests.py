@@ -1,5 +1,17 @@
+import requests
+import threading
+
+from PIL import Image
+from unittest import mock
+
 from ..exceptions import BadExtent, ContentError, HTTPError, ImageError
-from ..exceptions import MissingFields, NoLayers, ServiceError, ValidationError
+from ..exceptions import MissingFields, NoLayers, ServiceError, ServiceTimeout
+from ..exceptions import ServiceUnavailable, ValidationError
+from ..utils.cache import legend_cache, negative_cache
+from ..utils.concurrency import map_concurrently
+from ..utils.deadlines import Deadline
+from ..utils.images import encode_image
+from ..utils.retries import RetryPolicy
 from ..wms import (
     WMSResource,
     WMSLayerResource,
@@ -19,6 +31,9 @@ class WMSTestCase(ResourceTestCase):
 
         self.wms_url = "http://demo.mapserver.org/cgi-bin/wms"
         self.ncwms_url = "http://tools.pacificclimate.org/ncWMS-PCIC/wms?dataset=pr-tasmax-tasmin_day"
+        self.ncwms_layer_id = (
+            "pr-tasmax-tasmin_day_precipitation_flux/pr-tasmax-tasmin_day"
+        )
 
         self.service_exception_url = "http://demo.mapserver.org/service/wms"
         self.service_exception_path = self.wms_directory / "service-exception.xml"
@@ -26,6 +41,24 @@ class WMSTestCase(ResourceTestCase):
         self.version_error_url = "http://demo.mapserver.org/version/wms"
         self.version_error_path = self.wms_directory / "version-error.xml"
 
+    def mock_ncwms_session(self, layer_ids):
+        """ :return: a session serving NcWMS capabilities with a sibling leaf layer for each id """
+
+        session = self.mock_mapservice_session(self.wms_directory / "ncwms-max.xml")
+        response = session.get.return_value
+
+        start = response.text.index('<Layer queryable="1">')
+        end = response.text.index("</Layer>", start) + len("</Layer>")
+        leaf_layer = response.text[start:end]
+
+        response.text = response.text[:start] + response.text[end:]
+        for layer_id in reversed(layer_ids):
+            next_layer = leaf_layer.replace(f">{self.ncwms_layer_id}<", f">{layer_id}<")
+            response.text = response.text[:start] + next_layer + response.text[start:]
+        response.content = response.text.encode()
+
+        return session
+
     def assert_ncwms_request(self, data_path, version, token=None):
 
         is_max_version = version == "1.3.0"
@@ -597,6 +630,174 @@ class WMSTestCase(ResourceTestCase):
         self.assertEqual(first_layer.palettes, [])
         self.assertEqual(first_layer.supported_styles, ["boxfill"])
 
+    def test_concurrent_ncwms_layer_requests(self):
+
+        # Test details of every NcWMS leaf layer are requested at once, and failed requests are tolerated
+
+        layer_ids = [
+            f"{self.ncwms_layer_id}_{suffix}"
+            for suffix in ("first", "second", "failed")
+        ]
+        session = self.mock_ncwms_session(layer_ids)
+
+        layer_session = self.mock_mapservice_session(
+            self.wms_directory / "ncwms-layer.json",
+            headers={"content-type": "application/json"},
+        )
+        failed_session = self.mock_mapservice_session(
+            self.wms_directory / "ncwms-layer.json",
+            ok=False,
+            headers={"content-type": "application/json"},
+        )
+        layer_response = layer_session.get.return_value
+        failed_response = failed_session.get.return_value
+
+        both_requested = threading.Barrier(2, timeout=5)
+
+        def get_layer_details(url, params=None, **kwargs):
+            if "_failed" in url or "_failed" in str(params):
+                return failed_response
+
+            both_requested.wait()  # Raises if either request is made only after the other
+            return layer_response
+
+        layer_session.get.side_effect = get_layer_details
+
+        client = WMSResource.get(
+            self.ncwms_url, lazy=False, session=session, layer_session=layer_session
+        )
+
+        ordered_ids = [l.id for l in client.ordered_layers]
+        self.assertEqual(ordered_ids[-3:], list(reversed(layer_ids)))
+        self.assertEqual(
+            [l.layer_order for l in client.ordered_layers],
+            list(range(len(ordered_ids))),
+        )
+
+        for next_id in layer_ids[:2]:
+            layer = client.leaf_layers[next_id]
+            self.assertEqual(layer.num_color_bands, 254)
+            self.assertEqual(layer.default_style, "boxfill/rainbow")
+            self.assertGreater(len(layer.styles), 1)
+
+        failed_layer = client.leaf_layers[layer_ids[2]]
+        self.assertEqual(failed_layer.num_color_bands, 0)
+        self.assertEqual(failed_layer.default_style, None)
+        self.assertEqual(failed_layer.supported_styles, ["boxfill"])
+
+    def test_ncwms_layer_requests_stopped(self):
+
+        layer_ids = [f"{self.ncwms_layer_id}_{idx}" for idx in range(3)]
+
+        # Test a deadline expiring while layer details are requested is raised, not taken for missing details
+
+        deadline = Deadline(60)
+        session = self.mock_ncwms_session(layer_ids)
+        layer_session = self.mock_mapservice_session(
+            self.wms_directory / "ncwms-layer.json",
+            headers={"content-type": "application/json"},
+        )
+
+        def expire_deadline(url, params=None, **kwargs):
+            deadline.expires = 0
+            raise requests.exceptions.ReadTimeout("Read timed out")
+
+        layer_session.get.side_effect = expire_deadline
+
+        with self.assertRaises(ServiceTimeout):
+            WMSResource.get(
+                self.ncwms_url,
+                lazy=False,
+                session=session,
+                layer_session=layer_session,
+                deadline=deadline,
+            )
+
+        # Test requests refused while the host is down are raised, but other errors still mean no details
+
+        for error, raised in ((ServiceUnavailable, True), (HTTPError, False)):
+            session = self.mock_ncwms_session(layer_ids)
+
+            get_layer = mock.patch.object(
+                NcWMSLayerResource, "get", side_effect=error("Failed")
+            )
+            with get_layer:
+                if raised:
+                    with self.assertRaises(error):
+                        WMSResource.get(self.ncwms_url, lazy=False, session=session)
+                else:
+                    client = WMSResource.get(
+                        self.ncwms_url, lazy=False, session=session
+                    )
+                    layer = client.leaf_layers[layer_ids[0]]
+                    self.assertEqual(layer.num_color_bands, 0)
+
+    def test_concurrent_lazy_ncwms_layer_requests(self):
+
+        # Test many sibling layers indexed lazily are populated before their details are requested at once
+
+        layer_ids = [f"{self.ncwms_layer_id}_{idx}" for idx in range(60)]
+
+        for lazy in (False, True):
+            session = self.mock_ncwms_session(layer_ids)
+            layer_session = self.mock_mapservice_session(
+                self.wms_directory / "ncwms-layer.json",
+                headers={"content-type": "application/json"},
+            )
+
+            client = WMSResource.get(
+                self.ncwms_url,
+                lazy=lazy,
+                lazy_layers=True,
+                session=session,
+                layer_session=layer_session,
+            )
+            ordered_layers = client.ordered_layers
+
+            self.assertEqual([l.id for l in ordered_layers[-60:]], layer_ids[::-1])
+            self.assertEqual(layer_session.get.call_count, 60)
+
+            for layer_id in layer_ids:
+                layer = client.leaf_layers[layer_id]
+                self.assertTrue(layer._populated_field_values)
+                self.assertEqual(layer.num_color_bands, 254)
+                self.assertEqual(layer.default_style, "boxfill/rainbow")
+                self.assertGreater(len(layer.styles), 1)
+
+            self.assertEqual({k[0] for k in client.get_legend_urls()}, set(layer_ids))
+
+    def test_ncwms_legends(self):
+
+        session = self.mock_mapservice_session(self.wms_directory / "ncwms-max.xml")
+        layer_session = self.mock_mapservice_session(
+            self.wms_directory / "ncwms-layer.json",
+            headers={"content-type": "application/json"},
+        )
+        client = WMSResource.get(
+            self.ncwms_url, lazy=True, session=session, layer_session=layer_session
+        )
+
+        # Test that NcWMS styles are populated from layer details before legends are fetched
+
+        self.assertEqual(client.title, "My ncWMS server")
+        self.assertEqual(client._ordered_layers, [])
+
+        client._session = self.mock_mapservice_session(
+            self.data_directory / "test.png",
+            mode="rb",
+            headers={"content-type": "image/png"},
+        )
+        legends = client.fetch_legends(raw=True)
+
+        layer = client.leaf_layers[
+            "pr-tasmax-tasmin_day_precipitation_flux/pr-tasmax-tasmin_day"
+        ]
+        self.assertGreater(len(layer.styles), 1)
+        self.assertEqual(
+            set(legends), {(layer.id, style["id"]) for style in layer.styles}
+        )
+        self.assertEqual(client._session.get.call_count, len(layer.styles))
+
     def test_invalid_ncwms_layer_request(self):
         session = self.mock_mapservice_session(
             self.wms_directory / "invalid-ncwms-layer.json"
@@ -615,23 +816,159 @@ class WMSTestCase(ResourceTestCase):
         )
 
     def test_invalid_wms_request(self):
-        session = self.mock_mapservice_session(
-            self.wms_directory / "invalid-wms-layer-extent.xml"
+        for lazy_layers in (False, True):
+            negative_cache.clear()
+
+            session = self.mock_mapservice_session(
+                self.wms_directory / "invalid-wms-layer-extent.xml"
+            )
+            with self.assertRaises(BadExtent):
+                WMSResource.get(
+                    self.wms_url, session=session, lazy=False, lazy_layers=lazy_layers
+                )
+
+            session = self.mock_mapservice_session(
+                self.wms_directory / "missing-wms-layer-extent.xml"
+            )
+            with self.assertRaises(MissingFields):
+                WMSResource.get(
+                    self.wms_url, session=session, lazy=False, lazy_layers=lazy_layers
+                )
+
+            session = self.mock_mapservice_session(
+                self.wms_directory / "missing-wms-layers.xml"
+            )
+            with self.assertRaises(NoLayers):
+                WMSResource.get(
+                    self.wms_url, session=session, lazy=False, lazy_layers=lazy_layers
+                )
+
+    def test_lazy_wms_layers(self):
+        def get_layer_data(layer):
+            # Extents and spatial references compare by their representation
+            data = {
+                f._attr_name: repr(getattr(layer, f._attr_name))
+                for f in layer._meta.fields
+            }
+            data["child_layers"] = [child.id for child in layer.child_layers]
+            data["leaf_layers"] = list(layer.leaf_layers)
+            return data
+
+        services = (
+            (self.wms_url, "demo-wms-max.xml"),
+            (self.wms_url, "demo-wms-min.xml"),
+            (self.ncwms_url, "ncwms-max.xml"),
         )
-        with self.assertRaises(BadExtent):
-            WMSResource.get(self.wms_url, session=session, lazy=False)
+        for url, file_name in services:
+            layer_session = self.mock_mapservice_session(
+                self.wms_directory / "ncwms-layer.json",
+                headers={"content-type": "application/json"},
+            )
+            session = self.mock_mapservice_session(self.wms_directory / file_name)
 
-        session = self.mock_mapservice_session(
-            self.wms_directory / "missing-wms-layer-extent.xml"
+            client = WMSResource.get(
+                url, session=session, layer_session=layer_session, lazy=False
+            )
+            lazy_client = WMSResource.get(
+                url,
+                session=session,
+                layer_session=layer_session,
+                lazy=True,
+                lazy_layers=True,
+            )
+
+            # Test service fields are aggregated without populating layers
+
+            self.assertEqual(lazy_client.title, client.title)
+            self.assertEqual(list(lazy_client.leaf_layers), list(client.leaf_layers))
+            self.assertEqual(
+                lazy_client.full_extent.as_list(precision=7),
+                client.full_extent.as_list(precision=7),
+            )
+            self.assertEqual(
+                lazy_client.supported_spatial_refs, client.supported_spatial_refs
+            )
+            self.assertEqual(
+                lazy_client.spatial_reference.srs, client.spatial_reference.srs
+            )
+            self.assertEqual(lazy_client.has_dimensions, client.has_dimensions)
+            self.assertEqual(lazy_client.has_time, client.has_time)
+
+            lazy_layers = lazy_client.leaf_layers.values()
+            self.assertFalse(any(l._populated_field_values for l in lazy_layers))
+
+            # Test each layer is populated on first access, the same as if populated right away
+
+            layer_id = list(client.leaf_layers)[-1]
+            lazy_layer = lazy_client.leaf_layers[layer_id]
+
+            self.assertEqual(lazy_layer.title, client.leaf_layers[layer_id].title)
+            self.assertTrue(lazy_layer._populated_field_values)
+            self.assertEqual(sum(l._populated_field_values for l in lazy_layers), 1)
+
+            lazy_ordered = lazy_client.ordered_layers
+            self.assertEqual(len(lazy_ordered), len(client.ordered_layers))
+
+            for layer, lazy_layer in zip(client.ordered_layers, lazy_ordered):
+                self.assertEqual(get_layer_data(lazy_layer), get_layer_data(layer))
+
+    def test_lazy_wms_layer_loading(self):
+        session = self.mock_mapservice_session(self.wms_directory / "demo-wms-max.xml")
+
+        client = WMSResource.get(self.wms_url, session=session, lazy=False)
+        lazy_client = WMSResource.get(
+            self.wms_url, session=session, lazy=False, lazy_layers=True
         )
-        with self.assertRaises(MissingFields):
-            WMSResource.get(self.wms_url, session=session, lazy=False)
 
-        session = self.mock_mapservice_session(
-            self.wms_directory / "missing-wms-layers.xml"
+        # Test a layer that fails to populate is left indexed, and populated on next access
+
+        layer_id = list(client.leaf_layers)[0]
+        lazy_layer = lazy_client.leaf_layers[layer_id]
+
+        with mock.patch.object(
+            WMSLayerResource, "_populate_styles", side_effect=ValueError
+        ):
+            with self.assertRaises(ValueError):
+                lazy_layer.styles
+
+        self.assertFalse(lazy_layer._populated_field_values)
+        self.assertIsNotNone(lazy_layer._layer_data)
+        self.assertNotIn("title", vars(lazy_layer))
+
+        self.assertEqual(lazy_layer.styles, client.leaf_layers[layer_id].styles)
+        self.assertTrue(lazy_layer._populated_field_values)
+        self.assertIsNone(lazy_layer._layer_data)
+
+        # Test layers populated from many threads at once are each populated fully, and only once
+
+        lazy_client = WMSResource.get(
+            self.wms_url, session=session, lazy=False, lazy_layers=True
+        )
+        layer_ids = list(client.leaf_layers) * 8
+
+        layers = set()
+        for layer in lazy_client.leaf_layers.values():
+            while layer is not None:
+                layers.add(layer)
+                layer = layer.parent
+
+        unpopulated = [l for l in layers if not l._populated_field_values]
+
+        with mock.patch.object(
+            WMSLayerResource,
+            "_populate_indexed_layer",
+            side_effect=WMSLayerResource._populate_indexed_layer,
+            autospec=True,
+        ) as populate:
+            styles = map_concurrently(
+                lambda layer_id: lazy_client.leaf_layers[layer_id].styles, layer_ids
+            )
+
+        self.assertEqual(
+            styles, [client.leaf_layers[layer_id].styles for layer_id in layer_ids]
         )
-        with self.assertRaises(NoLayers):
-            WMSResource.get(self.wms_url, session=session, lazy=False)
+        self.assertTrue(all(l._populated_field_values for l in layers))
+        self.assertEqual(populate.call_count, len(unpopulated))
 
     def test_invalid_wms_layer_request(self):
         with self.assertRaises(NotImplementedError):
@@ -668,6 +1005,160 @@ class WMSTestCase(ResourceTestCase):
             params={"version": "1.1.1"},
         )
 
+        # Test images are passed through, unless stitched across the anti-meridian
+
+        self.assert_get_raw_image(client, layer_ids=["country_bounds"])
+        self.assert_get_raw_image(
+            client, passthrough=False, extent=extent, layer_ids=["country_bounds"]
+        )
+
+        # Test images that are not passed through are encoded with the client's profile
+
+        with mock.patch.object(WMSResource, "encoding_profile", "balanced"):
+            with mock.patch(
+                "clients.utils.images.encode_image", wraps=encode_image
+            ) as mock_encode:
+                self.assert_get_raw_image(
+                    client,
+                    passthrough=False,
+                    extent=extent,
+                    layer_ids=["country_bounds"],
+                )
+        self.assertEqual(mock_encode.call_args[0][1], "balanced")
+
+        # Test a color marked transparent is fixed, in a palette if raw
+
+        self.assert_get_transparent_image(client, layer_ids=["country_bounds"])
+
+    def test_wms_legends(self):
+
+        session = self.mock_mapservice_session(self.wms_directory / "demo-wms-max.xml")
+        client = WMSResource.get(self.wms_url, lazy=False, session=session)
+
+        image_path = self.data_directory / "test.png"
+        client._session = self.mock_mapservice_session(
+            image_path, mode="rb", headers={"content-type": "image/png"}
+        )
+        test_image = Image.open(image_path)
+
+        legend_urls = client.get_legend_urls()
+        self.assertEqual(
+            set(legend_urls), {("cities", "default"), ("continents", "default")}
+        )
+        self.assertEqual(
+            legend_urls["cities", "default"],
+            "https://demo.mapserver.org/cgi-bin/wms?version=1.3.0&service=WMS"
+            "&request=GetLegendGraphic&sld_version=1.1.0&layer=cities"
+            "&format=image/png&STYLE=default",
+        )
+        self.assertEqual(client.get_legend_urls(styles=["other"]), {})
+        self.assertEqual(
+            set(client.get_legend_urls(layer_ids="cities")), {("cities", "default")}
+        )
+        with self.assertRaises(ValidationError):
+            client.get_legend_urls(layer_ids=["cities", "missing"])
+
+        # Test legends are fetched once each, and decoded unless raw
+
+        legends = client.fetch_legends()
+        self.assertEqual(set(legends), set(legend_urls))
+        self.assertEqual(client._session.get.call_count, 2)
+        for legend in legends.values():
+            self.assertEqual(legend.size, test_image.size)
+            self.assertEqual(legend.tobytes(), test_image.tobytes())
+
+        requested_urls = {args[0] for args, _ in client._session.get.call_args_list}
+        self.assertEqual(requested_urls, set(legend_urls.values()))
+
+        # Test legends are reused from the cache, as served when raw
+
+        legends = client.fetch_legends(layer_ids=["cities"], raw=True)
+        self.assertEqual(client._session.get.call_count, 2)
+        self.assertEqual(legends["cities", "default"].content_type, "image/png")
+        with open(image_path, "rb") as image_file:
+            self.assertEqual(legends["cities", "default"].content, image_file.read())
+
+        # Test legends packed into an atlas share a swatch
+
+        atlas = client.get_legend_atlas()
+        self.assertEqual(atlas.swatch_count, 1)
+        self.assertEqual(set(atlas.index), set(legend_urls))
+        self.assertEqual(client._session.get.call_count, 2)
+
+        # Test tokens are sent with legend requests, and cached separately
+
+        client = WMSResource.get(
+            self.wms_url, lazy=False, session=session, token="secure"
+        )
+        client._session = self.mock_mapservice_session(
+            image_path, mode="rb", headers={"content-type": "image/png"}
+        )
+        client.fetch_legends(layer_ids=["cities"])
+        self.assertEqual(client._session.get.call_count, 1)
+        self.assertEqual(
+            client._session.get.call_args[1]["params"], {"token": "secure"}
+        )
+
+    def test_invalid_wms_legends(self):
+
+        session = self.mock_mapservice_session(self.wms_directory / "demo-wms-max.xml")
+        client = WMSResource.get(self.wms_url, lazy=False, session=session)
+
+        legend_keys = {("cities", "default"), ("continents", "default")}
+
+        # Test legends that fail with HTTP errors, service exceptions or invalid images are skipped
+
+        client._session = self.mock_mapservice_session(
+            self.service_exception_path, ok=False
+        )
+        with self.assertRaises(HTTPError):
+            client._fetch_legend(client.get_legend_urls()["cities", "default"])
+        self.assertEqual(client.fetch_legends(), dict.fromkeys(legend_keys))
+
+        client._session = self.mock_mapservice_session(
+            self.service_exception_path,
+            mode="rb",
+            headers={"content-type": WMS_EXCEPTION_FORMAT},
+        )
+        self.assertEqual(client.fetch_legends(), dict.fromkeys(legend_keys))
+
+        client._session = self.mock_mapservice_session(
+            self.data_directory / "test.html",
+            mode="rb",
+            headers={"content-type": "image/png"},
+        )
+        self.assertEqual(client.fetch_legends(), dict.fromkeys(legend_keys))
+        raw_legends = client.fetch_legends(raw=True)
+        self.assertEqual(raw_legends["cities", "default"].content_type, "image/png")
+
+        # Test one failing legend does not fail the others
+
+        image_path = self.data_directory / "test.png"
+        client._session = self.mock_mapservice_session(
+            image_path, mode="rb", headers={"content-type": "image/png"}
+        )
+        legend_response = client._session.get.return_value
+        failing_url = client.get_legend_urls()["cities", "default"]
+
+        def get_legend(url, **kwargs):
+            if url == failing_url:
+                raise requests.exceptions.ConnectionError("refused")
+            return legend_response
+
+        client._session.get.side_effect = get_legend
+        legend_cache.clear()
+
+        with mock.patch.object(WMSResource, "retry_policy", RetryPolicy(retries=0)):
+            legends = client.fetch_legends()
+
+        self.assertIsNone(legends["cities", "default"])
+        self.assertEqual(
+            legends["continents", "default"].size, Image.open(image_path).size
+        )
+
+        atlas = client.get_legend_atlas()
+        self.assertEqual(set(atlas.index), {("continents", "default")})
+
     def test_invalid_wms_image_request(self):
 
         session = self.mock_mapservice_session(self.wms_directory / "demo-wms-max.xml")
@@ -8,17 +8,21 @@ from io import BytesIO
 from gis_metadata.iso_metadata_parser import IsoParser
 from gis_metadata.utils import format_xpaths, ParserProperty
 from parserutils.collections import wrap_value
-from parserutils.elements import get_remote_element
 from parserutils.urls import has_trailing_slash, url_to_parts, parts_to_url
 from restle.fields import TextField
 from restle.serializers import JSONSerializer
 
-from .exceptions import HTTPError, ImageError, ValidationError
+from .exceptions import HTTPError, ImageError, ServiceTimeout, ServiceUnavailable
+from .exceptions import ValidationError
 from .query.fields import DictField, ExtentField, ListField
 from .query.serializers import XMLToJSONSerializer
 from .resources import ClientResource
+from .utils.concurrency import map_concurrently
+from .utils.deadlines import Deadline
 from .utils.geometry import Extent, SpatialReference, union_extent
-from .utils.images import make_color_transparent
+from .utils.images import RawImage, make_color_transparent, reduce_to_palette
+from .utils.metrics import instrumented
+from .utils.profiling import timed_phase
 from .wms import NcWMSLayerResource
 from .wms import (
     WMS_DEFAULT_PARAMS,
@@ -223,7 +227,7 @@ class ThreddsResource(ClientResource):
         # Fill out all other data from related endpoints
 
         self._parse_related_endpoints()
-        self._populate_from_endpoints()
+        self._query_related_endpoints()
 
     def _parse_related_endpoints(self):
         """ Derive related end point URLs following THREDDS service conventions """
@@ -237,14 +241,6 @@ class ThreddsResource(ClientResource):
             parts["query"] = {}
             self.download_url = parts_to_url(parts, trailing_slash=has_trailing)
 
-            try:
-                # Ping the URL and check the response code
-                response = requests.head(self.download_url)
-                response.raise_for_status()
-
-            except requests.exceptions.HTTPError:
-                self.download_url = None
-
         # Derive base WMS url: thredds/wms/<urlPath>
         parts["path"] = self._wms_path
         self._wms_url = parts_to_url(parts, trailing_slash=has_trailing)
@@ -265,32 +261,77 @@ class ThreddsResource(ClientResource):
         parts["path"] = self._iso_path
         parts["query"] = {"dataset": self.id}
         self._metadata_url = parts_to_url(parts, trailing_slash=has_trailing)
-        self._metadata_parser = ThreddsIsoParser(get_remote_element(self._metadata_url))
 
-    def _populate_from_endpoints(self):
-        """ Populate layers from metadata and individual layer endpoints """
+    def _query_related_endpoints(self):
+        """ Queries the download URL, ISO metadata and, unless lazy, layer ids all at once, then populates layers """
+
+        queries = [self._query_download_url, self._query_metadata]
+        if not self._lazy:
+            queries.append(self._query_layer_ids)
+
+        results = map_concurrently(lambda query: query(), queries)
+
+        self._populate_from_endpoints(*results[2:])
+
+    def _query_download_url(self):
+        """ Pings the download URL, and discards it if it does not respond correctly """
+
+        if not self.download_url:
+            return
+
+        try:
+            self._make_request(
+                self.download_url,
+                {},
+                deadline=self._deadline,
+                endpoint="metadata",
+                method="head",
+            )
+        except requests.exceptions.RequestException:
+            self.download_url = None  # Not available, or not responding in time
+
+    def _query_metadata(self):
+        """ Fetches and parses ISO metadata """
+
+        try:
+            response = self._make_request(
+                self._metadata_url, {}, deadline=self._deadline, endpoint="metadata"
+            )
+        except requests.exceptions.HTTPError as ex:
+            raise HTTPError(
+                "The THREDDS metadata query did not respond correctly",
+                underlying=ex,
+                url=self._metadata_url,
+                status_code=getattr(ex.response, "status_code", None),
+            )
+
+        self._metadata_parser = ThreddsIsoParser(response.text)
+
+    def _populate_from_endpoints(self, layer_ids=None):
+        """
+        Populate layers from metadata and individual layer endpoints, querying all layers at once
+        :param layer_ids: leaf layer ids by layer group description, if already queried
+        """
 
         if self._lazy:
             return  # Query only when a related property has been dereferenced
 
-        layer_metadata = {d["id"]: d for d in self._metadata_parser.dimensions}
-        constraints = set()
-        layers = []
+        if layer_ids is None:
+            layer_ids = self._query_layer_ids()
 
-        for idx, desc_id in enumerate(
-            (k, l) for k, v in self._query_layer_ids().items() for l in v
-        ):
-            layers_desc, layer_id = desc_id
+        layer_metadata = {d["id"]: d for d in self._metadata_parser.dimensions}
+        layer_descs = [(k, l) for k, v in layer_ids.items() for l in v]
 
+        for layers_desc, _ in layer_descs:
             if not self.description:
                 # Use the first layer group description
                 self.description = layers_desc
 
-            layer_obj = self._query_layer(layer_id, idx, layer_metadata)
-            layers.append(layer_obj)
-
-            if layer_obj.copyright_text:
-                constraints.add(layer_obj.copyright_text)
+        layers = map_concurrently(
+            lambda idx: self._query_layer(layer_descs[idx][1], idx, layer_metadata),
+            range(len(layer_descs)),
+        )
+        constraints = {l.copyright_text for l in layers if l.copyright_text}
 
         self.full_extent = union_extent(
             l.full_extent for l in layers
@@ -336,6 +377,7 @@ class ThreddsResource(ClientResource):
             color_map=self.styles_color_map,
             layer_data=layer_data,
             session=(self._layer_session or self._session),
+            deadline=self._deadline,
         )
 
     def _query_layer_ids(self, data=None, layer_ids=None):
@@ -344,7 +386,13 @@ class ThreddsResource(ClientResource):
         if data is None:
             try:
                 data = JSONSerializer.to_dict(
-                    self._make_request(self._layers_url, {}, timeout=120).text
+                    self._make_request(
+                        self._layers_url,
+                        {},
+                        timeout=120,
+                        deadline=self._deadline,
+                        endpoint="layers",
+                    ).text
                 )
             except requests.exceptions.HTTPError as ex:
                 raise HTTPError(
@@ -383,6 +431,7 @@ class ThreddsResource(ClientResource):
 
         return super(ThreddsResource, self).__getattribute__(item)
 
+    @instrumented("get_image", timed=True)
     def get_image(
         self,
         extent,
@@ -393,13 +442,21 @@ class ThreddsResource(ClientResource):
         time_range=None,
         params=None,
         image_format="png",
+        deadline=None,
+        raw=False,
     ):
         """
         Note: extent aspect ratio must align correctly with image aspect ratio, or this will be warped incorrectly.
         Extent must be in Web Mercator. The caller of this function is expected to pass in valid values.
         Also note: the first layer is the lowest layer in stack, all others render on top
+        :param deadline: a Deadline, or number of seconds, within which all image requests must complete
+        :param raw:
+            If True, return a RawImage: the image bytes as served, unless transparency must be fixed
+            or the image stitched across the anti-meridian, in which case the result is encoded as PNG
         """
 
+        deadline = Deadline.from_value(deadline)  # Shared by both sides of the anti-meridian
+
         if not isinstance(extent, Extent):
             spatial_ref = (
                 getattr(extent, "spatial_reference", None) or self.spatial_reference
@@ -424,6 +481,8 @@ class ThreddsResource(ClientResource):
                 time_range,
                 params,
                 image_format,
+                deadline,
+                raw,
             )
 
         # Edge case: mapserver renders badly any global extent raster data that straddles the -180/180 line
@@ -447,12 +506,14 @@ class ThreddsResource(ClientResource):
             time_range,
             params,
             image_format,
+            deadline,
         )
-        img.paste(
-            wms_img,
-            (left_side_adjust, 0, left_side_adjust + img_width, img_height),
-            wms_img,
-        )
+        with timed_phase("composite"):
+            img.paste(
+                wms_img,
+                (left_side_adjust, 0, left_side_adjust + img_width, img_height),
+                wms_img,
+            )
 
         # Request other side of meridian, if part of the extent
         if extent.has_negative_extent():
@@ -469,8 +530,14 @@ class ThreddsResource(ClientResource):
                 time_range,
                 params,
                 image_format,
+                deadline,
             )
-            img.paste(negative_image, (0, 0), negative_image)
+            with timed_phase("composite"):
+                img.paste(negative_image, (0, 0), negative_image)
+
+        if raw:
+            with timed_phase("encode"):
+                return RawImage.from_image(img, profile=self.encoding_profile)
 
         return img
 
@@ -484,6 +551,8 @@ class ThreddsResource(ClientResource):
         time_range,
         params,
         image_format,
+        deadline=None,
+        raw=False,
     ):
 
         if not image_format.startswith("image/"):
@@ -522,7 +591,13 @@ class ThreddsResource(ClientResource):
 
             # Send the image request
 
-            response = self._make_request(self._wms_url, image_params, timeout=120)
+            response = self._make_request(
+                self._wms_url,
+                image_params,
+                timeout=120,
+                deadline=deadline,
+                endpoint="export",
+            )
             response_type = response.headers["content-type"]
 
             if response_type != image_format:
@@ -534,21 +609,41 @@ class ThreddsResource(ClientResource):
                     url=response.url,
                 )
 
-            img = Image.open(BytesIO(response.content))
-            fix_transparency = False
-            if (
-                img.mode == "RGB" and img.info["transparency"]
-            ):  # PIL does not always correctly detect PNG transparency
-                fix_transparency = True
+            with timed_phase("decode") as phase:
+                phase.bytes = len(response.content)
+
+                img = Image.open(BytesIO(response.content))
+                fix_transparency = False
+                if (
+                    img.mode == "RGB" and img.info["transparency"]
+                ):  # PIL does not always correctly detect PNG transparency
+                    fix_transparency = True
+                    # Replaced below, whether or not this version of PIL applies it on conversion
+                    r, g, b = img.info.pop("transparency")
+                    replace_color = (r, g, b, 255)
+
+                # Only the header has been read: pass the image through untouched if no pixels need to change
+                if raw and not fix_transparency:
+                    return RawImage(response.content, response_type)
+                elif raw:
+                    img.load()  # Encoded again once fixed, so kept in a palette if it has few enough colors
+                else:
+                    img = img.convert("RGBA")
 
-            img = img.convert("RGBA")
             if fix_transparency:
-                r, g, b = img.info["transparency"]
-                replace_color = (r, g, b, 255)
-                make_color_transparent(img, replace_color)
+                with timed_phase("transparency"):
+                    if raw:
+                        img = reduce_to_palette(img)
+                    img = make_color_transparent(img, replace_color, keep_palette=raw)
+
+            if raw:
+                with timed_phase("encode"):
+                    return RawImage.from_image(img, profile=self.encoding_profile)
 
             return img
 
+        except (ServiceTimeout, ServiceUnavailable):
+            raise  # Deadline exceeded or host down: not an image error
         except requests.exceptions.HTTPError as ex:
             raise HTTPError(
                 "The THREDDS service image query did not respond correctly",
@@ -0,0 +1,172 @@
+""" Caches of classified service failures, so that known-broken services are not requested repeatedly, and of static content """
+import copy
+import threading
+import time
+
+from urllib.parse import urlencode
+
+from ..exceptions import BadTileScheme, HTTPError, NoLayers, ServiceError
+from ..exceptions import ServiceMisconfigured, UnsupportedVersion
+
+
+DEFAULT_NEGATIVE_TTL = 300  # Seconds for which a failure is remembered
+DEFAULT_CONTENT_TTL = 3600  # Seconds for which legend graphics are reused
+DEFAULT_MAX_ENTRIES = 10000
+
+CACHED_ERRORS = (BadTileScheme, NoLayers, ServiceMisconfigured, UnsupportedVersion)
+CACHED_STATUS_CODES = (404, 410)  # Missing services, which will not resolve on retry
+
+# Services denying access, which will not resolve on retry with the same params (and so the same token, if any)
+CACHED_SERVICE_STATUS_CODES = (401, 403) + CACHED_STATUS_CODES
+
+
+class NegativeCache(object):
+    """
+    Remembers errors that classify a service as broken (rather than failing transiently) for a time to live.
+    Errors are keyed by URL and request parameters, and raised again for the same request until they expire.
+    """
+
+    def __init__(self, ttl=DEFAULT_NEGATIVE_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        self._errors = {}
+
+    def __len__(self):
+        return len(self._errors)
+
+    @staticmethod
+    def get_key(url, params=None, **options):
+        """ :return: a key for the request, including any options affecting how its response is validated """
+
+        params = sorted((params or {}).items())
+        options = sorted((k, v) for k, v in options.items() if v)
+
+        return url, urlencode(params), urlencode(options)
+
+    def is_cacheable(self, error):
+        """ :return: True if the error means the service will fail the same way if requested again """
+
+        if isinstance(error, CACHED_ERRORS):
+            return True
+        elif isinstance(error, ServiceError):
+            # Expired or invalid tokens (498, 499) and other 5xx statuses may resolve, so are not cached
+            return error.status_code in CACHED_SERVICE_STATUS_CODES
+        elif isinstance(error, HTTPError):
+            return error.status_code in CACHED_STATUS_CODES
+
+        return False
+
+    def add(self, key, error):
+        """ Remembers the error for the key if it classifies the service as broken """
+
+        if not self.ttl or not self.is_cacheable(error):
+            return
+
+        with self._lock:
+            if len(self._errors) >= self.max_entries:
+                self._purge()
+
+            self._errors[key] = (time.monotonic() + self.ttl, error)
+
+    def get(self, key):
+        """ :return: a copy of the error remembered for the key, or None if there is none or it has expired """
+
+        with self._lock:
+            cached = self._errors.get(key)
+
+            if cached is None:
+                return None
+            elif cached[0] <= time.monotonic():
+                self._errors.pop(key, None)
+                return None
+
+        return copy.copy(cached[1])  # Each raise gets its own traceback
+
+    def raise_cached(self, key):
+        """ Raises the error remembered for the key, if any """
+
+        error = self.get(key)
+        if error is not None:
+            raise error
+
+    def remove(self, key):
+        with self._lock:
+            self._errors.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._errors.clear()
+
+    def _purge(self):
+        """ Drops expired entries, and then the oldest entries if still full: must be called holding the lock """
+
+        now = time.monotonic()
+        for key in [k for k, v in self._errors.items() if v[0] <= now]:
+            del self._errors[key]
+
+        while len(self._errors) >= self.max_entries:
+            del self._errors[next(iter(self._errors))]
+
+
+class ContentCache(object):
+    """ Remembers content that rarely changes, such as legend graphics, by URL for a time to live """
+
+    def __init__(self, ttl=DEFAULT_CONTENT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        self._content = {}
+
+    def __len__(self):
+        return len(self._content)
+
+    def add(self, key, content):
+        if not self.ttl:
+            return
+
+        with self._lock:
+            self._content.pop(key, None)  # Re-added entries are the newest
+
+            if len(self._content) >= self.max_entries:
+                self._purge()
+
+            self._content[key] = (time.monotonic() + self.ttl, content)
+
+    def get(self, key):
+        """ :return: the content remembered for the key, or None if there is none or it has expired """
+
+        with self._lock:
+            cached = self._content.get(key)
+
+            if cached is None:
+                return None
+            elif cached[0] <= time.monotonic():
+                self._content.pop(key, None)
+                return None
+
+        return cached[1]
+
+    def remove(self, key):
+        with self._lock:
+            self._content.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._content.clear()
+
+    def _purge(self):
+        """ Drops expired entries, and then the oldest entries if still full: must be called holding the lock """
+
+        now = time.monotonic()
+        for key in [k for k, v in self._content.items() if v[0] <= now]:
+            del self._content[key]
+
+        while len(self._content) >= self.max_entries:
+            del self._content[next(iter(self._content))]
+
+
+negative_cache = NegativeCache()
+legend_cache = ContentCache()
@@ -0,0 +1,212 @@
+""" Adaptive per-host limits on concurrent requests, shared by every request and fan-out in the clients """
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import copy_context
+
+import requests
+
+from .retries import get_host
+
+
+DEFAULT_INITIAL_LIMIT = 4
+DEFAULT_MIN_LIMIT = 1
+DEFAULT_MAX_LIMIT = 32
+
+OVERLOAD_STATUSES = (429, 503)  # Statuses indicating a host is receiving more requests than it can handle
+
+
+class AdaptiveLimiter(object):
+    """
+    Limits concurrent requests to a host, adjusting the limit by additive-increase/multiplicative-decrease:
+    the limit grows by one for each limit's worth of requests completed while latency stays near its baseline,
+    and is cut by backoff_ratio whenever a request is throttled or times out.
+    """
+
+    def __init__(
+        self,
+        initial_limit=DEFAULT_INITIAL_LIMIT,
+        min_limit=DEFAULT_MIN_LIMIT,
+        max_limit=DEFAULT_MAX_LIMIT,
+        backoff_ratio=0.5,
+        latency_tolerance=2.0,
+    ):
+        self.min_limit = max(min_limit, 1)
+        self.max_limit = max(max_limit, self.min_limit)
+        self.limit = float(min(max(initial_limit, self.min_limit), self.max_limit))
+
+        self.backoff_ratio = backoff_ratio
+        self.latency_tolerance = latency_tolerance
+        self.baseline_latency = None
+
+        self.in_flight = 0
+        self.queued = 0
+
+        self._condition = threading.Condition()
+
+    def acquire(self, timeout=None):
+        """
+        Waits for the number of requests in flight to fall below the current limit.
+        :return: True if a request may be sent, or False if none could be before the timeout
+        """
+
+        with self._condition:
+            self.queued += 1
+            try:
+                acquired = self._condition.wait_for(
+                    lambda: self.in_flight < int(self.limit), timeout
+                )
+            finally:
+                self.queued -= 1
+
+            if acquired:
+                self.in_flight += 1
+
+            return acquired
+
+    def release(self, latency=None, overloaded=False):
+        """
+        Frees the slot taken by a completed request, and adapts the limit to how the request fared.
+        :param latency: seconds taken by the request, or None if it failed without indicating load
+        :param overloaded: True if the host throttled the request, or it timed out
+        """
+
+        with self._condition:
+            self.in_flight -= 1
+
+            if overloaded:
+                self.limit = max(self.min_limit, self.limit * self.backoff_ratio)
+
+            elif latency is not None:
+                if self.baseline_latency is None or latency < self.baseline_latency:
+                    self.baseline_latency = latency
+                else:
+                    # Drift slowly upward, so the baseline follows a host that has become slower
+                    self.baseline_latency += (latency - self.baseline_latency) * 0.05
+
+                if latency <= self.baseline_latency * self.latency_tolerance:
+                    self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+            self._condition.notify_all()
+
+    @contextmanager
+    def request(self, timeout=None):
+        """
+        Holds a slot for the duration of a request made by other means than ClientResource._make_request.
+        :raise requests.exceptions.Timeout: if no slot is available before the timeout
+        """
+
+        if not self.acquire(timeout):
+            raise requests.exceptions.Timeout("No request slot was available in time")
+
+        started = time.monotonic()
+        try:
+            yield
+        except requests.exceptions.Timeout:
+            self.release(overloaded=True)
+            raise
+        except Exception:
+            self.release()
+            raise
+        else:
+            self.release(time.monotonic() - started)
+
+    def get_stats(self):
+        """ :return: a dict with the current limit, and number of requests in flight and waiting """
+
+        with self._condition:
+            return {
+                "limit": int(self.limit),
+                "in_flight": self.in_flight,
+                "queued": self.queued,
+            }
+
+
+class LimiterRegistry(object):
+    """ Creates and keeps one adaptive limiter per host, configurable for all hosts or per host """
+
+    def __init__(
+        self,
+        initial_limit=DEFAULT_INITIAL_LIMIT,
+        min_limit=DEFAULT_MIN_LIMIT,
+        max_limit=DEFAULT_MAX_LIMIT,
+    ):
+        self.initial_limit = initial_limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+
+        self._lock = threading.Lock()
+        self._limiters = {}
+        self._host_config = {}
+
+    def configure_host(self, host, initial_limit=None, min_limit=None, max_limit=None):
+        """
+        Overrides limits for a single host, replacing any limiter already created for it.
+        :param host: a host name with optional port, or any URL at that host
+        """
+
+        host = get_host(host)
+        config = {
+            "initial_limit": initial_limit or self.initial_limit,
+            "min_limit": min_limit or self.min_limit,
+            "max_limit": max_limit or self.max_limit,
+        }
+
+        with self._lock:
+            self._host_config[host] = config
+            self._limiters.pop(host, None)
+
+    def get_limiter(self, url):
+        """ :return: the limiter for the host of the URL """
+
+        host = get_host(url)
+
+        with self._lock:
+            limiter = self._limiters.get(host)
+
+            if limiter is None:
+                config = self._host_config.get(host) or {
+                    "initial_limit": self.initial_limit,
+                    "min_limit": self.min_limit,
+                    "max_limit": self.max_limit,
+                }
+                limiter = self._limiters[host] = AdaptiveLimiter(**config)
+
+        return limiter
+
+    def get_stats(self):
+        """ :return: current limits and queue depths by host """
+
+        with self._lock:
+            limiters = dict(self._limiters)
+
+        return {host: limiter.get_stats() for host, limiter in limiters.items()}
+
+    def reset(self):
+        """ Forgets all adapted limits, starting every host over at its initial limit """
+
+        with self._lock:
+            self._limiters.clear()
+
+
+def map_concurrently(func, items, max_workers=DEFAULT_MAX_LIMIT):
+    """
+    Calls func with each item in a bounded pool of threads, which may be limited further per host.
+    Each call runs in a copy of the caller's context, so spans and timings in progress include its work.
+    :return: a list of results in the same order as items, raising the first error encountered in that order
+    """
+
+    items = list(items)
+
+    if len(items) < 2:
+        return [func(item) for item in items]
+
+    contexts = [copy_context() for _ in items]
+
+    with ThreadPoolExecutor(max_workers=min(len(items), max_workers)) as executor:
+        return list(executor.map(lambda c, i: c.run(func, i), contexts, items))
+
+
+concurrency_limiters = LimiterRegistry()
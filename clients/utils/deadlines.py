@@ -0,0 +1,50 @@
+""" Deadlines bounding the total time spent on operations that make many requests """
+import time
+
+
+MINIMUM_TIMEOUT = 0.001  # Requests will not accept a timeout of zero
+
+
+class Deadline(object):
+    """
+    An overall time budget for an operation, shared by every request made on its behalf.
+    Each request is given what is left of the budget as its timeout, so later requests time out sooner.
+    """
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires = time.monotonic() + seconds
+
+    def __repr__(self):
+        return f"Deadline({self.seconds}, remaining={self.remaining:.3f})"
+
+    @classmethod
+    def from_value(cls, value):
+        """ :return: a new deadline from a number of seconds, or the value itself if it is already a deadline """
+
+        if value is None or isinstance(value, Deadline):
+            return value
+        return cls(value)
+
+    @property
+    def expired(self):
+        return self.remaining <= 0
+
+    @property
+    def remaining(self):
+        return max(self.expires - time.monotonic(), 0)
+
+    def limit(self, timeout=None):
+        """
+        :param timeout: a timeout in seconds, or a tuple of connect and read timeouts, as accepted by requests
+        :return: the timeout, with each value limited to the time remaining before the deadline
+        """
+
+        remaining = max(self.remaining, MINIMUM_TIMEOUT)
+
+        if timeout is None:
+            return remaining
+        elif isinstance(timeout, (list, tuple)):
+            return tuple(remaining if t is None else min(t, remaining) for t in timeout)
+        else:
+            return min(timeout, remaining)
@@ -2,12 +2,14 @@ import copy
 import json
 import re
 
+from array import array
 from bisect import bisect_left
 from decimal import Decimal
+from functools import lru_cache
 from itertools import product
 from math import cos, fabs, radians, sqrt
 from parserutils.numbers import is_number
-from pyproj import Proj, transform
+from pyproj import Proj, Transformer
 from pyproj.exceptions import CRSError
 
 from ..exceptions import BadExtent, BadSpatialReference
@@ -25,6 +27,8 @@ GLOBAL_EXTENT_WGS84 = (-180.0, -90.0, 180.0, 90.0)
 GLOBAL_EXTENT_WGS84_CORRECTED = (-180.0, -85.0511, 180.0, 85.0511)
 SQL_BOX_REGEX = re.compile("BOX\((.*) (.*),(.*) (.*)\)")
 
+EDGE_POINTS = 9  # Points along each edge of an extent, corners included, projected to find its bounds
+
 
 def extract_significant_digits(number):
     is_negative = number < 0
@@ -68,6 +72,94 @@ def union_extent(extents):
     return extent
 
 
+@lru_cache(maxsize=64)
+def get_transformer(source_srs, target_srs):
+    """ :return: a transformer between two projections, created only once for each pair since creation is costly """
+
+    from_epsg = source_srs.strip().upper().startswith("EPSG:")
+
+    try:
+        source_proj = Proj(init=source_srs) if from_epsg else Proj(str(source_srs))
+        target_proj = (
+            Proj(init=target_srs) if ":" in target_srs else Proj(str(target_srs))
+        )
+    except CRSError:
+        raise BadSpatialReference(f"Invalid SRS value: {source_srs}")
+
+    return Transformer.from_proj(source_proj, target_proj)
+
+
+def project_extents(extents, target_srs="EPSG:3857"):
+    """
+    Projects extents as project_to_web_mercator or project_to_geographic would one by one, but densifies the edges
+    of all extents sharing a projection and transforms them together.
+    Geographic latitudes must first be bounded to the following or calculations will fail!
+        -85.0511 <= y <= 85.0511
+    :param target_srs: either "EPSG:3857" or "EPSG:4326"
+    :return: a new extent for each extent, in the same order, with the outer bounds of its projected coordinates
+    """
+
+    if target_srs == "EPSG:3857":
+        is_target = SpatialReference.is_web_mercator
+    elif target_srs == "EPSG:4326":
+        is_target = SpatialReference.is_geographic
+    else:
+        raise ValueError(f"Invalid target projection: {target_srs}")
+
+    projected = [None] * len(extents)
+    indexes_by_srs = {}
+
+    for idx, extent in enumerate(extents):
+        if is_target(extent.spatial_reference):
+            projected[idx] = extent.clone()
+            continue
+
+        if not extent.spatial_reference.is_valid_proj4_projection():
+            raise ValueError(
+                "Spatial reference is not valid for proj4, must use a different service to project"
+            )
+
+        extent._correct_for_projection()
+        indexes_by_srs.setdefault(extent.spatial_reference.srs, []).append(idx)
+
+    num_points = EDGE_POINTS * EDGE_POINTS
+
+    for source_srs, indexes in indexes_by_srs.items():
+        x_values, y_values = array("d"), array("d")
+        for idx in indexes:
+            extents[idx]._densify(x_values, y_values)
+
+        # TODO: check for bidirectional consistency, as is done in ncserve BoundingBox.project() method
+        transformer = get_transformer(source_srs, target_srs)
+        x_values, y_values = transformer.transform(x_values, y_values)
+
+        for pos, idx in enumerate(indexes):
+            start, end = pos * num_points, (pos + 1) * num_points
+            x_points, y_points = x_values[start:end], y_values[start:end]
+
+            projected_values = (
+                min(x_points),
+                min(y_points),
+                max(x_points),
+                max(y_points),
+            )
+            if any(not is_number(coord) for coord in projected_values):
+                raise ValueError(
+                    f'Invalid projection coordinates for "{source_srs}": {projected_values}'
+                )
+
+            new_extent = extents[idx].clone()
+            new_extent.xmin, new_extent.ymin, new_extent.xmax, new_extent.ymax = (
+                projected_values
+            )
+            new_extent.spatial_reference.wkid = int(target_srs.split(":")[1])
+            new_extent.spatial_reference.srs = target_srs
+
+            projected[idx] = new_extent
+
+    return projected
+
+
 class Extent(object):
     """ Provides easy handling of extent through various functions below, and abstract out ESRI / WMS differences """
 
@@ -296,48 +388,11 @@ class Extent(object):
 
     def project_to_web_mercator(self):
         """ Project self to Web Mercator (only some ESRI extents are valid here) """
-
-        new_extent = self.clone()
-        if self.spatial_reference.is_web_mercator():
-            return new_extent
-
-        if not self.spatial_reference.is_valid_proj4_projection():
-            raise ValueError(
-                "Spatial reference is not valid for proj4, must use a different service to project"
-            )
-
-        (
-            new_extent.xmin,
-            new_extent.ymin,
-            new_extent.xmax,
-            new_extent.ymax,
-        ) = self._get_projected_extent("EPSG:3857")
-        new_extent.spatial_reference.wkid = 3857
-        new_extent.spatial_reference.srs = "EPSG:3857"
-
-        return new_extent
+        return project_extents([self], "EPSG:3857")[0]
 
     def project_to_geographic(self):
         """ Project self to geographic (only some ESRI extents are valid here) """
-
-        new_extent = self.clone()
-        if self.spatial_reference.is_geographic():
-            return new_extent
-
-        if not self.spatial_reference.is_valid_proj4_projection():
-            raise ValueError(
-                "Spatial reference is not valid for proj4, must use a different service to project"
-            )
-
-        (
-            new_extent.xmin,
-            new_extent.ymin,
-            new_extent.xmax,
-            new_extent.ymax,
-        ) = self._get_projected_extent("EPSG:4326")
-        new_extent.spatial_reference.wkid = 4326
-        new_extent.spatial_reference.srs = "EPSG:4326"
-        return new_extent
+        return project_extents([self], "EPSG:4326")[0]
 
     def _correct_for_projection(self):
 
@@ -354,50 +409,18 @@ class Extent(object):
             if self.ymax >= 90:
                 self.ymax = 85.0511
 
-    def _get_projected_extent(self, target_srs):
-        """
-        Densifies the edges with edge_points points between corners, and projects all of them.
-        Geographic latitudes must first be bounded to the following or calculations will fail!
-            -85.0511 <= y <= 85.0511
-        :return: the outer bounds of the projected coordinates.
-        """
-
-        self._correct_for_projection()
-
-        source_srs = self.spatial_reference.srs
-        from_epsg = source_srs.strip().upper().startswith("EPSG:")
-
-        try:
-            source_proj = Proj(init=source_srs) if from_epsg else Proj(str(source_srs))
-            target_proj = (
-                Proj(init=target_srs) if ":" in target_srs else Proj(str(target_srs))
-            )
-        except CRSError:
-            raise BadSpatialReference(f"Invalid SRS value: {source_srs}")
-
-        edge_points = 9
+    def _densify(self, x_values, y_values):
+        """ Appends the coordinates of EDGE_POINTS points along each edge, and as many across the extent """
 
-        samples = list(range(0, edge_points))
+        samples = list(range(0, EDGE_POINTS))
         x_diff, y_diff = self.get_dimensions()
-        xstep = x_diff / (edge_points - 1)
-        ystep = y_diff / (edge_points - 1)
-        x_values, y_values = [], []
+        xstep = x_diff / (EDGE_POINTS - 1)
+        ystep = y_diff / (EDGE_POINTS - 1)
 
         for i, j in product(samples, samples):
             x_values.append(self.xmin + xstep * i)
             y_values.append(self.ymin + ystep * j)
 
-        # TODO: check for bidirectional consistency, as is done in ncserve BoundingBox.project() method
-        x_values, y_values = transform(source_proj, target_proj, x_values, y_values)
-
-        projected_values = min(x_values), min(y_values), max(x_values), max(y_values)
-        if any(not is_number(coord) for coord in projected_values):
-            raise ValueError(
-                f'Invalid projection coordinates for "{source_srs}": {projected_values}'
-            )
-
-        return projected_values
-
     def get_scale_string(self, image_width):
         """
         This is modified to use the extent's southern latitude to mimic how ArcGIS displays the front end scale.
@@ -0,0 +1,192 @@
+""" Hedged requests, which send a duplicate of an idempotent request that is slower than most to the same host """
+import threading
+import time
+
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextvars import copy_context
+
+from .retries import get_host
+
+
+DEFAULT_PERCENTILE = 95  # Requests slower than this percentile of recent latencies are hedged
+DEFAULT_MAX_EXTRA_RATIO = 0.05  # Duplicates sent, as a ratio of all requests to a host
+DEFAULT_MIN_SAMPLES = 20  # Latencies recorded for a host before any request to it is hedged
+DEFAULT_WINDOW = 200  # Recent latencies kept per host
+DEFAULT_MAX_WORKERS = 32  # Attempts in flight at once, across all hosts
+
+
+class HedgingPolicy(object):
+    """
+    Tracks recent latencies per host, and sends a duplicate of any hedged request that takes longer than
+    a percentile of them: whichever response arrives first is used, and the other is discarded.
+    Duplicates are capped at max_extra_ratio of all hedged requests to each host, so the extra load stays bounded.
+    Attempts are sent from one executor of max_workers threads: requests sent while all are busy are not hedged.
+    """
+
+    def __init__(
+        self,
+        percentile=DEFAULT_PERCENTILE,
+        max_extra_ratio=DEFAULT_MAX_EXTRA_RATIO,
+        min_samples=DEFAULT_MIN_SAMPLES,
+        min_delay=0.01,
+        window=DEFAULT_WINDOW,
+        max_workers=DEFAULT_MAX_WORKERS,
+    ):
+        self.percentile = percentile
+        self.max_extra_ratio = max_extra_ratio
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.window = window
+        self.max_workers = max_workers
+
+        self._lock = threading.Lock()
+        self._hosts = {}
+
+        self._executor = None
+        self._workers = threading.BoundedSemaphore(max_workers)
+
+    def _get_host_stats(self, url):
+        """ Must be called holding the lock """
+
+        host = get_host(url)
+        stats = self._hosts.get(host)
+
+        if stats is None:
+            stats = self._hosts[host] = {
+                "latencies": deque(maxlen=self.window),
+                "requests": 0,
+                "hedged": 0,
+            }
+        return stats
+
+    def get_delay(self, url):
+        """ :return: seconds after which a request to the URL is hedged, or None until enough are recorded """
+
+        with self._lock:
+            return self._get_delay(self._hosts.get(get_host(url)))
+
+    def _get_delay(self, stats):
+        """ Must be called holding the lock """
+
+        latencies = sorted(stats["latencies"]) if stats else None
+
+        if not latencies or len(latencies) < self.min_samples:
+            return None
+
+        index = min(len(latencies) - 1, int(len(latencies) * self.percentile / 100))
+        return max(latencies[index], self.min_delay)
+
+    def record(self, url, latency):
+        with self._lock:
+            self._get_host_stats(url)["latencies"].append(latency)
+
+    def allow_hedge(self, url, acquire_slot=None):
+        """
+        :param acquire_slot: returns True if a duplicate may be sent now without exceeding concurrency limits
+        :return: True, counting the duplicate, if one more would keep within the cap for the host
+        """
+
+        with self._lock:
+            stats = self._get_host_stats(url)
+
+            if stats["hedged"] + 1 > stats["requests"] * self.max_extra_ratio:
+                return False
+            elif acquire_slot is not None and not acquire_slot():
+                return False
+
+            stats["hedged"] += 1
+            return True
+
+    def get_stats(self):
+        """ :return: requests, duplicates sent and the current hedging delay by host """
+
+        with self._lock:
+            return {
+                host: {
+                    "requests": stats["requests"],
+                    "hedged": stats["hedged"],
+                    "delay": self._get_delay(stats),
+                }
+                for host, stats in self._hosts.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._hosts.clear()
+
+    def send(self, url, send_request, acquire_slot=None, release_slot=None):
+        """
+        Sends a request, and a duplicate of it if it is slow to complete.
+        :param send_request: sends the request and returns its response, or raises a requests exception
+        :param acquire_slot: takes a slot for the duplicate without waiting, as in allow_hedge
+        :param release_slot: frees the slot taken for an attempt that is cancelled before it is sent
+        :return: the first response received, or if both failed the error raised by the first to be sent
+        The other attempt is cancelled, or its response closed once received, to release its connection.
+        """
+
+        with self._lock:
+            self._get_host_stats(url)["requests"] += 1
+
+        delay = self.get_delay(url)
+        if delay is None or not self._workers.acquire(blocking=False):
+            return self._send_timed(url, send_request)
+
+        first = self._submit(url, send_request, release_slot)
+        done, _ = wait([first], timeout=delay)
+
+        if done or not self._workers.acquire(blocking=False):
+            return first.result()
+        elif not self.allow_hedge(url, acquire_slot):
+            self._workers.release()
+            return first.result()
+
+        second = self._submit(url, send_request, release_slot)
+        pending = {first, second}
+
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                if future.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                        other.add_done_callback(_close_response)
+                    return future.result()
+
+        return first.result()  # Both failed
+
+    def _submit(self, url, send_request, release_slot=None):
+        """ Sends the request from the shared executor, in a worker already acquired, with the caller's context """
+
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    self.max_workers, thread_name_prefix="hedging"
+                )
+
+        future = self._executor.submit(
+            copy_context().run, self._send_timed, url, send_request
+        )
+        future.add_done_callback(lambda f: self._release(f, release_slot))
+        return future
+
+    def _release(self, future, release_slot=None):
+        self._workers.release()
+
+        if future.cancelled() and release_slot is not None:
+            release_slot()
+
+    def _send_timed(self, url, send_request):
+        started = time.monotonic()
+        response = send_request()
+
+        self.record(url, time.monotonic() - started)
+        return response
+
+
+def _close_response(future):
+    """ Releases the connection held by a discarded response """
+
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
@@ -1,11 +1,13 @@
 """ General image utilities """
 import io
-import requests
 
-from base64 import b64decode, b64encode
+from base64 import b64decode
+from binascii import b2a_base64
 from pathlib import Path
 
-from PIL import Image
+from PIL import Image, ImageChops, features
+
+from .sessions import get_session
 
 
 IMG_BASE64_PREFIX = b"data:image/png;base64,"
@@ -25,9 +27,115 @@ IMG_FORMATS_BY_EXT = {
     ".pnm": "PPM",
     ".png": "PNG",
     ".apng": "PNG",
+    ".webp": "WEBP",
     "": "PNG",
 }
 IMG_SUPPORTED_FORMATS = set(IMG_FORMATS_BY_EXT.values())
+# Formats PIL saves by seeking back, which cannot be base64 encoded as they are written
+IMG_SEEKING_FORMATS = {"TIFF"}
+
+# Encoding options by profile: PNG zlib level and optimization, whether to store images with 256 colors or fewer
+# in a palette, lossy quality, and the lossy format chosen by encode_image for images without transparency
+ENCODING_PROFILES = {
+    "fast": {
+        "compress_level": 1,
+        "optimize": False,
+        "palette": False,
+        "quality": 75,
+        "lossy_format": None,
+    },
+    "balanced": {
+        "compress_level": 6,
+        "optimize": False,
+        "palette": True,
+        "quality": 85,
+        "lossy_format": None,
+    },
+    "small": {
+        "compress_level": 9,
+        "optimize": True,
+        "palette": True,
+        "quality": 75,
+        "lossy_format": "WEBP",
+    },
+}
+
+# Modes without an alpha band, in which only a "transparency" entry in image info makes pixels transparent
+OPAQUE_IMAGE_MODES = {"1", "CMYK", "F", "I", "L", "P", "RGB", "YCbCr"}
+
+
+class Base64Writer(io.RawIOBase):
+    """
+    A binary stream that base64 encodes whatever is written to it into the output, which may be binary or text.
+    Bytes left over from each write, short of a full 3 byte group, are held until the next write or close.
+    """
+
+    def __init__(self, output, prefix=b""):
+        super(Base64Writer, self).__init__()
+
+        self.output = output
+        self._is_text = isinstance(output, io.TextIOBase)
+        self._remainder = b""
+
+        if prefix:
+            self._write_encoded(prefix)
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = memoryview(data).cast("B")
+        size = len(data)
+        start = 0
+
+        if self._remainder:
+            start = min(3 - len(self._remainder), size)
+            self._remainder += data[:start].tobytes()
+            if len(self._remainder) < 3:
+                return size
+
+            self._write_encoded(b2a_base64(self._remainder, newline=False))
+
+        end = start + (size - start) // 3 * 3
+        if end > start:
+            self._write_encoded(b2a_base64(data[start:end], newline=False))
+
+        self._remainder = data[end:].tobytes()
+        return size
+
+    def close(self):
+        """ Encodes any remaining bytes, with padding, but leaves the output open """
+
+        if not self.closed and self._remainder:
+            self._write_encoded(b2a_base64(self._remainder, newline=False))
+            self._remainder = b""
+
+        super(Base64Writer, self).close()
+
+    def _write_encoded(self, encoded):
+        self.output.write(encoded.decode("ascii") if self._is_text else encoded)
+
+
+class RawImage(object):
+    """ Encoded image content and its content type, as returned by a service or encoded from a rendered image """
+
+    def __init__(self, content, content_type):
+        self.content = content
+        self.content_type = content_type
+
+    def __repr__(self):
+        return f"RawImage({self.content_type}, {len(self.content)} bytes)"
+
+    @classmethod
+    def from_image(cls, image, image_format="PNG", profile="fast"):
+        """
+        :param profile: one of ENCODING_PROFILES, "fast" by default since the image is usually served right away
+        :return: the image encoded in the format given, for when pixels could not be passed through
+        """
+        return encode_image(image, profile, image_format)
+
+    def to_image(self):
+        return Image.open(io.BytesIO(self.content))
 
 
 def base64_to_image(base64_string):
@@ -35,46 +143,116 @@ def base64_to_image(base64_string):
     return Image.open(io.BytesIO(b64decode(base64_string)))
 
 
-def image_to_base64(image, image_format=None, quality=75, optimize=False):
+def image_to_base64(image, image_format=None, quality=75, optimize=False, profile=None):
     """ Converts a PIL image into base64 string with PIL params by default """
-    return b64encode(image_to_bytes(image, image_format, quality, optimize))
 
+    output = io.BytesIO()
+    write_image_base64(image, output, image_format, quality, optimize, profile)
+    return output.getvalue()
 
-def image_to_bytes(image, image_format=None, quality=100, optimize=True):
-    """ Converts a PIL image into raw bytes overriding PIL params by default """
 
-    if not image:
-        raise ValueError("Image is required")
+def image_to_bytes(image, image_format=None, quality=100, optimize=True, profile=None):
+    """
+    Converts a PIL image into raw bytes overriding PIL params by default
+    :param profile: one of ENCODING_PROFILES ("fast", "balanced" or "small"), overriding quality and optimize
+    """
 
-    image_ext = Path(getattr(image, "filename", "")).suffix
-    if not image_format:
-        image_format = IMG_FORMATS_BY_EXT[image_ext.lower()]
+    output = io.BytesIO()
+    write_image(image, output, image_format, quality, optimize, profile)
+    return output.getvalue()
 
-    image_format = image_format.upper()
-    if image_format not in IMG_SUPPORTED_FORMATS:
-        raise ValueError(f"Unsupported image format: {image_format}")
+
+def write_image(
+    image, output, image_format=None, quality=100, optimize=True, profile=None
+):
+    """ Saves a PIL image to a binary file-like output, with the same params as image_to_bytes """
+
+    image_format = get_image_format(image, image_format)
 
     if image_format == "JPEG":
         image = image.convert("RGB")
 
     image_kwargs = {}
+
+    if profile is not None:
+        options = get_encoding_profile(profile)
+        quality = options["quality"]
+        optimize = options["optimize"]
+
+        if image_format == "PNG":
+            image_kwargs["compress_level"] = options["compress_level"]
+            if options["palette"]:
+                image = reduce_to_palette(image)
+
     if quality is not None:
         image_kwargs["quality"] = quality
     if optimize is not None:
         image_kwargs["optimize"] = optimize
 
-    output = io.BytesIO()
     image.save(output, format=image_format, **image_kwargs)
-    return output.getvalue()
+    return output
+
+
+def get_image_format(image, image_format=None):
+    """ :return: the upper case image format given, or else the one for the extension of the image file name """
+
+    if not image:
+        raise ValueError("Image is required")
+
+    image_ext = Path(getattr(image, "filename", "")).suffix
+    if not image_format:
+        image_format = IMG_FORMATS_BY_EXT[image_ext.lower()]
+
+    image_format = image_format.upper()
+    if image_format not in IMG_SUPPORTED_FORMATS:
+        raise ValueError(f"Unsupported image format: {image_format}")
 
+    return image_format
+
+
+def write_image_base64(
+    image,
+    output,
+    image_format=None,
+    quality=75,
+    optimize=False,
+    profile=None,
+    prefix=False,
+):
+    """
+    Writes a PIL image as base64 to a binary or text file-like output, encoding it as it is saved,
+    so that neither the image bytes nor their encoding are held in memory in full (unless saved by seeking, as TIFF is)
+    :param prefix: if True, the base64 is written as a PNG data URL
+    """
+
+    image_format = get_image_format(image, image_format)
+
+    with Base64Writer(output, IMG_BASE64_PREFIX if prefix else b"") as writer:
+        if image_format not in IMG_SEEKING_FORMATS:
+            write_image(image, writer, image_format, quality, optimize, profile)
+        else:
+            buffer = io.BytesIO()
+            write_image(image, buffer, image_format, quality, optimize, profile)
+            with buffer.getbuffer() as image_buffer:
+                writer.write(image_buffer)
+
+    return output
 
-def image_to_string(image, image_format=None, quality=None, optimize=None, prefix=True):
+
+def image_to_string(
+    image, image_format=None, quality=None, optimize=None, prefix=True, profile=None
+):
     """ Converts a PIL image, or a base64 string or bytes into a base64 image string """
 
     if not image:
         return None
     elif isinstance(image, Image.Image):
-        image_str = image_to_base64(image, image_format, quality, optimize)
+        output = io.BytesIO()
+        write_image_base64(
+            image, output, image_format, quality, optimize, profile, prefix
+        )
+        with output.getbuffer() as image_buffer:
+            return str(image_buffer, "ascii")
     elif isinstance(image, str):
         image_str = image.encode("ascii")
     elif isinstance(image, bytes):
@@ -83,7 +261,7 @@ def image_to_string(image, image_format=None, quality=None, optimize=None, prefi
         raise ValueError("Image must be a PIL image, image string, or image bytes")
 
     if image_str.startswith(b"http"):
-        response = requests.get(image)
+        response = get_session().get(image)
         status_code = response.status_code
 
         if status_code != 200:
@@ -92,7 +270,9 @@ def image_to_string(image, image_format=None, quality=None, optimize=None, prefi
             )
         else:
             image = Image.open(io.BytesIO(response.content))
-            return image_to_string(image, image_format, quality, optimize, prefix)
+            return image_to_string(
+                image, image_format, quality, optimize, prefix, profile
+            )
 
     if not prefix and image_str.startswith(IMG_BASE64_PREFIX):
         image_str = image_str[len(IMG_BASE64_PREFIX) :]
@@ -102,21 +282,131 @@ def image_to_string(image, image_format=None, quality=None, optimize=None, prefi
     return image_str.decode("ascii")
 
 
-def count_colors(image):
-    """ :return: count of an image's colors, if possible """
+def encode_image(image, profile="balanced", image_format=None):
+    """
+    Encodes the image with the options of the profile, unless an image format is given, as a PNG, or in the lossy format
+    of the profile if the image is fully opaque and has more colors than a palette holds.
+    :return: a RawImage with the encoded bytes and their content type
+    """
+
+    if not image:
+        raise ValueError("Image is required")
+
+    if image_format is None:
+        lossy_format = get_encoding_profile(profile)["lossy_format"]
+        if lossy_format == "WEBP" and not features.check("webp"):
+            lossy_format = "JPEG"
+
+        if (
+            lossy_format
+            and image.mode in ("RGB", "RGBA")
+            and is_opaque(image)
+            and image.getcolors(256) is None
+        ):
+            image_format = lossy_format
+        else:
+            image_format = "PNG"
+
+    image_format = image_format.upper()
+    content = image_to_bytes(image, image_format, profile=profile)
+
+    return RawImage(content, f"image/{image_format.lower()}")
+
+
+def get_encoding_profile(profile):
+    try:
+        return ENCODING_PROFILES[profile]
+    except KeyError:
+        profiles = ", ".join(ENCODING_PROFILES)
+        raise ValueError(f"Unsupported encoding profile {profile}: expected {profiles}")
+
+
+def is_opaque(image):
+    """ :return: True if no pixel of the image is even partly transparent """
+
+    if image.mode in OPAQUE_IMAGE_MODES and "transparency" not in image.info:
+        return True
+    elif image.mode != "RGBA":
+        image = image.convert("RGBA")
+
+    return image.getchannel("A").getextrema()[0] == 255
+
+
+def reduce_to_palette(image):
+    """ :return: the image in "P" mode if it has 256 colors or fewer, which convert without loss, or else the image """
+
+    if image.mode not in ("RGB", "RGBA") or image.getcolors(256) is None:
+        return image
+
+    method = (
+        Image.Quantize.FASTOCTREE if image.mode == "RGBA" else Image.Quantize.MEDIANCUT
+    )
+    palette_image = image.quantize(256, method=method, dither=Image.Dither.NONE)
+
+    difference = ImageChops.difference(palette_image.convert(image.mode), image)
+    if any(high for low, high in difference.getextrema()):
+        return image
+
+    return palette_image
+
+
+def count_colors(image, max_colors=None):
+    """
+    :param max_colors: if provided, counting stops once there are more colors than this, and max_colors + 1 is returned
+    :return: count of an image's distinct colors, if possible
+    """
 
     try:
-        if not image.palette:
-            return len(image.getcolors())
+        if image.mode in ("1", "L", "P"):
+            # Count colors used from the histogram, rather than each pixel
+            used = [idx for idx, count in enumerate(image.histogram()) if count]
+            if image.mode == "P":
+                used = _get_palette_colors(image, used)
+            color_count = len(used)
+        elif max_colors is not None:
+            colors = image.getcolors(max_colors)
+            color_count = max_colors + 1 if colors is None else len(colors)
         else:
-            # Assume RGB, and 4 chars per color, plus 1 (based on testing)
-            return (len(image.palette.palette) / 12) + 1
+            # Memory for counting grows with the limit, so raise it only as far as needed
+            limit = 256
+            pixels = image.width * image.height
+            colors = image.getcolors(limit)
+            while colors is None and limit < pixels:
+                limit = min(limit * 16, pixels)
+                colors = image.getcolors(limit)
+            color_count = len(colors)
+
+        return color_count if max_colors is None else min(color_count, max_colors + 1)
+
     except Exception:
         return 0  # Could not obtain colors in normal way
 
 
+def _get_palette_colors(image, indices):
+    """ :return: the distinct palette colors at the indices, with alpha from palette transparency """
+
+    palette_mode = image.palette.mode if image.palette else "RGB"
+    palette = image.getpalette(palette_mode) or []
+    channels = len(palette_mode)
+
+    transparency = image.info.get("transparency")
+    if isinstance(transparency, int):
+        transparency = bytes(255 if i != transparency else 0 for i in range(256))
+
+    colors = set()
+    for idx in indices:
+        color = tuple(palette[idx * channels : (idx + 1) * channels])
+        alpha = transparency[idx] if transparency and idx < len(transparency) else 255
+        colors.add(color + (alpha,))
+
+    return colors
+
+
 def overlay_images(images, background_color=(255, 255, 255, 255)):
-    """ Merges images into a single image, ordered from bottom to top. Images must be same dimensions """
+    """
+    Merges images into a single image, ordered from bottom to top. Images must be same dimensions.
+    Fully transparent images are skipped, and nothing below the topmost fully opaque image is composited.
+    """
 
     if not images:
         raise ValueError("Images are required")
@@ -124,34 +414,118 @@ def overlay_images(images, background_color=(255, 255, 255, 255)):
         raise ValueError("More than one image is required to overlay images")
 
     size = images[0].size
-    image = Image.new("RGBA", size, background_color)
 
-    for next_image in images:
-        if next_image.mode != "RGBA":
-            next_image = next_image.convert("RGBA")
+    # Collect visible layers from the top down, stopping at the first that hides all below it
+
+    layers = []
+    base_image = None
+
+    for next_image in reversed(images):
+        if next_image.size != size:
+            raise ValueError("Images must be the same dimensions to overlay them")
 
+        if (
+            next_image.mode in OPAQUE_IMAGE_MODES
+            and "transparency" not in next_image.info
+        ):
+            min_alpha, max_alpha = 255, 255
+        else:
+            if next_image.mode != "RGBA":
+                next_image = next_image.convert("RGBA")
+            min_alpha, max_alpha = next_image.getchannel("A").getextrema()
+
+        if max_alpha == 0:
+            continue
+        elif min_alpha == 255:
+            base_image = next_image
+            break
+
+        layers.append(next_image)
+
+    if base_image is None:
+        image = Image.new("RGBA", size, background_color)
+    elif base_image.mode != "RGBA":
+        image = base_image.convert("RGBA")
+    else:
+        image = base_image.copy()
+
+    for next_image in reversed(layers):
         # Use composite, not paste, to keep alpha of images
         image = Image.alpha_composite(image, next_image)
 
     return image
 
 
-def make_color_transparent(image, replace_color, with_color=None):
-    """ Image must already be RGBA mode, color is an RGBA tuple """
+def make_color_transparent(
+    image, replace_color, with_color=None, keep_palette=False, inplace=False
+):
+    """
+    Replaces an RGBA color with another, or with transparent white by default, converting the image to RGBA mode
+    :param keep_palette: if True, "P" mode images have matching palette colors replaced instead of converting to RGBA
+    :param inplace: if True, RGBA images passed in are modified and returned, as they were before copies were made
+    :return: the image with the color replaced: a new image, unless modified in place
+    """
 
     if not image:
         raise ValueError("Image is required")
+    elif keep_palette and image.mode == "P":
+        return _make_palette_color_transparent(image, replace_color, with_color)
     elif image.mode != "RGBA":
         image = image.convert("RGBA")
+    elif not inplace:
+        image = image.copy()
+
+    if with_color is None:
+        with_color = (255, 255, 255, 0)
+
+    replace_color = tuple(replace_color)
+    if len(replace_color) != len(image.getbands()):
+        return image  # No pixel can match
+
+    # Mask pixels where every band matches, then fill them in the new image with the new color
+
+    mask = None
+    for band, value in zip(image.split(), replace_color):
+        band_mask = band.point([255 if v == value else 0 for v in range(256)], "1")
+        mask = band_mask if mask is None else ImageChops.logical_and(mask, band_mask)
+
+    if mask.getbbox():
+        image.paste(tuple(with_color), None, mask)
+
+    return image
+
+
+def _make_palette_color_transparent(image, replace_color, with_color=None):
+    """ :return: a copy of the image with palette entries matching the RGBA color replaced, storing alpha as PNG does """
 
     if with_color is None:
         with_color = (255, 255, 255, 0)
 
-    pixdata = image.load()
-    for y in range(image.size[1]):
-        for x in range(image.size[0]):
-            if pixdata[x, y] == replace_color:
-                pixdata[x, y] = with_color
+    palette = image.getpalette() or []
+    alphas = [255] * (len(palette) // 3)
+
+    transparency = image.info.get("transparency")
+    if isinstance(transparency, int) and transparency < len(alphas):
+        alphas[transparency] = 0
+    elif isinstance(transparency, bytes):
+        alphas[: len(transparency)] = transparency[: len(alphas)]
+
+    replace_color = tuple(replace_color)
+    matches = [
+        idx
+        for idx, alpha in enumerate(alphas)
+        if tuple(palette[idx * 3 : idx * 3 + 3]) + (alpha,) == replace_color
+    ]
+    image = image.copy()
+    if not matches:
+        return image
+
+    for idx in matches:
+        palette[idx * 3 : idx * 3 + 3] = with_color[:3]
+        alphas[idx] = with_color[3] if len(with_color) > 3 else 255
+
+    image.putpalette(palette)
+    image.info["transparency"] = bytes(alphas)
 
     return image
 
@@ -0,0 +1,165 @@
+""" Legend sprite atlases: distinct legend swatches packed into one image, with the position of each by key """
+import binascii
+import hashlib
+import io
+
+from base64 import b64decode
+
+from PIL import Image
+
+from .images import RawImage, encode_image, image_to_string
+
+
+DEFAULT_ATLAS_WIDTH = 1024  # Most pixels across, unless a single swatch is wider
+DEFAULT_PADDING = 1  # Transparent pixels between swatches, so they do not bleed into each other when scaled
+
+
+class LegendAtlas(object):
+    """ A sprite image of distinct legend swatches, and the box of the swatch for each legend key """
+
+    def __init__(self, image, index, swatch_count):
+        self.image = image
+        self.index = index
+        self.swatch_count = swatch_count
+
+    def __repr__(self):
+        width, height = self.image.size
+        return f"LegendAtlas({len(self.index)} keys, {self.swatch_count} swatches, {width}x{height})"
+
+    def get_box(self, key):
+        """ :return: the (left, upper, right, lower) box of the swatch for the key within the atlas image """
+
+        position = self.index[key]
+        x, y = position["x"], position["y"]
+        return x, y, x + position["width"], y + position["height"]
+
+    def get_swatch(self, key):
+        return self.image.crop(self.get_box(key))
+
+    def encode(self, profile="balanced"):
+        """ :return: a RawImage of the atlas encoded as a PNG """
+        return encode_image(self.image, profile, image_format="PNG")
+
+    def as_dict(self, profile="balanced"):
+        """ :return: the atlas image as a PNG data URL, and the position of each key's swatch, serializable as JSON """
+
+        return {
+            "image": image_to_string(self.image, "PNG", profile=profile),
+            "width": self.image.width,
+            "height": self.image.height,
+            "index": {
+                format_key(key): dict(position) for key, position in self.index.items()
+            },
+        }
+
+
+def build_legend_atlas(
+    legend_images, max_width=DEFAULT_ATLAS_WIDTH, padding=DEFAULT_PADDING
+):
+    """
+    Decodes each distinct legend image once, skips swatches with the same pixels as another,
+    and packs the rest in rows from tallest to shortest.
+    :param legend_images:
+        (key, image) pairs, or a dict of images by key, where each image is a PIL image, a RawImage, encoded bytes,
+        or base64 bytes or string (with or without a data URL prefix). Keys without an image are skipped.
+    :return: a LegendAtlas with an index of each key's swatch position
+    """
+
+    if isinstance(legend_images, dict):
+        legend_images = legend_images.items()
+
+    decoded = {}  # Images by hash of their encoded content, so each is decoded once
+    swatches = {}  # Images by hash of their pixels
+    swatch_keys = {}  # Keys by hash of their swatch's pixels
+
+    for key, legend_image in legend_images:
+        if not legend_image:
+            continue
+
+        if isinstance(legend_image, Image.Image):
+            image = _to_rgba(legend_image)
+        else:
+            content = _to_bytes(legend_image)
+            content_hash = hashlib.sha1(content).digest()
+
+            image = decoded.get(content_hash)
+            if image is None:
+                image = _to_rgba(Image.open(io.BytesIO(content)))
+                decoded[content_hash] = image
+
+        pixel_hash = hashlib.sha1(image.tobytes()).digest() + repr(image.size).encode()
+        swatches.setdefault(pixel_hash, image)
+        swatch_keys.setdefault(pixel_hash, []).append(key)
+
+    boxes = _pack_swatches(
+        {pixel_hash: image.size for pixel_hash, image in swatches.items()},
+        max_width,
+        padding,
+    )
+
+    width = max((box[2] for box in boxes.values()), default=0)
+    height = max((box[3] for box in boxes.values()), default=0)
+    atlas_image = Image.new("RGBA", (max(width, 1), max(height, 1)), (0, 0, 0, 0))
+
+    index = {}
+    for pixel_hash, box in boxes.items():
+        atlas_image.paste(swatches[pixel_hash], box[:2])
+
+        position = {
+            "x": box[0],
+            "y": box[1],
+            "width": box[2] - box[0],
+            "height": box[3] - box[1],
+        }
+        for key in swatch_keys[pixel_hash]:
+            index[key] = position
+
+    return LegendAtlas(atlas_image, index, len(swatches))
+
+
+def _pack_swatches(sizes, max_width, padding):
+    """ :return: a box for each size by key, packed in rows (shelves) of swatches sorted by height """
+
+    boxes = {}
+    x = y = row_height = 0
+
+    for key, (width, height) in sorted(
+        sizes.items(), key=lambda item: (-item[1][1], -item[1][0])
+    ):
+        if x and x + width > max_width:
+            x = 0
+            y += row_height + padding
+            row_height = 0
+
+        boxes[key] = (x, y, x + width, y + height)
+
+        x += width + padding
+        row_height = max(row_height, height)
+
+    return boxes
+
+
+def format_key(key):
+    """ :return: the key as a string, with the parts of tuple keys separated by slashes """
+    return "/".join(str(k) for k in key) if isinstance(key, tuple) else str(key)
+
+
+def _to_bytes(legend_image):
+    """ :return: encoded image content, decoded from base64 unless already binary """
+
+    if isinstance(legend_image, RawImage):
+        return legend_image.content
+    elif isinstance(legend_image, str):
+        legend_image = legend_image.encode("ascii")
+
+    if legend_image.startswith(b"data:"):
+        return b64decode(legend_image.split(b",", 1)[-1])
+
+    try:
+        return b64decode(legend_image, validate=True)
+    except binascii.Error:
+        return legend_image  # Binary image content is never valid base64
+
+
+def _to_rgba(image):
+    return image if image.mode == "RGBA" else image.convert("RGBA")
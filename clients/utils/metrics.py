@@ -0,0 +1,512 @@
+""" Events describing every request and operation performed by clients, for listeners that collect metrics """
+import logging
+import re
+import threading
+import time
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from urllib.parse import urlsplit
+
+from .profiling import collect_timings
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, float("inf"))
+
+# Path segments that identify an instance rather than an endpoint: numeric ids and tile coordinates
+URL_TEMPLATE_PARAM = re.compile(r"^-?\d+$")
+
+_current_span = ContextVar("current_span", default=None)
+
+
+def get_url_template(url):
+    """ :return: the URL without its query, and numeric path segments replaced so URLs group by endpoint """
+
+    parts = urlsplit(url or "")
+    path = "/".join(
+        "{id}" if URL_TEMPLATE_PARAM.match(segment) else segment
+        for segment in parts.path.split("/")
+    )
+    return f"{parts.scheme}://{parts.netloc}{path}" if parts.netloc else path
+
+
+def get_response_size(response):
+    """ :return: the number of bytes in a response body, if already read or reported by the service """
+
+    content = getattr(response, "_content", None)
+    if isinstance(content, bytes):
+        return len(content)
+
+    try:
+        return int(response.headers["Content-Length"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class RequestEvent(object):
+    """
+    A request made by a client to a map service, including any retries, reported to listeners once complete.
+    Requests answered from the negative cache are reported with cache set to "hit", and the cached error.
+    Legend graphics answered from the legend cache are reported with cache set to "hit", and no status code.
+    """
+
+    def __init__(self, service_type, endpoint, url, method="GET", cache=None):
+        self.service_type = service_type
+        self.endpoint = endpoint
+        self.url = url
+        self.url_template = get_url_template(url)
+        self.method = method
+        self.cache = cache
+
+        self.status_code = None
+        self.bytes = None
+        self.retries = 0
+        self.latency = None
+        self.error = None
+
+        span = _current_span.get()
+        self.operation = span.operation if span else None
+
+        self._started = time.monotonic()
+
+    def __repr__(self):
+        return f"RequestEvent({self.method} {self.url_template}, status={self.status})"
+
+    @property
+    def status(self):
+        """ :return: the status code, or the name of the error raised without one, or "cached" """
+
+        if self.status_code is not None:
+            return str(self.status_code)
+        elif self.error is not None:
+            return self.error
+        return "cached" if self.cache == "hit" else "unknown"
+
+    def finish(self, response=None, error=None):
+        self.latency = time.monotonic() - self._started
+
+        if response is None:
+            response = getattr(error, "response", None)
+
+        if response is not None:
+            self.status_code = response.status_code
+            self.bytes = get_response_size(response)
+        if error is not None:
+            self.error = type(error).__name__
+
+            if self.status_code is None:
+                self.status_code = getattr(error, "status_code", None)
+
+        return self
+
+    def as_dict(self):
+        return {
+            "service_type": self.service_type,
+            "endpoint": self.endpoint,
+            "operation": self.operation,
+            "url": self.url,
+            "url_template": self.url_template,
+            "method": self.method,
+            "status": self.status,
+            "status_code": self.status_code,
+            "bytes": self.bytes,
+            "latency": self.latency,
+            "retries": self.retries,
+            "cache": self.cache,
+            "error": self.error,
+        }
+
+
+class Span(object):
+    """
+    A client operation (get, bulk_get, get_image or populate_field_values), reported to listeners once complete.
+    Image operations also report timings by phase, as clients.utils.profiling.PhaseTimings.
+    """
+
+    def __init__(self, operation, service_type, url=None):
+        self.operation = operation
+        self.service_type = service_type
+        self.url = url
+        self.url_template = get_url_template(url)
+        self.parent = _current_span.get()
+
+        self.start_time = time.time()
+        self.duration = None
+        self.error = None
+        self.timings = None
+
+        self._started = time.monotonic()
+
+    def __repr__(self):
+        return f"Span({self.service_type}.{self.operation}, duration={self.duration})"
+
+    @property
+    def end_time(self):
+        return None if self.duration is None else self.start_time + self.duration
+
+    def finish(self, error=None):
+        self.duration = time.monotonic() - self._started
+
+        if error is not None:
+            self.error = type(error).__name__
+
+        return self
+
+    def as_dict(self):
+        return {
+            "operation": self.operation,
+            "service_type": self.service_type,
+            "url": self.url,
+            "url_template": self.url_template,
+            "parent": self.parent.operation if self.parent else None,
+            "start_time": self.start_time,
+            "duration": self.duration,
+            "error": self.error,
+            "timings": self.timings.as_dict() if self.timings else None,
+        }
+
+
+class MetricsListener(object):
+    """ Receives events from clients: override either method to collect them """
+
+    def on_request(self, event):
+        """ :param event: a completed RequestEvent """
+
+    def on_span(self, span):
+        """ :param span: a completed Span """
+
+
+class Instrumentation(object):
+    """ Dispatches request events and operation spans to registered listeners, if there are any """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._listeners = ()
+
+    @property
+    def enabled(self):
+        return bool(self._listeners)
+
+    def add_listener(self, listener):
+        with self._lock:
+            if listener not in self._listeners:
+                self._listeners += (listener,)
+        return listener
+
+    def remove_listener(self, listener):
+        with self._lock:
+            self._listeners = tuple(
+                existing for existing in self._listeners if existing is not listener
+            )
+
+    def clear(self):
+        with self._lock:
+            self._listeners = ()
+
+    def emit_request(self, event):
+        for listener in self._listeners:
+            try:
+                listener.on_request(event)
+            except Exception:
+                logger.exception(f"Metrics listener failed on request: {event}")
+
+    def emit_span(self, span):
+        for listener in self._listeners:
+            try:
+                listener.on_span(span)
+            except Exception:
+                logger.exception(f"Metrics listener failed on span: {span}")
+
+    @contextmanager
+    def span(self, operation, service_type, url=None):
+        """ Times the operation, and any requests made within it, as a span reported once it completes """
+
+        span = Span(operation, service_type, url)
+        token = _current_span.set(span)
+
+        try:
+            yield span
+        except BaseException as ex:
+            self.emit_span(span.finish(error=ex))
+            raise
+        else:
+            self.emit_span(span.finish())
+        finally:
+            _current_span.reset(token)
+
+
+def instrumented(operation, timed=False):
+    """
+    Decorates a resource method to report each call as a span for the operation.
+    :param timed: if True, the span includes timings by phase, collected only while there are listeners
+    """
+
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            service_type = type(self).__name__
+
+            with instrumentation.span(operation, service_type, self._url) as span:
+                if not timed or not instrumentation.enabled:
+                    return method(self, *args, **kwargs)
+
+                with collect_timings() as timings:
+                    span.timings = timings
+                    return method(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class LatencyHistogram(object):
+    """ Counts observed durations in cumulative buckets, as Prometheus histograms do """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+        for idx, bucket in enumerate(self.buckets):
+            if value <= bucket:
+                self.counts[idx] += 1
+
+    def get_stats(self):
+        return {
+            "count": self.count,
+            "total": self.total,
+            "mean": self.total / self.count if self.count else None,
+            "max": self.max,
+            "buckets": dict(zip(self.buckets, self.counts)),
+        }
+
+
+class MetricsAggregator(MetricsListener):
+    """ Collects request and span totals in memory, grouped by service type, endpoint and status or operation """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+
+        self._lock = threading.Lock()
+        self.reset()
+
+    def on_request(self, event):
+        key = (event.service_type, event.endpoint, event.status)
+
+        with self._lock:
+            stats = self._requests.get(key)
+            if stats is None:
+                stats = self._requests[key] = {
+                    "count": 0,
+                    "bytes": 0,
+                    "retries": 0,
+                    "cache_hits": 0,
+                    "cache_misses": 0,
+                    "latency": LatencyHistogram(self.buckets),
+                }
+
+            stats["count"] += 1
+            stats["bytes"] += event.bytes or 0
+            stats["retries"] += event.retries
+
+            if event.cache == "hit":
+                stats["cache_hits"] += 1
+            elif event.cache == "miss":
+                stats["cache_misses"] += 1
+
+            if event.latency is not None:
+                stats["latency"].observe(event.latency)
+
+    def on_span(self, span):
+        key = (span.service_type, span.operation)
+
+        with self._lock:
+            stats = self._spans.get(key)
+            if stats is None:
+                stats = self._spans[key] = {
+                    "count": 0,
+                    "errors": 0,
+                    "duration": LatencyHistogram(self.buckets),
+                }
+
+            stats["count"] += 1
+            stats["errors"] += 1 if span.error else 0
+            stats["duration"].observe(span.duration)
+
+    def get_stats(self):
+        """ :return: request totals keyed by (service type, endpoint, status), and span totals by (service type, operation) """
+
+        with self._lock:
+            return {
+                "requests": {
+                    key: dict(stats, latency=stats["latency"].get_stats())
+                    for key, stats in self._requests.items()
+                },
+                "spans": {
+                    key: dict(stats, duration=stats["duration"].get_stats())
+                    for key, stats in self._spans.items()
+                },
+            }
+
+    def reset(self):
+        with self._lock:
+            self._requests = {}
+            self._spans = {}
+
+
+class PrometheusAdapter(MetricsListener):
+    """
+    Reports events to Prometheus-style metrics: any objects with labels(...).inc() and labels(...).observe().
+    Use create() to make and register them with prometheus_client, if installed.
+    """
+
+    REQUEST_LABELS = ("service_type", "endpoint", "status")
+    SPAN_LABELS = ("service_type", "operation", "error")
+
+    def __init__(
+        self,
+        requests_total,
+        request_seconds,
+        response_bytes=None,
+        operation_seconds=None,
+    ):
+        self.requests_total = requests_total
+        self.request_seconds = request_seconds
+        self.response_bytes = response_bytes
+        self.operation_seconds = operation_seconds
+
+    @classmethod
+    def create(cls, namespace="mapservice_client", registry=None):
+        """ :return: an adapter with new metrics registered in the prometheus_client registry (or default) """
+
+        from prometheus_client import REGISTRY, Counter, Histogram
+
+        registry = REGISTRY if registry is None else registry
+        options = {"namespace": namespace, "registry": registry}
+
+        return cls(
+            Counter(
+                "requests",
+                "Requests sent to map services",
+                cls.REQUEST_LABELS,
+                **options,
+            ),
+            Histogram(
+                "request_seconds",
+                "Latency of requests to map services",
+                cls.REQUEST_LABELS,
+                **options,
+            ),
+            Counter(
+                "response_bytes",
+                "Bytes received from map services",
+                cls.REQUEST_LABELS,
+                **options,
+            ),
+            Histogram(
+                "operation_seconds",
+                "Duration of client operations",
+                cls.SPAN_LABELS,
+                **options,
+            ),
+        )
+
+    def on_request(self, event):
+        labels = {
+            "service_type": event.service_type,
+            "endpoint": event.endpoint,
+            "status": event.status,
+        }
+
+        self.requests_total.labels(**labels).inc()
+
+        if event.latency is not None:
+            self.request_seconds.labels(**labels).observe(event.latency)
+        if event.bytes and self.response_bytes is not None:
+            self.response_bytes.labels(**labels).inc(event.bytes)
+
+    def on_span(self, span):
+        if self.operation_seconds is None:
+            return
+
+        self.operation_seconds.labels(
+            service_type=span.service_type,
+            operation=span.operation,
+            error=span.error or "",
+        ).observe(span.duration)
+
+
+class OpenTelemetryAdapter(MetricsListener):
+    """
+    Reports events to an OpenTelemetry-style meter, creating counters and histograms from it,
+    and spans to an optional tracer, with start and end times matching each completed operation.
+    """
+
+    def __init__(self, meter, tracer=None, prefix="mapservice_client"):
+        self.tracer = tracer
+
+        self.requests = meter.create_counter(
+            f"{prefix}.requests", description="Requests sent to map services"
+        )
+        self.request_duration = meter.create_histogram(
+            f"{prefix}.request.duration",
+            unit="s",
+            description="Latency of requests to map services",
+        )
+        self.response_size = meter.create_counter(
+            f"{prefix}.response.size",
+            unit="By",
+            description="Bytes received from map services",
+        )
+        self.operation_duration = meter.create_histogram(
+            f"{prefix}.operation.duration",
+            unit="s",
+            description="Duration of client operations",
+        )
+
+    def on_request(self, event):
+        attributes = {
+            "service.type": event.service_type,
+            "endpoint": event.endpoint,
+            "url.template": event.url_template,
+            "status": event.status,
+        }
+        if event.cache is not None:
+            attributes["cache"] = event.cache
+
+        self.requests.add(1, attributes)
+
+        if event.latency is not None:
+            self.request_duration.record(event.latency, attributes)
+        if event.bytes:
+            self.response_size.add(event.bytes, attributes)
+
+    def on_span(self, span):
+        attributes = {"service.type": span.service_type, "operation": span.operation}
+        if span.error:
+            attributes["error"] = span.error
+
+        self.operation_duration.record(span.duration, attributes)
+
+        if self.tracer is not None:
+            attributes["url.template"] = span.url_template
+
+            trace_span = self.tracer.start_span(
+                f"{span.service_type}.{span.operation}",
+                attributes=attributes,
+                start_time=int(span.start_time * 1e9),
+            )
+            trace_span.end(end_time=int(span.end_time * 1e9))
+
+
+instrumentation = Instrumentation()
@@ -0,0 +1,105 @@
+""" Timing of each phase of an image pipeline: network, decode, transparency, composite, crop, render and encode """
+import threading
+import time
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+
+PHASES = ("network", "decode", "transparency", "composite", "crop", "render", "encode")
+
+_current_timings = ContextVar("current_timings", default=None)
+
+
+class Phase(object):
+    """ A single timed step, to which the number of bytes processed may be assigned """
+
+    def __init__(self, name):
+        self.name = name
+        self.bytes = None
+
+
+class PhaseTimings(object):
+    """
+    Durations, byte counts and number of steps by phase, collected while timing is enabled.
+    Phases run concurrently (such as requests for tiles) are summed, so may exceed the overall duration.
+    """
+
+    def __init__(self, parent=None):
+        self.parent = parent
+        self.phases = {}
+        self.duration = None
+
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+
+    def __repr__(self):
+        return f"PhaseTimings({self.as_dict()})"
+
+    def add(self, phase, duration, size=None):
+        with self._lock:
+            stats = self.phases.get(phase)
+            if stats is None:
+                stats = self.phases[phase] = {"count": 0, "duration": 0.0, "bytes": 0}
+
+            stats["count"] += 1
+            stats["duration"] += duration
+            stats["bytes"] += size or 0
+
+        if self.parent is not None:
+            self.parent.add(phase, duration, size)
+
+    def get(self, phase):
+        """ :return: the totals for the phase, which are zero if it did not run """
+
+        with self._lock:
+            stats = self.phases.get(phase)
+
+        return dict(stats) if stats else {"count": 0, "duration": 0.0, "bytes": 0}
+
+    def finish(self):
+        self.duration = time.monotonic() - self._started
+        return self
+
+    def as_dict(self):
+        with self._lock:
+            phases = {phase: dict(stats) for phase, stats in self.phases.items()}
+
+        return {"duration": self.duration, "phases": phases}
+
+
+@contextmanager
+def collect_timings():
+    """
+    Collects the time spent in each phase of any image pipeline run within the block:
+        with collect_timings() as timings:
+            client.get_image(extent, width, height)
+        timings.get("decode")
+    """
+
+    timings = PhaseTimings(parent=_current_timings.get())
+    token = _current_timings.set(timings)
+
+    try:
+        yield timings
+    finally:
+        timings.finish()
+        _current_timings.reset(token)
+
+
+@contextmanager
+def timed_phase(name):
+    """ Times the block as a phase of the current image pipeline, only if timings are being collected """
+
+    phase = Phase(name)
+    timings = _current_timings.get()
+
+    if timings is None:
+        yield phase
+        return
+
+    started = time.monotonic()
+    try:
+        yield phase
+    finally:
+        timings.add(name, time.monotonic() - started, phase.bytes)
@@ -0,0 +1,231 @@
+""" Retries with jittered backoff, and circuit breakers that stop requests to hosts known to be down """
+import random
+import threading
+import time
+
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+
+
+RETRY_STATUSES = (429, 502, 503, 504)  # Statuses indicating a request may succeed if retried
+FAILURE_STATUSES = (502, 503, 504)  # Statuses indicating a host is down or overloaded
+RETRY_ERRORS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+
+DEFAULT_FAILURE_THRESHOLD = 5  # Consecutive failures before requests to a host are suspended
+DEFAULT_RECOVERY_TIMEOUT = 30  # Seconds before a suspended host is probed again
+DEFAULT_PROBE_TIMEOUT = 180  # Seconds before a probe with no outcome is abandoned
+
+
+class RetryPolicy(object):
+    """
+    Determines whether and when idempotent requests are retried, with exponential backoff and full jitter.
+    A Retry-After header sent with a retryable status is respected, up to max_retry_after seconds.
+    """
+
+    def __init__(
+        self,
+        retries=2,
+        backoff=0.5,
+        max_backoff=10,
+        max_retry_after=30,
+        statuses=RETRY_STATUSES,
+    ):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_retry_after = max_retry_after
+        self.statuses = frozenset(statuses)
+
+    def get_delay(self, attempt, response=None, error=None):
+        """
+        :param attempt: the number of attempts already made, minus one
+        :param response: the response to the last attempt, if any
+        :param error: the connection error or timeout raised by the last attempt, if any
+        :return: seconds to wait before retrying, or None if the request should not be retried
+        """
+
+        if attempt >= self.retries:
+            return None
+
+        if response is not None:
+            if response.status_code not in self.statuses:
+                return None
+
+            retry_after = self.get_retry_after(response)
+            if retry_after is not None:
+                return retry_after if retry_after <= self.max_retry_after else None
+
+        elif not isinstance(error, RETRY_ERRORS):
+            return None
+
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def get_retry_after(self, response):
+        """ :return: seconds to wait as specified by the Retry-After header, or None if not provided """
+
+        retry_after = (response.headers or {}).get("Retry-After")
+        if not retry_after:
+            return None
+
+        try:
+            return max(float(retry_after), 0)
+        except ValueError:
+            pass
+
+        try:
+            retry_date = parsedate_to_datetime(retry_after)
+        except (TypeError, ValueError):
+            return None
+
+        return max(retry_date.timestamp() - time.time(), 0)
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+
+class CircuitBreaker(object):
+    """
+    Tracks consecutive failures for a single host, and suspends requests once they reach a threshold.
+    After the recovery timeout one request is let through to probe the host: its success resumes requests.
+    A probe that is never sent should be cancelled, and one that reports no outcome is abandoned after probe_timeout.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(
+        self,
+        failure_threshold=DEFAULT_FAILURE_THRESHOLD,
+        recovery_timeout=DEFAULT_RECOVERY_TIMEOUT,
+        probe_timeout=DEFAULT_PROBE_TIMEOUT,
+    ):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.probe_timeout = probe_timeout
+
+        self.failures = 0
+        self.opened_at = None
+        self.probed_at = None
+        self.state = self.CLOSED
+
+        self._lock = threading.Lock()
+
+    def allow_request(self):
+        """ :return: True if a request may be sent to the host, which may be the probe for a suspended host """
+
+        with self._lock:
+            now = time.monotonic()
+
+            if self.state == self.CLOSED:
+                return True
+            elif self.state == self.HALF_OPEN:
+                if now - self.probed_at < self.probe_timeout:
+                    return False  # A probe is already in flight
+
+            elif now - self.opened_at < self.recovery_timeout:
+                return False
+
+            self.state = self.HALF_OPEN
+            self.probed_at = now
+            return True
+
+    def cancel_probe(self):
+        """ Suspends requests again without an outcome, after a probe allowed through was not sent """
+
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                # Still past the recovery timeout, so the next request probes again
+                self.state = self.OPEN
+
+    def record_response(self, response):
+        if response.status_code in FAILURE_STATUSES:
+            self.record_failure()
+        else:
+            self.record_success()
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probed_at = None
+            self.state = self.CLOSED
+
+
+class CircuitBreakerRegistry(object):
+    """ Creates and keeps one circuit breaker per host, configurable for all hosts or per host """
+
+    def __init__(
+        self,
+        failure_threshold=DEFAULT_FAILURE_THRESHOLD,
+        recovery_timeout=DEFAULT_RECOVERY_TIMEOUT,
+        probe_timeout=DEFAULT_PROBE_TIMEOUT,
+    ):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.probe_timeout = probe_timeout
+
+        self._lock = threading.Lock()
+        self._breakers = {}
+        self._host_config = {}
+
+    def configure_host(
+        self, host, failure_threshold=None, recovery_timeout=None, probe_timeout=None
+    ):
+        """
+        Overrides breaker settings for a single host, replacing any breaker already created for it.
+        :param host: a host name with optional port, or any URL at that host
+        """
+
+        host = get_host(host)
+        config = {
+            "failure_threshold": failure_threshold or self.failure_threshold,
+            "recovery_timeout": recovery_timeout or self.recovery_timeout,
+            "probe_timeout": probe_timeout or self.probe_timeout,
+        }
+
+        with self._lock:
+            self._host_config[host] = config
+            self._breakers.pop(host, None)
+
+    def get_breaker(self, url):
+        """ :return: the circuit breaker for the host of the URL """
+
+        host = get_host(url)
+
+        with self._lock:
+            breaker = self._breakers.get(host)
+
+            if breaker is None:
+                config = self._host_config.get(host) or {
+                    "failure_threshold": self.failure_threshold,
+                    "recovery_timeout": self.recovery_timeout,
+                    "probe_timeout": self.probe_timeout,
+                }
+                breaker = self._breakers[host] = CircuitBreaker(**config)
+
+        return breaker
+
+    def reset(self):
+        """ Forgets all failures, resuming requests to every host """
+
+        with self._lock:
+            self._breakers.clear()
+
+
+def get_host(url):
+    """ :return: the host name and port of a URL, or of a host name with optional port """
+    return urlsplit(url if "//" in url else f"//{url}").netloc.lower()
+
+
+circuit_breakers = CircuitBreakerRegistry()
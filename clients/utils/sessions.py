@@ -0,0 +1,147 @@
+""" Pooled HTTP sessions shared by all of the map service clients """
+import threading
+import requests
+
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlsplit
+
+
+DEFAULT_POOL_CONNECTIONS = 20  # Number of hosts for which connection pools are kept
+DEFAULT_POOL_MAXSIZE = 10  # Number of keep-alive connections kept per host
+DEFAULT_TIMEOUT = (10, 120)  # Connect and read timeouts in seconds
+
+
+class ClientSession(requests.Session):
+    """
+    A session with a default timeout for every request, which mounts connection pools shared with other sessions.
+    Sessions are cheap to create this way, while TLS connections to the same hosts are reused between them.
+    """
+
+    def __init__(self, adapters=None, timeout=DEFAULT_TIMEOUT):
+        super(ClientSession, self).__init__()
+
+        self.timeout = timeout
+
+        for prefix, adapter in (adapters or {}).items():
+            self.mount(prefix, adapter)
+
+    def request(self, method, url, **kwargs):
+        """ Overridden to apply the default timeout when none is provided """
+
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+
+        return super(ClientSession, self).request(method, url, **kwargs)
+
+    def close(self):
+        """ Overridden to leave connection pools open for the other sessions sharing them """
+
+
+class SessionFactory(object):
+    """ Creates sessions that share keep-alive connection pools, with pool sizes configurable per host """
+
+    def __init__(
+        self,
+        pool_connections=DEFAULT_POOL_CONNECTIONS,
+        pool_maxsize=DEFAULT_POOL_MAXSIZE,
+        pool_block=False,
+        timeout=DEFAULT_TIMEOUT,
+    ):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.timeout = timeout
+
+        self._lock = threading.Lock()
+        self._adapters = {}
+        self._session = None
+
+        for prefix in ("http://", "https://"):
+            self._adapters[prefix] = self._create_adapter(pool_maxsize, pool_block)
+
+    def _create_adapter(self, pool_maxsize, pool_block):
+        return HTTPAdapter(
+            pool_connections=self.pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=pool_block,
+        )
+
+    def configure_host(self, host, pool_maxsize, pool_block=None):
+        """
+        Sizes the connection pool for a single host, affecting sessions created from now on.
+        :param host: a host name with optional port, or any URL at that host
+        """
+
+        parts = urlsplit(host if "//" in host else f"//{host}")
+        schemes = (parts.scheme,) if parts.scheme else ("http", "https")
+
+        pool_block = self.pool_block if pool_block is None else pool_block
+        adapter = self._create_adapter(pool_maxsize, pool_block)
+
+        with self._lock:
+            for scheme in schemes:
+                # The trailing slash keeps the pool from matching other hosts that start with the same name
+                prefix = f"{scheme}://{parts.netloc}/"
+                self._adapters[prefix] = adapter
+
+                if self._session is not None:
+                    self._session.mount(prefix, adapter)
+
+    def mount(self, prefix, adapter):
+        """
+        Mounts a transport adapter for URLs starting with the prefix, in the shared session and those created from now on.
+        :return: the adapter previously mounted for the prefix, if any
+        """
+
+        with self._lock:
+            previous = self._adapters.get(prefix)
+            self._adapters[prefix] = adapter
+
+            if self._session is not None:
+                self._session.mount(prefix, adapter)
+
+        return previous
+
+    def create_session(self, user_agent=None, timeout=None):
+        """ :return: a new session with its own headers and params, but pooled connections """
+
+        with self._lock:
+            adapters = dict(self._adapters)
+
+        session = ClientSession(adapters, timeout=timeout or self.timeout)
+        if user_agent:
+            session.headers["User-agent"] = user_agent
+
+        return session
+
+    def get_session(self):
+        """ :return: a session shared by requests that need no headers, params or credentials of their own """
+
+        if self._session is None:
+            session = self.create_session()
+
+            with self._lock:
+                if self._session is None:
+                    self._session = session
+
+        return self._session
+
+    def close(self):
+        """ Closes all pooled connections: they will be reopened as needed """
+
+        with self._lock:
+            for adapter in set(self._adapters.values()):
+                adapter.close()
+
+
+session_factory = SessionFactory()
+
+
+def create_session(user_agent=None, timeout=None):
+    """ :return: a new session from the default session factory """
+    return session_factory.create_session(user_agent, timeout)
+
+
+def get_session():
+    """ :return: the shared session from the default session factory """
+    return session_factory.get_session()
@@ -11,7 +11,10 @@ WMS Notes: layer may have BoundingBox, LatLonBoundingBox, or both (or worst case
 layer may have sublayers (extent may be defined at parent layer level).
 """
 
+import copy
+import logging
 import requests
+import threading
 
 from PIL import Image
 from io import BytesIO
@@ -24,16 +27,26 @@ from parserutils.urls import (
     parts_to_url,
 )
 from restle.fields import TextField, BooleanField, IntegerField
+from restle.resources import ALPHANUMERIC
 
 from .exceptions import BadExtent, ClientError, HTTPError, ImageError
-from .exceptions import MissingFields, NoLayers, ServiceError, ValidationError
+from .exceptions import MissingFields, NoLayers, ServiceError, ServiceTimeout
+from .exceptions import ServiceUnavailable, ValidationError
 from .query.fields import DictField, ExtentField, ListField, SpatialReferenceField
-from .query.serializers import XMLToJSONSerializer
+from .query.serializers import StreamingXMLToJSONSerializer, XMLToJSONSerializer
 from .resources import ClientResource
-from .utils.geometry import Extent, union_extent
-from .utils.images import make_color_transparent
+from .utils.cache import legend_cache
+from .utils.concurrency import map_concurrently
+from .utils.deadlines import Deadline
+from .utils.geometry import Extent, project_extents, union_extent
+from .utils.images import RawImage, make_color_transparent, reduce_to_palette
+from .utils.legends import build_legend_atlas
+from .utils.metrics import RequestEvent, instrumentation, instrumented
+from .utils.profiling import timed_phase
 
 
+logger = logging.getLogger(__name__)
+
 WMS_KNOWN_VERSIONS = ("1.1.1", "1.3.0")
 WMS_DEFAULT_PARAMS = {
     "version": WMS_KNOWN_VERSIONS[1],  # Default to maximum
@@ -43,6 +56,80 @@ WMS_DEFAULT_PARAMS = {
 WMS_EXCEPTION_FORMAT = "application/vnd.ogc.se_xml"
 WMS_SRS_DEFAULT = "EPSG:3857"
 
+# Layer fields read when layers are indexed lazily: enough for the layer tree and the service level aggregates
+WMS_INDEXED_LAYER_FIELDS = {
+    "id",
+    "version",
+    "is_ncwms",
+    "is_old_version",
+    "dimensions",
+    "has_dimensions",
+    "has_time",
+    "supported_spatial_refs",
+    "_dimension",
+    "_extent",
+    "_geographic_extent",
+    "_old_bbox_extent",
+    "_old_latlon_extent",
+    "_spatial_refs",
+    "_coordinate_refs",
+}
+
+
+def _get_spatial_reference_key(extent):
+    spatial_ref = extent.spatial_reference
+    return spatial_ref.srs, spatial_ref.wkid, spatial_ref.wkt
+
+
+def _merge_indexed_extents(extents, other_extents):
+    """ Unions each extent in other_extents into the extent with the same spatial reference in extents """
+
+    for key, extent in other_extents.items():
+        extents[key] = union_extent((extents.get(key), extent))
+
+
+def _project_indexed_extents(extents, url=None):
+    """ :return: the union of indexed extents, each projected to Web Mercator once for all layers sharing its projection """
+
+    try:
+        return union_extent(project_extents(list(extents.values())))
+    except ValueError as ex:
+        raise BadExtent("Error reprojecting WMS layer extents", underlying=ex, url=url)
+
+
+def _project_layer_extents(layers, url=None):
+    """
+    Projects the extent of each layer and all its children to Web Mercator, together for layers sharing a projection,
+    and then unions the extents of child layers into their parents.
+    """
+
+    ordered_layers = []  # Children before their parents
+
+    def collect_layers(layer):
+        for child in layer.child_layers:
+            collect_layers(child)
+        ordered_layers.append(layer)
+
+    for layer in layers:
+        collect_layers(layer)
+
+    extents = [layer._get_extent() for layer in ordered_layers]
+    layers_with_extents = [l for l, e in zip(ordered_layers, extents) if e]
+
+    try:
+        projected = project_extents([e for e in extents if e])
+    except ValueError as ex:
+        raise BadExtent("Error reprojecting WMS layer extents", underlying=ex, url=url)
+
+    for layer, extent in zip(layers_with_extents, projected):
+        layer.full_extent = extent
+
+    for layer in ordered_layers:
+        if layer.child_layers:
+            layer.full_extent = union_extent(
+                [layer.full_extent] + [l.full_extent for l in layer.child_layers]
+            )
+
 
 class NcWMSLayerResource(ClientResource):
 
@@ -82,6 +169,9 @@ class NcWMSLayerResource(ClientResource):
 
     is_ncwms = True
 
+    _endpoint = "layers"
+    _hedged = True  # Layer details are small, idempotent metadata requests
+
     class Meta:
         case_sensitive_fields = False
         match_fuzzy_keys = True
@@ -227,6 +317,10 @@ class WMSLayerResource(ClientResource):
     palettes = ListField(default=[])
     supported_styles = ListField(default=["boxfill"])
 
+    # Data left to populate, and unprojected extents of the layer and its children by projection, if indexed lazily
+    _layer_data = None
+    _indexed_extents = None
+
     class Meta:
         case_sensitive_fields = False
         match_fuzzy_keys = True
@@ -244,6 +338,101 @@ class WMSLayerResource(ClientResource):
     def populate_field_values(self, data):
         """ Overridden to recursively populate layers """
 
+        self._prepare_field_values(data)
+
+        super(WMSLayerResource, self).populate_field_values(data)
+
+        # No parent/child layer dependencies
+        self._populate_dimensions()
+        self._populate_metadata_urls()
+
+        self.has_dimensions = bool(self.dimensions)
+        self.has_time = "time" in self.dimensions
+
+        # Must populate before child layers (depend on self.parent): extents are projected once all are populated
+        self._populate_attribution()
+        self._populate_styles()
+        self._populate_spatial_refs()
+
+        self._populate_child_layers(data)
+
+        # Must populate after child layers (depends on self.child_layers)
+        if self.is_ncwms:
+            self._populate_ncwms_names()
+
+    def index_field_values(self, data):
+        """
+        Populates only what is needed to index the layer tree by id and position, and to aggregate service fields.
+        The rest is populated on first access to any other field, inheriting from parent layers populated likewise.
+        """
+
+        self._prepare_field_values(data)
+        self._populate_indexed_fields(data)
+
+        self._layer_data = data
+        self._populated_field_values = False
+
+        self._populate_dimensions()
+
+        self.has_dimensions = bool(self.dimensions)
+        self.has_time = "time" in self.dimensions
+
+        extent = self._get_extent()
+        if extent:
+            self._indexed_extents = {_get_spatial_reference_key(extent): extent}
+        else:
+            self._indexed_extents = {}
+
+        self._populate_spatial_refs()
+        self._populate_child_layers(data)
+
+    def _load_resource(self, as_unicode=True):
+        """
+        Overridden to populate the rest of a layer indexed lazily: layers are only ever populated, not fetched.
+        Layers of a service are populated one at a time, since each populates its parents first and inherits from them.
+        """
+
+        with self.wms._layers_lock:
+            if self._populated_field_values:
+                return  # Populated by another thread in the meantime
+
+            # Populate a copy, so that the layer is never seen partially populated, and is left indexed on failure
+            layer = object.__new__(type(self))
+            vars(layer).update(vars(self))
+            layer._populate_indexed_layer()
+            layer._layer_data = None
+
+            vars(self).update(vars(layer))
+
+    def _populate_indexed_layer(self):
+        """ Populates the fields not indexed from the data captured when indexing """
+
+        indexed = dict(vars(self))
+
+        super(WMSLayerResource, self).populate_field_values(self._layer_data)
+
+        # Keep the layer tree, indexed fields, and any layer order assigned since indexing
+        vars(self).update(indexed)
+        self._populated_field_values = True
+
+        self._populate_metadata_urls()
+        self._populate_attribution()
+
+        if self.child_layers:
+            self.full_extent = _project_indexed_extents(
+                self._indexed_extents, self._url
+            )
+        else:
+            self._populate_extent()
+
+        self._populate_styles()
+
+        if self.is_ncwms:
+            self._populate_ncwms_names()
+
+    def _prepare_field_values(self, data):
+        """ Captures parent data, and derives fields from the data before it is populated or indexed """
+
         self.wms = data.pop("wms")
         self.parent = data.pop("parent", None)
 
@@ -266,29 +455,28 @@ class WMSLayerResource(ClientResource):
         data["queryable"] = data.get("queryable", "").lower() in {"1", "true"}
         data["is_ncwms"] = self.wms._is_ncwms
 
-        super(WMSLayerResource, self).populate_field_values(data)
+    def _populate_indexed_fields(self, data):
+        """ Populates the fields in WMS_INDEXED_LAYER_FIELDS from the data, as populate_field_values would """
 
-        # No parent/child layer dependencies
-        self._populate_dimensions()
-        self._populate_metadata_urls()
-
-        self.has_dimensions = bool(self.dimensions)
-        self.has_time = "time" in self.dimensions
+        data = {
+            "".join(c for c in k if c in ALPHANUMERIC).lower(): v
+            for k, v in data.items()
+        }
 
-        # Must populate before child layers (depend on self.parent)
-        self._populate_attribution()
-        self._populate_extent()
-        self._populate_styles()
-        self._populate_spatial_refs()
+        for field in self._meta.fields:
+            if field._attr_name not in WMS_INDEXED_LAYER_FIELDS:
+                continue
 
-        self._populate_child_layers(data)
+            name = "".join(c for c in field.name if c in ALPHANUMERIC).lower()
+            if name in data:
+                value = field.to_python(data[name], self)
+            else:
+                value = copy.copy(field.default)
 
-        # Must populate after child layers (depends on self.child_layers)
-        if self.is_ncwms:
-            self._populate_ncwms_names()
+            setattr(self, field._attr_name, value)
 
     def _populate_child_layers(self, data):
-        """ Recurse and instantiate children with nested Layer data """
+        """ Recurse and instantiate children with nested Layer data, indexing them only if the service says so """
 
         for layer in wrap_value(data.get("Layer", [])):
             layer["wms"] = self.wms
@@ -299,9 +487,15 @@ class WMSLayerResource(ClientResource):
                 session=(self._layer_session or self._session),
                 color_map=self._color_map,
             )
-            wms_layer.populate_field_values(layer)
             self.child_layers.append(wms_layer)
-            self.full_extent = union_extent((self.full_extent, wms_layer.full_extent))
+
+            if self.wms._lazy_layers:
+                wms_layer.index_field_values(layer)
+                _merge_indexed_extents(
+                    self._indexed_extents, wms_layer._indexed_extents
+                )
+            else:
+                wms_layer.populate_field_values(layer)
 
             if wms_layer.id and not wms_layer.child_layers:
                 self.leaf_layers[wms_layer.id] = wms_layer
@@ -335,7 +529,23 @@ class WMSLayerResource(ClientResource):
                 self.dimensions[dim["name"]] = obj
 
     def _populate_extent(self):
-        """ Extract original extent - caller must limit to globe and project """
+        """ Extract original extent, and project it to Web Mercator """
+
+        extent = self._get_extent()
+        if extent:
+            try:
+                # Standardize across layers; they may be in different projections
+                self.full_extent = extent.project_to_web_mercator()
+            except ValueError as ex:
+                raise BadExtent(
+                    f'Error reprojecting extent for WMS layer "{self.id}"',
+                    extent=self.full_extent,
+                    underlying=ex,
+                    url=self._url,
+                )
+
+    def _get_extent(self):
+        """ :return: the original extent of the layer, or of its parent if it has none """
 
         if self._geographic_extent:
             extent = self._geographic_extent
@@ -344,8 +554,11 @@ class WMSLayerResource(ClientResource):
         elif self._old_bbox_extent:
             extent = self._old_bbox_extent
             extent = extent if isinstance(extent, Extent) else extent[0]
+        elif self.parent is None:
+            extent = None
         else:
-            extent = getattr(self.parent, "full_extent", None)
+            # Inherit the original extent: the parent extent may not have been projected yet
+            extent = self.parent._get_extent()
 
         if self.id and not extent:
             # Leaf layer missing extent as EX_GeographicBoundingBox, LatLonBoundingBox, or BoundingBox
@@ -354,17 +567,8 @@ class WMSLayerResource(ClientResource):
                 missing="extent",
                 url=self._url,
             )
-        elif extent:
-            try:
-                # Standardize across layers; they may be in different projections
-                self.full_extent = extent.project_to_web_mercator()
-            except ValueError as ex:
-                raise BadExtent(
-                    f'Error reprojecting extent for WMS layer "{self.id}"',
-                    extent=self.full_extent,
-                    underlying=ex,
-                    url=self._url,
-                )
+
+        return extent
 
     def _populate_metadata_urls(self):
 
@@ -451,45 +655,50 @@ class WMSLayerResource(ClientResource):
             for child in child_layers:
                 child._populate_ordered_layers(ordered_layers)
 
-        elif self.is_ncwms:
-            # Attempt to query the NcWMS layer endpoint for more data
-
-            layer_url = self._ncwms_layer_url.format(layer_id=self.id)
-            layer_data = {
-                "id": self.id,
-                "title": self.id,
-                "description": self.title,
-                "layer_order": self.layer_order,
-                "version": self.version,
-                "wms_version": self.version,
-            }
+    def _get_ncwms_layer(self):
+        """ :return: the NcWMS layer details for this leaf layer, or None if the service has none for it """
+
+        layer_url = self._ncwms_layer_url.format(layer_id=self.id)
+        layer_data = {
+            "id": self.id,
+            "title": self.id,
+            "description": self.title,
+            "layer_order": self.layer_order,
+            "version": self.version,
+            "wms_version": self.version,
+        }
 
-            try:
-                ncwms_layer = NcWMSLayerResource.get(
-                    layer_url,
-                    lazy=False,
-                    color_map=self._color_map,
-                    layer_data=layer_data,
-                    session=(self._layer_session or self._session),
-                )
-            except ClientError:
-                pass  # No NcWMS data to query
-            else:
-                self.credits = ncwms_layer.credits
-                self.copyright_text = ncwms_layer.copyright_text
-                self.more_info = ncwms_layer.more_info
+        try:
+            return NcWMSLayerResource.get(
+                layer_url,
+                lazy=False,
+                color_map=self._color_map,
+                layer_data=layer_data,
+                session=(self._layer_session or self._session),
+                deadline=self.wms._deadline,
+            )
+        except (ServiceTimeout, ServiceUnavailable):
+            raise  # Out of time, or the host is down: no other layer details will load either
+        except ClientError:
+            return None  # No NcWMS data to query
+
+    def _populate_ncwms_details(self, ncwms_layer):
+
+        self.credits = ncwms_layer.credits
+        self.copyright_text = ncwms_layer.copyright_text
+        self.more_info = ncwms_layer.more_info
 
-                self.num_color_bands = ncwms_layer.num_color_bands
-                self.log_scaling = ncwms_layer.log_scaling
-                self.scale_range = ncwms_layer.scale_range
-                self.legend_info = ncwms_layer.legend_info
-                self.units = ncwms_layer.units
+        self.num_color_bands = ncwms_layer.num_color_bands
+        self.log_scaling = ncwms_layer.log_scaling
+        self.scale_range = ncwms_layer.scale_range
+        self.legend_info = ncwms_layer.legend_info
+        self.units = ncwms_layer.units
 
-                self.default_style = ncwms_layer.default_style
-                self.default_palette = ncwms_layer.default_palette
-                self.palettes = ncwms_layer.palettes
-                self.supported_styles = ncwms_layer.supported_styles
-                self.styles = ncwms_layer.styles
+        self.default_style = ncwms_layer.default_style
+        self.default_palette = ncwms_layer.default_palette
+        self.palettes = ncwms_layer.palettes
+        self.supported_styles = ncwms_layer.supported_styles
+        self.styles = ncwms_layer.styles
 
 
 class WMSResource(ClientResource):
@@ -517,13 +726,14 @@ class WMSResource(ClientResource):
 
     supported_versions = WMS_KNOWN_VERSIONS
 
+    _lazy_layers = False
     _wms_url = None
 
     class Meta:
         case_sensitive_fields = False
         match_fuzzy_keys = True
 
-        deserializer = XMLToJSONSerializer
+        deserializer = StreamingXMLToJSONSerializer
         get_parameters = WMS_DEFAULT_PARAMS
 
     @property
@@ -563,9 +773,15 @@ class WMSResource(ClientResource):
         token=None,
         token_id="token",
         version=None,
+        lazy_layers=False,
         **kwargs,
     ):
-        """ Overridden to do some initialization and capture version and target coordinate reference """
+        """
+        Overridden to do some initialization and capture version and target coordinate reference
+        :param lazy_layers:
+            If True, layers are only indexed by id and position when the service is loaded,
+            and each is populated on first access to any other field: for services with very many layers
+        """
 
         super(WMSResource, self)._get(url, **kwargs)
 
@@ -581,6 +797,9 @@ class WMSResource(ClientResource):
         )  # Populated before resource is loaded, or anytime afterwards if self._lazy
 
         self._spatial_ref = spatial_ref or self.default_spatial_ref
+        self._lazy_layers = lazy_layers
+        # Held while populating layers indexed lazily
+        self._layers_lock = threading.RLock()
         self.styles_color_map = styles_color_map or {}
 
         self._token = token
@@ -649,11 +868,17 @@ class WMSResource(ClientResource):
                 color_map=self.styles_color_map,
                 session=(self._layer_session or self._session),
             )
-            wms_layer.populate_field_values(layer)
+            if self._lazy_layers:
+                wms_layer.index_field_values(layer)
+            else:
+                wms_layer.populate_field_values(layer)
 
             self.root_layers.append(wms_layer)
             self.leaf_layers.update(wms_layer.leaf_layers)
 
+        if not self._lazy_layers:
+            _project_layer_extents(self.root_layers, self.wms_url)
+
         if len(self.root_layers) == 1 and self.root_layers[0].child_layers:
             # If only a single root, parent layer it is equivalent to the dataset itself
             self.root_layers = self.root_layers[0].child_layers
@@ -692,7 +917,13 @@ class WMSResource(ClientResource):
         super(WMSResource, self).populate_field_values(wms_data)
 
         # Union all leaf layer extents in Web Mercator (root layers recursively union leafs)
-        self.full_extent = union_extent(l.full_extent for l in self.root_layers)
+        if not self._lazy_layers:
+            self.full_extent = union_extent(l.full_extent for l in self.root_layers)
+        else:
+            extents = {}
+            for root_layer in self.root_layers:
+                _merge_indexed_extents(extents, root_layer._indexed_extents)
+            self.full_extent = _project_indexed_extents(extents, self.wms_url)
 
     def _populate_ordered_layers(self):
         """ Must be called after root layers and complete nested layer structure have been loaded """
@@ -703,6 +934,166 @@ class WMSResource(ClientResource):
         for root_layer in reversed_layers:
             root_layer._populate_ordered_layers(self._ordered_layers)
 
+        # Query the NcWMS layer endpoint for more data about each leaf layer, all at once since each is slow
+
+        ncwms_layers = [
+            l for l in self._ordered_layers if l.is_ncwms and not l.child_layers
+        ]
+        for layer in ncwms_layers:
+            if not layer._populated_field_values:
+                layer._load_resource()  # Layers indexed lazily, and their parents, are populated in order
+
+        layer_details = map_concurrently(lambda l: l._get_ncwms_layer(), ncwms_layers)
+
+        for layer, ncwms_layer in zip(ncwms_layers, layer_details):
+            if ncwms_layer is not None:
+                layer._populate_ncwms_details(ncwms_layer)
+
+    def get_legend_urls(self, layer_ids=None, styles=None):
+        """
+        :param layer_ids: ids of the leaf layers for which to get legends, or all leaf layers by default
+        :param styles: ids of the styles for which to get legends, or every style of each layer by default
+        :return: the legend URL of each layer style, keyed by (layer id, style id)
+        """
+
+        if not self._populated_field_values:
+            self._load_resource()
+        if self._is_ncwms and not self._ordered_layers:
+            self._populate_ordered_layers()  # NcWMS styles come from the details of each layer
+
+        if layer_ids is None:
+            layer_ids = list(self.leaf_layers)
+        else:
+            layer_ids = wrap_value(layer_ids)
+            missing = [l for l in layer_ids if l not in self.leaf_layers]
+            if missing:
+                raise ValidationError(
+                    "Legends requested for layers not in the WMS service",
+                    layer_ids=missing,
+                    url=self.wms_url,
+                )
+
+        style_ids = None if styles is None else set(wrap_value(styles))
+
+        return {
+            (layer_id, style["id"]): style["legendURL"]
+            for layer_id in layer_ids
+            for style in self.leaf_layers[layer_id].styles or []
+            if style.get("legendURL")
+            and (style_ids is None or style["id"] in style_ids)
+        }
+
+    @instrumented("fetch_legends", timed=True)
+    def fetch_legends(self, layer_ids=None, styles=None, raw=False, deadline=None):
+        """
+        Requests legend graphics concurrently, each distinct legend URL once, reusing any in the legend cache.
+        Layer styles sharing a legend URL share the same image.
+        :param layer_ids: ids of the leaf layers for which to fetch legends, or all leaf layers by default
+        :param styles: ids of the styles for which to fetch legends, or every style of each layer by default
+        :param raw: if True, return a RawImage of each legend as served, rather than a decoded image
+        :param deadline: a Deadline, or number of seconds, within which all legend requests must complete
+        :return: a legend image for each layer style, keyed by (layer id, style id), or None for any that failed
+        """
+
+        deadline = Deadline.from_value(deadline)
+
+        legend_urls = self.get_legend_urls(layer_ids, styles)
+        urls = list(dict.fromkeys(legend_urls.values()))
+
+        fetched = map_concurrently(
+            lambda url: self._skip_legend_errors(self._fetch_legend, url, deadline),
+            urls,
+        )
+        legends = dict(zip(urls, fetched))
+
+        if not raw:
+            with timed_phase("decode"):
+                legends = {
+                    u: l and self._skip_legend_errors(self._decode_legend, u, l)
+                    for u, l in legends.items()
+                }
+
+        return {key: legends[url] for key, url in legend_urls.items()}
+
+    def get_legend_atlas(self, layer_ids=None, styles=None, deadline=None, **kwargs):
+        """
+        Fetches legend graphics as in fetch_legends, and packs each distinct one into a single sprite image
+        :param kwargs: passed to clients.utils.legends.build_legend_atlas
+        :return: a LegendAtlas with legend positions keyed by (layer id, style id)
+        """
+
+        legends = self.fetch_legends(layer_ids, styles, raw=True, deadline=deadline)
+        return build_legend_atlas(legends, **kwargs)
+
+    def _skip_legend_errors(self, get_legend, url, *args):
+        """ :return: the legend from get_legend, or None if it failed, so that one legend does not fail the rest """
+
+        try:
+            return get_legend(url, *args)
+        except (ClientError, requests.exceptions.RequestException) as ex:
+            logger.warning(f"Skipping {self.client_name} legend {url}: {ex}")
+            return None
+
+    def _fetch_legend(self, url, deadline=None):
+        """ :return: a RawImage of the legend graphic at the URL, from the legend cache if requested recently """
+
+        params = {self._token_id: self._token} if self._token else {}
+        cache_key = (url, self._token)
+
+        legend = legend_cache.get(cache_key)
+        if legend is not None:
+            event = RequestEvent(type(self).__name__, "legend", url, cache="hit")
+            instrumentation.emit_request(event.finish())
+            return legend
+
+        try:
+            response = self._make_request(
+                url,
+                params,
+                timeout=30,
+                deadline=deadline,
+                hedge=True,
+                endpoint="legend",
+                cache="miss" if legend_cache.ttl else None,
+            )
+        except (ServiceTimeout, ServiceUnavailable):
+            raise  # Deadline exceeded or host down: not an image error
+        except requests.exceptions.HTTPError as ex:
+            raise HTTPError(
+                "The WMS service legend request did not respond correctly",
+                params=params,
+                underlying=ex,
+                url=url,
+                status_code=getattr(ex.response, "status_code", None),
+            )
+
+        content_type = response.headers.get("content-type", "")
+        if not content_type.startswith("image/"):
+            raise ImageError(
+                f"Unexpected legend format {content_type}",
+                params=params,
+                underlying=response.text,
+                url=url,
+            )
+
+        legend = RawImage(response.content, content_type)
+        legend_cache.add(cache_key, legend)
+
+        return legend
+
+    def _decode_legend(self, url, legend):
+        try:
+            image = legend.to_image()
+            image.load()
+        except (IOError, ValueError) as ex:
+            raise ImageError(
+                "The WMS service did not return a valid legend image",
+                underlying=ex,
+                url=url,
+            )
+        return image
+
+    @instrumented("get_image", timed=True)
     def get_image(
         self,
         extent,
@@ -713,13 +1104,21 @@ class WMSResource(ClientResource):
         time_range=None,
         params=None,
         image_format="png",
+        deadline=None,
+        raw=False,
     ):
         """
         Note: extent aspect ratio must align correctly with image aspect ratio, or this will be warped incorrectly.
         Extent must be in Web Mercator. The caller of this function is expected to pass in valid values.
         Also note: the first layer is the lowest layer in stack, all others render on top
+        :param deadline: a Deadline, or number of seconds, within which all image requests must complete
+        :param raw:
+            If True, return a RawImage: the image bytes as served, unless transparency must be fixed
+            or the image stitched across the anti-meridian, in which case the result is encoded as PNG
         """
 
+        deadline = Deadline.from_value(deadline)  # Shared by both sides of the anti-meridian
+
         if not isinstance(extent, Extent):
             spatial_ref = (
                 getattr(extent, "spatial_reference", None) or self.spatial_reference
@@ -758,6 +1157,8 @@ class WMSResource(ClientResource):
                 time_range,
                 params,
                 image_format,
+                deadline,
+                raw,
             )
 
         # Edge case: mapserver renders badly any global extent raster data that straddles the -180/180 line
@@ -781,12 +1182,14 @@ class WMSResource(ClientResource):
             time_range,
             params,
             image_format,
+            deadline,
         )
-        img.paste(
-            wms_img,
-            (left_side_adjust, 0, left_side_adjust + img_width, img_height),
-            wms_img,
-        )
+        with timed_phase("composite"):
+            img.paste(
+                wms_img,
+                (left_side_adjust, 0, left_side_adjust + img_width, img_height),
+                wms_img,
+            )
 
         # Request other side of meridian, if part of the extent
         if extent.has_negative_extent():
@@ -803,8 +1206,14 @@ class WMSResource(ClientResource):
                 time_range,
                 params,
                 image_format,
+                deadline,
             )
-            img.paste(negative_image, (0, 0), negative_image)
+            with timed_phase("composite"):
+                img.paste(negative_image, (0, 0), negative_image)
+
+        if raw:
+            with timed_phase("encode"):
+                return RawImage.from_image(img, profile=self.encoding_profile)
 
         return img
 
@@ -818,6 +1227,8 @@ class WMSResource(ClientResource):
         time_range,
         params,
         image_format,
+        deadline=None,
+        raw=False,
     ):
 
         if not image_format.startswith("image/"):
@@ -857,7 +1268,13 @@ class WMSResource(ClientResource):
                 # Update from params last in order to override any of the above
                 image_params.update(params)
 
-            response = self._make_request(self.wms_url, image_params, timeout=120)
+            response = self._make_request(
+                self.wms_url,
+                image_params,
+                timeout=120,
+                deadline=deadline,
+                endpoint="export",
+            )
             response_type = response.headers["content-type"]
 
             if response_type != image_format:
@@ -874,21 +1291,41 @@ class WMSResource(ClientResource):
                     url=response.url,
                 )
 
-            img = Image.open(BytesIO(response.content))
-            fix_transparency = False
-            if (
-                img.mode == "RGB" and img.info["transparency"]
-            ):  # PIL does not always correctly detect PNG transparency
-                fix_transparency = True
+            with timed_phase("decode") as phase:
+                phase.bytes = len(response.content)
+
+                img = Image.open(BytesIO(response.content))
+                fix_transparency = False
+                if (
+                    img.mode == "RGB" and img.info["transparency"]
+                ):  # PIL does not always correctly detect PNG transparency
+                    fix_transparency = True
+                    # Replaced below, whether or not this version of PIL applies it on conversion
+                    r, g, b = img.info.pop("transparency")
+                    replace_color = (r, g, b, 255)
+
+                # Only the header has been read: pass the image through untouched if no pixels need to change
+                if raw and not fix_transparency:
+                    return RawImage(response.content, response_type)
+                elif raw:
+                    img.load()  # Encoded again once fixed, so kept in a palette if it has few enough colors
+                else:
+                    img = img.convert("RGBA")
 
-            img = img.convert("RGBA")
             if fix_transparency:
-                r, g, b = img.info["transparency"]
-                replace_color = (r, g, b, 255)
-                make_color_transparent(img, replace_color)
+                with timed_phase("transparency"):
+                    if raw:
+                        img = reduce_to_palette(img)
+                    img = make_color_transparent(img, replace_color, keep_palette=raw)
+
+            if raw:
+                with timed_phase("encode"):
+                    return RawImage.from_image(img, profile=self.encoding_profile)
 
             return img
 
+        except (ServiceTimeout, ServiceUnavailable):
+            raise  # Deadline exceeded or host down: not an image error
         except requests.exceptions.HTTPError as ex:
             raise HTTPError(
                 "The WMS service image query did not respond correctly",